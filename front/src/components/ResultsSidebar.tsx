@@ -11,6 +11,7 @@ import {
 import { Download } from "lucide-react";
 import { Button } from "@/components/ui/button";
 import { useUploadStore } from "@/store/upload";
+import { getApiUrl } from "@/lib/api-config";
 import axios from "axios";
 interface ImageData {
   imageId: string;
@@ -62,6 +63,20 @@ const ResultsSidebar = ({ currentImageData }: ResultsSidebarProps) => {
     }
   };
 
+  // Navigate to the streaming endpoint so the browser writes the ZIP straight to disk
+  const handleDownloadAll = () => {
+    if (!sessionId) {
+      alert("No sessionId found.");
+      return;
+    }
+    const link = document.createElement("a");
+    link.href = getApiUrl(`/api/download-session/${sessionId}`);
+    link.setAttribute("download", `session_${sessionId}.zip`);
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+  };
+
   return (
     <div className="w-full min-h-screen p-2">
       <div className="w-full flex flex-col gap-4">
@@ -75,6 +90,13 @@ const ResultsSidebar = ({ currentImageData }: ResultsSidebarProps) => {
             <Download className="w-4 h-4" />
             Export CSV
           </Button>
+          <Button
+            className="w-full h-12 gap-2 bg-[#0077B6] backdrop-blur-sm border-2 border-white/30 hover:bg-[#0077B6] cursor-pointer rounded-lg"
+            onClick={handleDownloadAll}
+          >
+            <Download className="w-4 h-4" />
+            Download All
+          </Button>
         </div>
         {/* Legends Card */}
         <Card className="bg-white shadow-lg border-0">
@@ -16,7 +16,7 @@ import { Button } from "@/components/ui/button";
 import { useNavigate } from "react-router-dom";
 import { useAuthStore } from "@/store/auth";
 import { useUploadStore } from "@/store/upload";
-import axios from "axios";
+import { uploadFilesChunked } from "@/lib/chunked-upload";
 
 interface ImageFile {
   url: string;
@@ -38,6 +38,7 @@ const ImageUploadDialog = ({
   const [uploadedImages, setUploadedImages] = useState<ImageFile[]>([]);
   const [dragActive, setDragActive] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
+  const [uploadPercent, setUploadPercent] = useState<number | null>(null);
   const { resetSessionTimer } = useUploadStore();
   const { sessionId } = useAuthStore(); // Use auth store session ID
   const navigate = useNavigate();
@@ -105,38 +106,34 @@ const ImageUploadDialog = ({
     setIsUploading(true);
     resetSessionTimer();
     try {
-      // Create FormData and append files
-      const formData = new FormData();
-      uploadedImages.forEach((image) => {
-        formData.append("files", image.file);
-      });
-      formData.append("session_id", sessionId);
+      // Chunked, resumable upload; each file is processed as soon as it arrives
+      const apiResponse = await uploadFilesChunked(
+        sessionId,
+        uploadedImages.map((image) => image.file),
+        ({ sentBytes, totalBytes }) =>
+          setUploadPercent(
+            sentBytes < totalBytes
+              ? Math.floor((sentBytes / totalBytes) * 100)
+              : null
+          )
+      );
 
-      // Use axios instead of fetch to use the configured base URL
-      const response = await axios.post("/api/upload-multiple/", formData, {
-        headers: {
-          "Content-Type": "multipart/form-data",
-        },
-      });
-
-      const apiResponse = response.data;
       // Pass the API response to parent component
       onImageUploaded?.(apiResponse);
-      // Preserve existing session if backend doesn't return one
-      if (apiResponse && apiResponse.sessionId) {
-        // setSessionId(apiResponse.sessionId as string); // This line is removed as per the edit hint
-      } else {
-        resetSessionTimer();
-      }
+      // The session is unchanged by the upload; keep it alive
+      resetSessionTimer();
       setIsOpen(false);
       setUploadedImages([]);
       // Ensure user lands on dashboard after upload
       navigate("/dashboard", { replace: false });
     } catch (error) {
       // console.error("Upload failed:", error);
-      alert("Upload failed. Please try again.");
+      alert(
+        "Upload failed. Please try again; chunks that already arrived will not be sent again."
+      );
     } finally {
       setIsUploading(false);
+      setUploadPercent(null);
     }
   };
 
@@ -271,7 +268,9 @@ const ImageUploadDialog = ({
               <CloudUpload className="w-4 h-4" />
             )}
             {isUploading
-              ? "Predicting..."
+              ? uploadPercent !== null
+                ? `Uploading ${uploadPercent}%...`
+                : "Predicting..."
               : `Predict ${uploadedImages.length} ${uploadedImages.length === 1 ? "Image with AI" : "Images with AI"}`}
           </Button>
         </DialogFooter>
@@ -0,0 +1,173 @@
+import axios from "axios";
+import { getApiConfig } from "./api-config";
+
+// Resumable chunked uploads (see server/services/upload_service.py)
+
+interface UploadFileStatus {
+  index: number;
+  name: string;
+  size: number;
+  chunks: number;
+  missingChunks: number[];
+  complete: boolean;
+  processed: boolean;
+  error?: string | null;
+}
+
+interface UploadStatus {
+  uploadId: string;
+  chunkSize: number;
+  files: UploadFileStatus[];
+  complete: boolean;
+  processed?: boolean;
+  failed?: string[];
+}
+
+export interface ChunkedUploadProgress {
+  sentBytes: number;
+  totalBytes: number;
+}
+
+const PARALLEL_CHUNKS = 3;
+const PROCESSING_POLL_MS = 2000;
+const PROCESSING_MAX_POLLS = 150;
+const RESUME_KEY_PREFIX = "chunked-upload:";
+
+/** Uploads are resumable across reloads for the same session and file selection */
+const resumeKey = (sessionId: string, files: File[]): string =>
+  RESUME_KEY_PREFIX +
+  sessionId +
+  ":" +
+  files.map((f) => `${f.name}/${f.size}/${f.lastModified}`).join("|");
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+const sha256Hex = async (data: ArrayBuffer): Promise<string | undefined> => {
+  // crypto.subtle is only available in secure contexts; the checksum is optional
+  if (!window.crypto?.subtle) return undefined;
+  const digest = await window.crypto.subtle.digest("SHA-256", data);
+  return [...new Uint8Array(digest)]
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("");
+};
+
+const isRetryable = (error: unknown): boolean => {
+  if (!axios.isAxiosError(error)) return false;
+  // Network errors and server-side failures are retried, rejected chunks and a
+  // full session store (507) are not
+  return (
+    !error.response ||
+    (error.response.status >= 500 && error.response.status !== 507)
+  );
+};
+
+const withRetry = async <T>(fn: () => Promise<T>): Promise<T> => {
+  const { retryAttempts } = getApiConfig();
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await fn();
+    } catch (error) {
+      if (attempt >= retryAttempts || !isRetryable(error)) throw error;
+      await sleep(1000 * 2 ** attempt);
+    }
+  }
+};
+
+const getStatus = async (
+  sessionId: string,
+  uploadId: string
+): Promise<UploadStatus | null> => {
+  try {
+    const response = await axios.get(`/api/uploads/${sessionId}/${uploadId}`);
+    return response.data;
+  } catch (error) {
+    if (axios.isAxiosError(error) && error.response?.status === 404) return null;
+    throw error;
+  }
+};
+
+/**
+ * Upload files in chunks, resuming a previous interrupted upload of the same
+ * selection if the server still has it. The server starts processing each file
+ * as soon as its last chunk arrives; this resolves once all files are processed
+ * or have failed (listed in `failed`), or after about five minutes of waiting
+ * for the last ones.
+ */
+export const uploadFilesChunked = async (
+  sessionId: string,
+  files: File[],
+  onProgress?: (progress: ChunkedUploadProgress) => void
+): Promise<UploadStatus> => {
+  const key = resumeKey(sessionId, files);
+  const previousId = localStorage.getItem(key);
+  let status = previousId ? await getStatus(sessionId, previousId) : null;
+  if (!status) {
+    const response = await withRetry(() =>
+      axios.post(`/api/uploads/${sessionId}`, {
+        files: files.map((f) => ({ name: f.name, size: f.size })),
+      })
+    );
+    status = {
+      ...response.data,
+      files: response.data.files.map((f: UploadFileStatus) => ({
+        ...f,
+        missingChunks: [...Array(f.chunks).keys()],
+      })),
+    } as UploadStatus;
+    localStorage.setItem(key, status.uploadId);
+  }
+
+  const { uploadId, chunkSize } = status;
+  const totalBytes = files.reduce((sum, f) => sum + f.size, 0);
+  const pending: { file: File; index: number; offset: number }[] = [];
+  status.files.forEach((fileStatus) => {
+    fileStatus.missingChunks.forEach((chunk) =>
+      pending.push({
+        file: files[fileStatus.index],
+        index: fileStatus.index,
+        offset: chunk * chunkSize,
+      })
+    );
+  });
+  let sentBytes =
+    totalBytes -
+    pending.reduce(
+      (sum, c) => sum + Math.min(chunkSize, c.file.size - c.offset),
+      0
+    );
+  onProgress?.({ sentBytes, totalBytes });
+
+  const sendNext = async (): Promise<void> => {
+    for (let next = pending.shift(); next; next = pending.shift()) {
+      const { file, index, offset } = next;
+      const data = await file.slice(offset, offset + chunkSize).arrayBuffer();
+      const checksum = await sha256Hex(data);
+      await withRetry(() =>
+        axios.put(`/api/uploads/${sessionId}/${uploadId}/${index}`, data, {
+          params: { offset },
+          headers: {
+            "Content-Type": "application/octet-stream",
+            ...(checksum ? { "X-Chunk-SHA256": checksum } : {}),
+          },
+        })
+      );
+      sentBytes += data.byteLength;
+      onProgress?.({ sentBytes, totalBytes });
+    }
+  };
+  await Promise.all(
+    Array.from({ length: Math.min(PARALLEL_CHUNKS, pending.length) }, sendNext)
+  );
+
+  let result: UploadStatus = status;
+  for (let poll = 0; poll < PROCESSING_MAX_POLLS; poll++) {
+    const response = await withRetry(() =>
+      axios.post(`/api/uploads/${sessionId}/${uploadId}/finalize`)
+    );
+    result = response.data;
+    localStorage.removeItem(key);
+    if (result.processed) break;
+    await sleep(PROCESSING_POLL_MS);
+  }
+  return result;
+};
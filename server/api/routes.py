@@ -1,129 +1,327 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Header, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from pathlib import Path
-from datetime import datetime, timedelta
-import shutil
+from datetime import datetime
 import json
 import logging
 import io
-import csv
-import re
-from typing import List
-from core.config import BASE_DIR
-from schemas.request import MoveImageRequest
-def _run_model_on_images_lazy():
-    from services.model_service import run_model_on_images  # type: ignore
-    return run_model_on_images
+import asyncio
+import secrets
+from typing import List, Optional
+from core.config import BASE_DIR, BACKFILL_CHUNK_SIZE, ARCHIVE_BATCH_SIZE, MODEL_ADMIN_TOKEN
+from schemas.request import CreateUploadRequest, LoadModelRequest, MoveImageRequest, ReprocessRequest
+from services.archive_service import BodyStream, start_archive_stream
+from services.upload_service import (
+    UploadError,
+    UploadNotFound,
+    create_upload,
+    finalize_upload,
+    upload_status,
+    write_chunk,
+)
+from services.export_service import stream_session_zip
+from services.model_registry import RegistryError
+from services.inference_scheduler import SchedulerBusy, gather_image_slices, scheduler, submit_image_slices
+from services.storage_service import StorageFull, storage
+from services.trash_service import trash_session
+from services.dedup_service import forget_image
+from services.detection_store import RAW_STORE_DIRNAME, DetectionStore
+from services.postprocess import ORIGINALS_DIRNAME, PostprocessParams
+from services.reprocess_service import reprocess_session
+from services import image_index, session_query
+from services.backfill_service import BackfillRunning, cancel_backfill, get_backfill_status, start_backfill
+from services.metadata_service import (
+    load_metadata,
+    save_metadata,
+    session_lock,
+    write_metadata_csv,
+)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 SESSION_TIMEOUT_MINUTES = 15
 
-def extract_captured_date(image_name: str) -> str:
-    """
-    Extract captured date from image filename.
-    Looks for pattern _YYYYMMDD in the filename.
-    Returns formatted date or 'N/A' if not found.
-    """
-    # Regular expression to match the pattern after first underscore with 8 digits (assumed to be YYYYMMDD)
-    match = re.search(r'_(\d{8})', image_name)
-    
-    if not match:
-        return "N/A"
-    
-    raw_date = match.group(1)
-    year = raw_date[:4]
-    month = raw_date[4:6]
-    day = raw_date[6:8]
-    
-    # Basic date validation
-    try:
-        date_object = datetime(int(year), int(month), int(day))
-        return f"{day}/{month}/{year}"
-    except ValueError:
-        return "N/A"
+
+def busy_response(error: SchedulerBusy) -> HTTPException:
+    """429 telling the client when the inference backlog should have room again."""
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)})
 
 
+def storage_full_response(error: StorageFull) -> HTTPException:
+    """507: the session store budget has no room for the upload even after eviction."""
+    return HTTPException(status_code=507, detail=str(error))
+
+
+def require_admin(token: Optional[str]) -> None:
+    """Model administration needs the X-Admin-Token header to match MODEL_ADMIN_TOKEN."""
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model administration is disabled")
+    if not token or not secrets.compare_digest(token, MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
 class BackfillResponse(BaseModel):
     message: str
     added_files: List[str]
+    job: Optional[dict] = None
 
 
 @router.post("/upload-multiple/")
 async def upload_multiple(session_id: str = Form(...), files: List[UploadFile] = File(...)):
     """Upload multiple images to a local session folder and run detection."""
     try:
-        session_dir = BASE_DIR / session_id / "images"
-        session_dir.mkdir(parents=True, exist_ok=True)
+        with await asyncio.to_thread(scheduler.admit, len(files)):
+            await asyncio.to_thread(storage.ensure_space, sum(file.size or 0 for file in files), session_id)
+            session_dir = BASE_DIR / session_id / "images"
+            session_dir.mkdir(parents=True, exist_ok=True)
+
+            saved_paths = []
+            for file in files:
+                file_path = session_dir / file.filename
+                with open(file_path, "wb") as buffer:
+                    buffer.write(await file.read())
+                saved_paths.append(file_path)
+
+            # Run detection in fair-queued slices (models are imported lazily to avoid heavy startup costs)
+            batch_report = {}
+            slices = await asyncio.to_thread(submit_image_slices, session_id, saved_paths, True, batch_report)
+        summary = await gather_image_slices(slices, batch_report)
 
-        metadata_path = BASE_DIR / session_id / "session_metadata.json"
-        if metadata_path.exists():
-            with open(metadata_path, "r") as f:
-                metadata = json.load(f)
-        else:
-            metadata = {"images": {}}
-
-        saved_paths = []
-        file_names = []
-        for file in files:
-            file_path = session_dir / file.filename
-            with open(file_path, "wb") as buffer:
-                buffer.write(await file.read())
-            saved_paths.append(file_path)
-            file_names.append(file.filename)
-
-        # Run detection in batch (lazy import to avoid heavy startup costs)
-        run_model_on_images = _run_model_on_images_lazy()
-        results = run_model_on_images(saved_paths, session_id)
-        for filename, (dugong_count, calf_count, image_class, _) in zip(file_names, results):
-            metadata["images"][filename] = {
-                "dugongCount": dugong_count,
-                "motherCalfCount": calf_count,
-                "totalCount": dugong_count + (2 * calf_count),
-                "imageClass": image_class.capitalize(),
-                "capturedDate": extract_captured_date(filename),
-                "uploadedAt": datetime.utcnow().isoformat()
-            }
-
-        metadata["last_activity"] = datetime.utcnow().isoformat()
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f, indent=4)
-
-        return {"message": f"Uploaded {len(files)} files and updated session metadata."}
+        return {
+            "message": f"Uploaded {len(files)} files and updated session metadata.",
+            "duplicates": summary["duplicates"],
+            "batching": batch_report
+        }
 
+    except SchedulerBusy as e:
+        raise busy_response(e)
+    except StorageFull as e:
+        raise storage_full_response(e)
     except Exception as e:
         logger.error(f"[Error in upload-multiple] {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/upload-archive/{session_id}")
+async def upload_archive(session_id: str, request: Request, batch_size: int = ARCHIVE_BATCH_SIZE):
+    """
+    Upload a single ZIP or TAR (optionally compressed) archive as the raw request body.
+    The archive is extracted while it streams in and detection runs on each batch
+    of extracted images without waiting for the upload to finish.
+    """
+    try:
+        if batch_size < 1:
+            raise HTTPException(status_code=400, detail="batch_size must be positive")
+        # One batch is reserved for as long as the archive streams in
+        with await asyncio.to_thread(scheduler.admit, batch_size):
+            # Images in archives barely compress, so the body size is a fair estimate of what is extracted
+            await asyncio.to_thread(storage.ensure_space, int(request.headers.get("content-length", 0)), session_id)
+
+            stream = BodyStream()
+            extraction = asyncio.wrap_future(start_archive_stream(stream, session_id, batch_size))
+            try:
+                async for chunk in request.stream():
+                    if not stream.try_feed(chunk):
+                        await asyncio.to_thread(stream.feed, chunk)
+            finally:
+                await asyncio.to_thread(stream.finish)
+            summary = await extraction
+
+        if not summary["extracted"] and summary["errors"]:
+            raise HTTPException(status_code=400, detail=f"Could not extract archive: {summary['errors'][0]}")
+
+        return {
+            "message": f"Extracted {len(summary['extracted'])} images and processed {len(summary['processed'])}.",
+            **summary
+        }
+
+    except HTTPException:
+        raise
+    except SchedulerBusy as e:
+        raise busy_response(e)
+    except StorageFull as e:
+        raise storage_full_response(e)
+    except Exception as e:
+        logger.error(f"[Error in upload-archive] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/uploads/{session_id}")
+async def create_chunked_upload(session_id: str, request: CreateUploadRequest):
+    """
+    Start a resumable upload: announce file names and sizes, then PUT each file's
+    chunks to /uploads/{session_id}/{upload_id}/{file_index}?offset=... and
+    finalize. Each file is processed as soon as its last chunk arrives.
+    """
+    try:
+        # Files may arrive much later and at other server workers, so the reservation ends once the upload is registered
+        with await asyncio.to_thread(scheduler.admit, len(request.files)):
+            await asyncio.to_thread(storage.ensure_space, sum(f.size for f in request.files), session_id)
+            return await asyncio.to_thread(
+                create_upload, session_id, [(f.name, f.size) for f in request.files], request.chunkSize
+            )
+    except SchedulerBusy as e:
+        raise busy_response(e)
+    except StorageFull as e:
+        raise storage_full_response(e)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"[Error in create-upload] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.put("/uploads/{session_id}/{upload_id}/{file_index}")
+async def put_upload_chunk(session_id: str, upload_id: str, file_index: int, offset: int, request: Request):
+    """
+    Store one chunk (raw request body) at `offset` of a file. Re-sending a chunk
+    that already arrived is acknowledged without rewriting it. An optional
+    X-Chunk-SHA256 header is verified before the chunk is stored.
+    """
+    try:
+        data = await request.body()
+        return await asyncio.to_thread(
+            write_chunk, session_id, upload_id, file_index, offset, data,
+            request.headers.get("x-chunk-sha256"),
+        )
+    except UploadNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"[Error in upload-chunk] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/uploads/{session_id}/{upload_id}")
+async def get_upload_status(session_id: str, upload_id: str):
+    """Missing chunks per file (to resume an interrupted upload) and processing progress."""
+    try:
+        return await asyncio.to_thread(upload_status, session_id, upload_id)
+    except UploadNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"[Error in upload-status] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/uploads/{session_id}/{upload_id}/finalize")
+async def finalize_chunked_upload(session_id: str, upload_id: str):
+    """
+    Close a fully received upload (409 lists the chunks still missing). Returns
+    processed=false while inference of its files is still running; poll again.
+    Files inference failed on are listed in `failed`, with the error per file.
+    """
+    try:
+        status = await asyncio.to_thread(finalize_upload, session_id, upload_id)
+        if not status["complete"]:
+            raise HTTPException(status_code=409, detail=status)
+        return status
+    except HTTPException:
+        raise
+    except UploadNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"[Error in finalize-upload] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/session-status/{session_id}")
-async def session_status(session_id: str):
-    """Check session status locally."""
+async def session_status(
+    session_id: str,
+    request: Request,
+    page: int = 1,
+    page_size: Optional[int] = None,
+    image_class: Optional[str] = None,
+    count_field: str = "totalCount",
+    min_count: Optional[int] = None,
+    max_count: Optional[int] = None,
+    captured_from: Optional[str] = None,
+    captured_to: Optional[str] = None,
+    sort_by: Optional[str] = None,
+    order: str = "asc",
+):
+    """
+    Check session status locally.
+
+    Without query parameters the full image table is returned as before. Filters,
+    sorting and page/page_size select a subset; metadata.images then holds just
+    that page (in sort order) and `pagination` describes the full selection.
+    Responses carry an ETag derived from the metadata file, so pollers sending
+    If-None-Match get a 304 without the file being read or re-serialised.
+    timeRemaining is only as fresh as the last change; use /session-time-remaining
+    for a live countdown.
+    """
     try:
         session_dir = BASE_DIR / session_id
         if not session_dir.exists():
             raise HTTPException(status_code=404, detail="Session not found")
 
-        metadata_path = session_dir / "session_metadata.json"
-        if not metadata_path.exists():
+        version = session_query.metadata_version(session_dir)
+        if version is None:
             raise HTTPException(status_code=404, detail="Metadata not found")
 
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
+        if page < 1 or (page_size is not None and not 1 <= page_size <= session_query.MAX_PAGE_SIZE):
+            raise HTTPException(
+                status_code=400,
+                detail=f"page must be >= 1 and page_size between 1 and {session_query.MAX_PAGE_SIZE}",
+            )
+        if count_field not in session_query.COUNT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"count_field must be one of {session_query.COUNT_FIELDS}")
+        if sort_by and sort_by not in session_query.SORT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"sort_by must be one of {session_query.SORT_FIELDS}")
+        if order not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+
+        query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+        etag = session_query.make_etag(version, query)
+        # no-cache makes browsers revalidate every poll instead of reusing a stale copy
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if session_query.etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        metadata = session_query.load_metadata_cached(session_dir, version)
+        items = session_query.filter_images(
+            metadata["images"], image_class, count_field, min_count, max_count, captured_from, captured_to
+        )
+        items = session_query.sort_images(items, sort_by, order == "desc")
+        page_items, pagination = session_query.paginate(items, page, page_size)
+
+        body = {
+            "timeRemaining": session_query.time_remaining(metadata, SESSION_TIMEOUT_MINUTES),
+            "metadata": {**metadata, "images": dict(page_items)},
+            "pagination": pagination,
+        }
+        return Response(content=json.dumps(body), media_type="application/json", headers=headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"[Error in session-status] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        last_activity = datetime.fromisoformat(metadata.get("last_activity"))
-        time_elapsed = datetime.utcnow() - last_activity
-        time_remaining = max(timedelta(minutes=SESSION_TIMEOUT_MINUTES) - time_elapsed, timedelta())
 
+@router.get("/session-time-remaining/{session_id}")
+async def session_time_remaining(session_id: str):
+    """Seconds until a session expires, without returning its image table."""
+    try:
+        session_dir = BASE_DIR / session_id
+        version = session_query.metadata_version(session_dir)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+        metadata = session_query.load_metadata_cached(session_dir, version)
         return {
-            "timeRemaining": int(time_remaining.total_seconds()),
-            "metadata": metadata
+            "timeRemaining": session_query.time_remaining(metadata, SESSION_TIMEOUT_MINUTES),
+            "lastActivity": metadata.get("last_activity"),
+            "imageCount": len(metadata["images"]),
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"[Error in session-status] {e}")
+        logger.error(f"[Error in session-time-remaining] {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -156,7 +354,11 @@ async def cleanup_session_by_id(session_id: str):
         if not session_dir.is_dir():
             raise HTTPException(status_code=400, detail=f"{session_id} is not a directory")
 
-        shutil.rmtree(session_dir)
+        # Atomic rename into the trash; the files are removed in the background
+        if not await asyncio.to_thread(trash_session, session_id):
+            return {"message": f"Session {session_id} not found"}
+        session_query.forget_session(session_dir)
+        storage.forget(session_id)
 
         # Also remove the session_id from any user documents that might have it
         from auth.login import client, user_collection
@@ -194,18 +396,13 @@ async def cleanup_session_beacon(session_id: str = Form(...), source: str = Form
             logger.warning(f"[Beacon Cleanup] {session_id} is not a directory")
             return {"message": f"{session_id} is not a directory"}
 
-        # Log what we're about to delete
-        logger.info(f"[Beacon Cleanup] About to delete session directory: {session_dir}")
-        logger.info(f"[Beacon Cleanup] Directory contents before deletion:")
-        try:
-            for item in session_dir.rglob('*'):
-                logger.info(f"[Beacon Cleanup]   {item}")
-        except Exception as e:
-            logger.warning(f"[Beacon Cleanup] Could not list directory contents: {e}")
-
-        # Delete the session directory
-        shutil.rmtree(session_dir)
-        logger.info(f"[Beacon Cleanup] Successfully deleted session directory: {session_id}")
+        # Move the session directory to the trash (atomic, done before the tab unloads)
+        if not await asyncio.to_thread(trash_session, session_id):
+            logger.info(f"[Beacon Cleanup] Session {session_id} was already deleted")
+            return {"message": f"Session {session_id} not found"}
+        session_query.forget_session(session_dir)
+        storage.forget(session_id)
+        logger.info(f"[Beacon Cleanup] Moved session directory to trash: {session_id}")
 
         # Verify deletion
         if session_dir.exists():
@@ -272,53 +469,88 @@ async def cleanup_session_beacon(session_id: str = Form(...), source: str = Form
 
 
 @router.post("/backfill-detections/{session_id}")
-async def backfill_detections(session_id: str):
-    """Run detection on any missing local images and update metadata."""
+async def backfill_detections(session_id: str, chunk_size: int = BACKFILL_CHUNK_SIZE):
+    """Start (or resume) a background job running detection on missing local images."""
     try:
-        session_dir = BASE_DIR / session_id / "images"
         metadata_path = BASE_DIR / session_id / "session_metadata.json"
 
         if not metadata_path.exists():
             raise HTTPException(status_code=404, detail="Session metadata not found.")
 
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
+        if chunk_size < 1:
+            raise HTTPException(status_code=400, detail="chunk_size must be positive")
 
-        processed_files = set(metadata.get("images", {}).keys())
-        all_files = {f.name for f in session_dir.iterdir() if f.is_file()}
-        missing_files = all_files - processed_files
+        job = await start_backfill(session_id, chunk_size)
+        if not job.files:
+            return BackfillResponse(message="No missing files to backfill.", added_files=[], job=job.to_dict())
 
-        if not missing_files:
-            return BackfillResponse(message="No missing files to backfill.", added_files=[])
+        return BackfillResponse(
+            message=f"Backfilling {len(job.files)} missing files in the background.",
+            added_files=job.added_files,
+            job=job.to_dict()
+        )
+
+    except HTTPException:
+        raise
+    except SchedulerBusy as e:
+        raise busy_response(e)
+    except BackfillRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"[Error in backfill-detections] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        missing_paths = [session_dir / fname for fname in missing_files]
-        run_model_on_images = _run_model_on_images_lazy()
-        results = run_model_on_images(missing_paths, session_id)
 
-        for file_name, (dugong_count, calf_count, image_class, _) in zip(missing_files, results):
-            total_count = dugong_count + 2 * calf_count
-            metadata["images"][file_name] = {
-                "dugongCount": dugong_count,
-                "motherCalfCount": calf_count,
-                "totalCount": total_count,
-                "imageClass": image_class.capitalize(),
-                "capturedDate": extract_captured_date(file_name),
-                "uploadedAt": datetime.utcnow().isoformat()
-            }
+@router.post("/reprocess-session/{session_id}")
+async def reprocess_session_route(session_id: str, request: ReprocessRequest):
+    """
+    Re-apply post-processing (confidence/IoU thresholds, dynamic NMS bounds, nested
+    box overlap) to every image of a session from cached raw detections, without
+    running the models. Omitted fields keep the session's current settings;
+    reset=true starts from the defaults.
+    """
+    try:
+        session_dir = BASE_DIR / session_id
+        if not (session_dir / "session_metadata.json").exists():
+            raise HTTPException(status_code=404, detail="Session metadata not found.")
+        if not (session_dir / RAW_STORE_DIRNAME).exists():
+            raise HTTPException(
+                status_code=409,
+                detail="This session has no cached raw detections; it was processed before re-thresholding was available.",
+            )
 
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f, indent=4)
+        base = {} if request.reset else load_metadata(session_dir).get("postprocess") or {}
+        params = PostprocessParams.from_dict({**base, **request.dict(exclude={"reset"}, exclude_none=True)})
+        if params.nms_iou_min > params.nms_iou_max:
+            raise HTTPException(status_code=400, detail="nms_iou_min must not exceed nms_iou_max")
 
-        return BackfillResponse(
-            message=f"Backfilled {len(missing_files)} missing files.",
-            added_files=list(missing_files)
-        )
+        return await asyncio.to_thread(reprocess_session, session_id, params)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"[Error in backfill-detections] {e}")
+        logger.error(f"[Error in reprocess-session] {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/backfill-status/{session_id}")
+async def backfill_status(session_id: str):
+    """Report progress of the session's backfill job."""
+    status = get_backfill_status(session_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="No backfill job for this session")
+    return status
+
+
+@router.delete("/backfill-detections/{session_id}")
+async def cancel_backfill_detections(session_id: str):
+    """Cancel a running backfill after its current chunk; completed chunks are kept."""
+    status = await asyncio.to_thread(cancel_backfill, session_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="No backfill job for this session")
+    return {"message": f"Backfill for {session_id} is {status['status']}", "job": status}
+
+
 @router.delete("/delete-image/{session_id}/{image_name}")
 async def delete_image(session_id: str, image_name: str):
     """Delete an image from the session folder and remove it from metadata."""
@@ -334,28 +566,33 @@ async def delete_image(session_id: str, image_name: str):
         if not metadata_path.exists():
             raise HTTPException(status_code=404, detail="Session metadata not found")
 
-        # Load metadata
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
+        with session_lock(session_dir):
+            # Load metadata
+            metadata = load_metadata(session_dir)
 
-        # Check if image exists in metadata
-        if image_name not in metadata.get("images", {}):
-            raise HTTPException(status_code=404, detail="Image not found in metadata")
+            # Check if image exists in metadata
+            if image_name not in metadata["images"]:
+                raise HTTPException(status_code=404, detail="Image not found in metadata")
 
-        # Delete the image file if it exists
-        if image_path.exists():
-            image_path.unlink()
-            logger.info(f"Deleted image file: {image_path}")
+            # Delete the image file if it exists
+            if image_path.exists():
+                image_path.unlink()
+                logger.info(f"Deleted image file: {image_path}")
+            (session_dir / ORIGINALS_DIRNAME / image_name).unlink(missing_ok=True)
 
-        # Remove from metadata
-        del metadata["images"][image_name]
-        
-        # Update last activity
-        metadata["last_activity"] = datetime.utcnow().isoformat()
+            # Remove from metadata
+            del metadata["images"][image_name]
+
+            # Update last activity
+            metadata["last_activity"] = datetime.utcnow().isoformat()
 
-        # Save updated metadata
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f, indent=4)
+            # Save updated metadata
+            save_metadata(session_dir, metadata)
+
+        image_index.remove_image(session_id, image_name)
+        forget_image(session_dir, image_name)
+        DetectionStore(session_dir).remove(image_name)
+        DetectionStore(session_dir, RAW_STORE_DIRNAME).remove(image_name)
 
         logger.info(f"Deleted image {image_name} from session {session_id}")
         return {"message": f"Image {image_name} deleted successfully"}
@@ -378,21 +615,7 @@ async def export_session_csv(session_id: str):
             metadata = json.load(f)
 
         output = io.StringIO()
-        writer = None
-
-        for image_name, data in metadata.get("images", {}).items():
-            row = {"IMAGE_NAME": image_name, **{k.upper(): v for k, v in data.items()}}
-            if "TOTALCOUNT" not in row:
-                row["TOTALDUGONGCOUNT"] = row.get("DUGONGCOUNT", 0) + 2 * row.get("MOTHERCALFCOUNT", 0)
-            
-            # Ensure captured date is included, default to "N/A" if not present
-            if "CAPTUREDDATE" not in row:
-                row["CAPTUREDDATE"] = extract_captured_date(image_name)
-
-            if writer is None:
-                writer = csv.DictWriter(output, fieldnames=row.keys())
-                writer.writeheader()
-            writer.writerow(row)
+        write_metadata_csv(metadata, output)
 
         output.seek(0)
         return StreamingResponse(
@@ -404,3 +627,127 @@ async def export_session_csv(session_id: str):
     except Exception as e:
         logger.error(f"[Error in export-session-csv] {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+
+@router.get("/download-session/{session_id}")
+async def download_session(session_id: str):
+    """Stream a ZIP of annotated images, YOLO labels and the CSV for a session."""
+    session_dir = BASE_DIR / session_id
+    if not (session_dir / "session_metadata.json").exists():
+        raise HTTPException(status_code=404, detail="Session metadata not found.")
+
+    return StreamingResponse(
+        stream_session_zip(session_dir),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename={session_id}.zip",
+            # Let nginx pass chunks straight through instead of spooling the archive
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+
+
+@router.get("/image-index/search")
+async def search_image_index(
+    min_lat: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    min_lon: Optional[float] = None,
+    max_lon: Optional[float] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: int = 1000,
+):
+    """
+    Find images (and summed counts) across live sessions within a GPS bounding box
+    and/or capture date range. Dates are ISO (YYYY-MM-DD or full timestamps).
+    """
+    try:
+        for value in (start_date, end_date):
+            if value:
+                datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO formatted (YYYY-MM-DD)")
+
+    try:
+        return image_index.search(min_lat, max_lat, min_lon, max_lon, start_date, end_date, limit)
+    except Exception as e:
+        logger.error(f"[Error in image-index search] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/aggregates")
+async def get_aggregates(session_id: Optional[str] = None):
+    """
+    Running totals (images, dugong/mother-calf/total counts, feeding vs resting)
+    for one session or across all live sessions, broken down by captured date.
+    Served from incrementally maintained tables, so the cost does not grow with
+    the number of images.
+    """
+    try:
+        return image_index.aggregates(session_id)
+    except Exception as e:
+        logger.error(f"[Error in aggregates] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/scheduler-metrics")
+async def scheduler_metrics():
+    """Inference queue depth per session, queue-wait percentiles and admission counters (this worker)."""
+    return scheduler.metrics()
+
+
+@router.get("/storage-usage")
+async def storage_usage():
+    """Session store usage by session and artifact type, the budget and eviction counters."""
+    try:
+        return await asyncio.to_thread(storage.report)
+    except Exception as e:
+        logger.error(f"[Error in storage-usage] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/models")
+async def model_status(x_admin_token: Optional[str] = Header(None)):
+    """Active model version, the candidate with its shadow comparison, and promotion history."""
+    require_admin(x_admin_token)
+    from services.model_service import registry
+    return registry.status()
+
+
+@router.post("/models/candidate", status_code=202)
+async def load_model_candidate(request: LoadModelRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Load a new model version in the background while the active one keeps serving.
+    With shadowFraction > 0 the candidate also runs on that fraction of live
+    batches; GET /models compares its counts, classes and latency with the active model.
+    """
+    require_admin(x_admin_token)
+    from services.model_service import registry
+    try:
+        return registry.load_candidate(request.detector, request.classifier, request.version, request.shadowFraction)
+    except RegistryError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/models/promote")
+async def promote_model_candidate(x_admin_token: Optional[str] = Header(None)):
+    """Swap the candidate in (once loaded); in-flight work finishes on the previous version."""
+    require_admin(x_admin_token)
+    from services.model_service import registry
+    try:
+        return registry.promote()
+    except RegistryError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.delete("/models/candidate")
+async def discard_model_candidate(x_admin_token: Optional[str] = Header(None)):
+    """Drop the candidate without promoting it."""
+    require_admin(x_admin_token)
+    from services.model_service import registry
+    try:
+        return registry.discard()
+    except RegistryError as e:
+        raise HTTPException(status_code=409, detail=str(e))
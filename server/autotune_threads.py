@@ -0,0 +1,83 @@
+# Thread-count auto-tuning for inference
+"""
+Sweeps torch intra-op and OpenCV thread counts against a sample batch of
+survey images and saves the fastest setting to THREAD_CONFIG_PATH, where
+core/cpu_topology.py picks it up at startup (as an upper bound per worker).
+
+Usage (from the `server/` directory):
+    python autotune_threads.py ./samples --repeats 3
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import List
+
+from core.config import ALLOWED_EXTENSIONS, THREAD_CONFIG_PATH
+from core.cpu_topology import available_cpus, plan_threads, set_thread_env
+
+
+def candidate_thread_counts(cpus: int) -> List[int]:
+    """Powers of two up to the CPU count, plus the CPU count itself."""
+    counts = {cpus}
+    n = 1
+    while n < cpus:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+def time_setting(images: List[Path], torch_threads: int, opencv_threads: int, repeats: int) -> float:
+    """Return the best seconds-per-image over `repeats` runs of detector + classifier."""
+    import cv2
+    import torch
+    from services.model_service import classification_model, detect_batch
+
+    torch.set_num_threads(torch_threads)
+    cv2.setNumThreads(opencv_threads)
+    detect_batch(images[:1])  # warm-up at this thread count
+
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        detect_batch(images)
+        for path in images:
+            classification_model.predict(path, save=False, verbose=False)
+        best = min(best, (time.perf_counter() - start) / len(images))
+    return best
+
+
+def autotune(images: List[Path], repeats: int, output: Path) -> dict:
+    cpus = available_cpus()
+    counts = candidate_thread_counts(cpus)
+    print(f"{cpus} usable CPUs; sweeping torch threads {counts} x OpenCV threads {[1, cpus]}")
+
+    trials = []
+    for torch_threads in counts:
+        for opencv_threads in sorted({1, cpus}):
+            seconds = time_setting(images, torch_threads, opencv_threads, repeats)
+            trials.append({"torchThreads": torch_threads, "opencvThreads": opencv_threads, "secondsPerImage": seconds})
+            print(f"torch={torch_threads:<3} opencv={opencv_threads:<3} {seconds * 1000:8.1f} ms/image")
+
+    best = min(trials, key=lambda t: t["secondsPerImage"])
+    config = {"cpus": cpus, **best, "sampleImages": len(images), "trials": trials}
+    output.write_text(json.dumps(config, indent=2))
+    print(f"Fastest: torch={best['torchThreads']} opencv={best['opencvThreads']} "
+          f"({best['secondsPerImage'] * 1000:.1f} ms/image) -> saved to {output}")
+    return config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the fastest inference thread settings for this machine")
+    parser.add_argument("images_dir", type=Path, help="Directory with a representative sample batch")
+    parser.add_argument("--limit", type=int, default=8, help="Images in the sample batch")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=THREAD_CONFIG_PATH)
+    args = parser.parse_args()
+
+    sample = sorted(p for p in args.images_dir.iterdir() if p.suffix.lower() in ALLOWED_EXTENSIONS)[:args.limit]
+    if not sample:
+        raise SystemExit(f"No images found in {args.images_dir}")
+    # Let OpenMP start with every usable CPU so all swept counts are reachable
+    set_thread_env(plan_threads(1)._replace(torch_threads=available_cpus()))
+    autotune(sample, args.repeats, args.output)
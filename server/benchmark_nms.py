@@ -0,0 +1,132 @@
+# Benchmark of batched vs per-image detection post-processing
+"""
+Times the post-processing chain (confidence threshold, class-aware NMS,
+size-adaptive NMS, nested box removal) run image by image with
+apply_postprocess against postprocess_batch over whole uploads, and checks
+that the batched path reproduces the per-image output exactly, both
+class-agnostic and class-aware.
+
+Raw detections come from a processed session's `detections_raw/` store or,
+by default, from synthetic survey frames (clusters of overlapping candidate
+boxes per animal, a mix of small distant and large close-up animals, some
+mother-calf pairs).
+
+Usage (from the `server/` directory):
+    python benchmark_nms.py --batch-sizes 8 32 128 --repeats 5
+    python benchmark_nms.py --session /tmp/uploads/<session_id>
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+import torch
+
+from services.detection_store import RAW_STORE_DIRNAME, DetectionStore, ImageDetections
+from services.postprocess import PostprocessParams, apply_postprocess, postprocess_batch
+
+
+def synthetic_frame(rng: np.random.Generator, index: int, width: int = 4000, height: int = 3000) -> ImageDetections:
+    """Raw detector output for one frame, as cached with RAW_CONF/RAW_IOU."""
+    animals = int(rng.integers(0, 40))
+    size = float(rng.choice([20, 45, 90, 160]))  # altitude sets a roughly common scale
+    boxes, scores, classes = [], [], []
+    for _ in range(animals):
+        cx, cy = rng.uniform(size, width - size), rng.uniform(size, height - size)
+        w, h = size * rng.uniform(0.7, 1.4), size * rng.uniform(0.5, 1.0)
+        cls = int(rng.random() < 0.15)
+        if cls == 1:
+            w, h = w * 1.6, h * 1.4
+        # The detector proposes several jittered boxes per animal
+        for _ in range(int(rng.integers(3, 12))):
+            jitter = rng.normal(0, 0.08 * size, 4)
+            boxes.append([cx - w / 2 + jitter[0], cy - h / 2 + jitter[1], cx + w / 2 + jitter[2], cy + h / 2 + jitter[3]])
+            scores.append(rng.uniform(0.05, 0.95))
+            classes.append(cls if rng.random() > 0.1 else 1 - cls)
+        if cls == 1 and rng.random() < 0.5:
+            # Dugong box around part of the pair, to be removed as nested
+            boxes.append([cx - w / 4, cy - h / 4, cx + w / 4, cy + h / 4])
+            scores.append(rng.uniform(0.3, 0.9))
+            classes.append(0)
+    return ImageDetections(
+        f"frame_{index:05d}.jpg", width, height,
+        np.array(boxes, dtype=np.float32).reshape(-1, 4),
+        np.array(scores, dtype=np.float32),
+        np.array(classes, dtype=np.uint8),
+    )
+
+
+def load_frames(args) -> List[ImageDetections]:
+    if args.session:
+        frames = [
+            det._replace(boxes=np.array(det.boxes), scores=np.array(det.scores), classes=np.array(det.classes))
+            for det in DetectionStore(args.session, RAW_STORE_DIRNAME)
+        ]
+        if not frames:
+            raise SystemExit(f"No cached raw detections in {args.session / RAW_STORE_DIRNAME}")
+        return frames
+    rng = np.random.default_rng(args.seed)
+    return [synthetic_frame(rng, i) for i in range(max(args.batch_sizes))]
+
+
+def best_ms(fn: Callable[[], object], repeats: int) -> float:
+    fn()  # warm-up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def mismatches(reference: List[ImageDetections], batched: List[ImageDetections]) -> int:
+    """Images whose kept boxes differ between the two implementations."""
+    return sum(
+        not np.array_equal(np.asarray(a.boxes), np.asarray(b.boxes))
+        or not np.array_equal(np.asarray(a.classes), np.asarray(b.classes))
+        for a, b in zip(reference, batched)
+    )
+
+
+def run(args) -> None:
+    torch.set_num_threads(args.threads)
+    frames = load_frames(args)
+    base = PostprocessParams()
+    parity = base._replace(class_agnostic=True)
+    raw_boxes = [len(f.scores) for f in frames]
+    print(f"{len(frames)} frames, raw boxes per frame: mean {np.mean(raw_boxes):.0f}, max {max(raw_boxes)}; "
+          f"torch threads: {args.threads}")
+    print(f"{'images':>7} {'per-image ms':>13} {'batched ms':>11} {'class-aware ms':>15} {'speedup':>8} {'parity':>9}")
+
+    for size in args.batch_sizes:
+        batch = (frames * (size // len(frames) + 1))[:size]
+        loop_ms = best_ms(lambda: [apply_postprocess(f, parity) for f in batch], args.repeats)
+        batched_ms = best_ms(lambda: postprocess_batch(batch, parity), args.repeats)
+        aware_ms = best_ms(lambda: postprocess_batch(batch, base), args.repeats)
+        diff = mismatches([apply_postprocess(f, parity) for f in batch], postprocess_batch(batch, parity))
+        parity_text = "exact" if not diff else f"{diff} diff"
+        print(f"{size:>7} {loop_ms:>13.1f} {batched_ms:>11.1f} {aware_ms:>15.1f} "
+              f"{loop_ms / batched_ms:>7.1f}x {parity_text:>9}")
+
+    aware_ref = [apply_postprocess(f, base) for f in frames]
+    aware_batched = postprocess_batch(frames, base)
+    kept_agnostic = sum(len(d.scores) for d in postprocess_batch(frames, parity))
+    kept_aware = sum(len(d.scores) for d in aware_batched)
+    print(f"class-aware batched vs per-image mismatches: {mismatches(aware_ref, aware_batched)}; "
+          f"boxes kept class-agnostic {kept_agnostic} vs class-aware {kept_aware}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark batched detection post-processing")
+    parser.add_argument("--session", type=Path, help="Session folder with cached raw detections")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
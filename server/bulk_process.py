@@ -0,0 +1,164 @@
+# Headless bulk processing of whole survey directories
+"""
+Runs the same detection/classification pipeline as `/api/upload-multiple/` over
+a directory tree without the browser or the API.
+
+For every image under SOURCE the output folder receives, mirroring the source
+layout, an annotated image in `<subdir>/images/`, a YOLO label file in
+`<subdir>/labels/` and the columnar detections in `<subdir>/detections/`. A consolidated `session_metadata.json` (keyed by the path
+relative to SOURCE) doubles as the checkpoint: it is rewritten after every
+completed batch, and a rerun skips images already recorded there. The final
+`results.csv` is produced by the same writer as the session CSV export.
+
+Usage (from the `server/` directory):
+    python bulk_process.py /data/flight_042 /data/flight_042_results --workers 4 --batch-size 8
+"""
+import argparse
+import multiprocessing
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from core.config import ALLOWED_EXTENSIONS
+from core.cpu_topology import apply_thread_plan, plan_threads, set_thread_env
+from core.logger import setup_logger
+from services.detection_store import DetectionStore
+from services.exif_service import extract_batch
+from services.metadata_service import (
+    chunked,
+    load_metadata,
+    record_results,
+    write_metadata_csv,
+)
+
+logger = setup_logger("bulk_process", "logs/bulk_process.log")
+
+Batch = Tuple[str, List[str]]  # (relative subdirectory, relative image paths)
+
+_source_root: Optional[Path] = None
+_output_root: Optional[Path] = None
+
+
+def find_images(source: Path) -> List[str]:
+    """Return image paths under `source`, relative to it, in a stable order."""
+    return sorted(
+        p.relative_to(source).as_posix()
+        for p in source.rglob("*")
+        if p.is_file() and p.suffix.lower() in ALLOWED_EXTENSIONS
+    )
+
+
+def plan_batches(pending: List[str], batch_size: int) -> List[Batch]:
+    """
+    Group pending images by subdirectory and split each group into batches,
+    so every batch writes into a single output folder.
+    """
+    by_dir = {}
+    for rel in pending:
+        by_dir.setdefault(str(Path(rel).parent), []).append(rel)
+    return [
+        (subdir, batch)
+        for subdir, rels in by_dir.items()
+        for batch in chunked(rels, batch_size)
+    ]
+
+
+def _init_worker(source: Path, output: Path, workers: int):
+    global _source_root, _output_root
+    _source_root, _output_root = source, output
+    identity = multiprocessing.current_process()._identity
+    apply_thread_plan(plan_threads(workers), worker_index=identity[0] - 1 if identity else 0)
+
+
+def process_batch(batch: Batch):
+    """
+    Run the model pipeline on one batch inside a worker.
+
+    Returns:
+        (relative paths, (results, exif)) on success or (relative paths, error message) on failure.
+    """
+    from services.model_service import run_model_on_images
+
+    subdir, rels = batch
+    paths = [_source_root / rel for rel in rels]
+    output_dir = _output_root / subdir
+    try:
+        exif = extract_batch(paths)
+        results = run_model_on_images(paths, _source_root.name, output_dir=output_dir)
+        # The output folder is an export, so render YOLO labels from the detection store
+        DetectionStore(output_dir).write_yolo_labels(output_dir / "labels", [p.name for p in paths])
+        return rels, ([(d, c, cls, str(p)) for d, c, cls, p in results], exif)
+    except Exception as e:
+        logger.error(f"Batch in {subdir} failed: {e}")
+        return rels, str(e)
+
+
+def run(source: Path, output: Path, workers: int, batch_size: int) -> int:
+    """
+    Process every not-yet-recorded image under `source` into `output`.
+
+    Returns:
+        int: Number of images that failed in this run
+    """
+    output.mkdir(parents=True, exist_ok=True)
+    done = set(load_metadata(output)["images"])
+    all_images = find_images(source)
+    pending = [rel for rel in all_images if rel not in done]
+    print(f"{len(all_images)} images found, {len(done)} already processed, {len(pending)} pending")
+
+    batches = plan_batches(pending, batch_size)
+    failures = 0
+    processed = 0
+    start = time.perf_counter()
+
+    # Load the models once in the parent; forked workers share the weights.
+    set_thread_env(plan_threads(workers))
+    import services.model_service
+    if workers > 1:
+        services.model_service.prepare_models_for_fork()
+
+    def handle(outcome):
+        nonlocal failures, processed
+        rels, payload = outcome
+        if isinstance(payload, str):
+            failures += len(rels)
+            print(f"FAILED batch of {len(rels)} ({rels[0]} ...): {payload}")
+            return
+        results, exif = payload
+        record_results(output, rels, results, exif=exif, index=False,
+                       model_version=services.model_service.registry.active().version)
+        processed += len(rels)
+        rate = processed / (time.perf_counter() - start)
+        print(f"[{processed}/{len(pending)}] {rate:.2f} img/s")
+
+    if workers <= 1:
+        _init_worker(source, output, 1)
+        for batch in batches:
+            handle(process_batch(batch))
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(source, output, workers)) as pool:
+            for outcome in pool.imap_unordered(process_batch, batches):
+                handle(outcome)
+
+    csv_path = output / "results.csv"
+    with open(csv_path, "w", newline="") as f:
+        rows = write_metadata_csv(load_metadata(output), f)
+    print(f"Wrote {rows} rows to {csv_path}; {failures} images failed (rerun to retry)")
+    return failures
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Bulk dugong detection over a survey directory")
+    parser.add_argument("source", type=Path, help="Directory tree of survey images")
+    parser.add_argument("output", type=Path, help="Output directory (also holds the resume checkpoint)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per model call")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    failed = run(args.source.resolve(), args.output.resolve(), args.workers, args.batch_size)
+    raise SystemExit(1 if failed else 0)
@@ -5,10 +5,11 @@ Manages automatic cleanup of expired session data and temporary files.
 import asyncio
 from pathlib import Path
 from datetime import datetime, timedelta
-import shutil
 import json
 from core.config import BASE_DIR
 from core.logger import setup_logger
+from services.trash_service import trash_session
+from services.storage_service import storage
 
 logger = setup_logger("cleanup", "logs/cleanup.log")
 
@@ -108,7 +109,8 @@ async def cleanup_expired_sessions(interval_seconds: int = 300, expiry_minutes:
                 # Check if session is expired
                 if is_session_expired(session_folder, expiry_minutes):
                     try:
-                        shutil.rmtree(session_folder)
+                        await asyncio.to_thread(trash_session, session_folder.name)
+                        storage.forget(session_folder.name)
                         logger.info(f"Deleted expired session folder: {session_folder.name}")
                         cleaned_count += 1
                     except Exception as e:
@@ -118,6 +120,11 @@ async def cleanup_expired_sessions(interval_seconds: int = 300, expiry_minutes:
                 logger.info(f"Cleanup completed - removed {cleaned_count} expired sessions")
             else:
                 logger.debug("Cleanup completed - no expired sessions found")
+
+            # Evict regenerable artifacts if the live sessions are over the storage budget
+            freed = await asyncio.to_thread(storage.enforce)
+            if freed:
+                logger.info(f"Storage budget enforced - evicted {freed / 1e6:.1f} MB")
                 
         except Exception as e:
             logger.error(f"Error during cleanup cycle: {e}")
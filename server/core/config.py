@@ -1,10 +1,93 @@
 """
 Core configuration settings for file handling and model parameters.
 """
+import os
 from pathlib import Path
 
-BASE_DIR= Path("/tmp").resolve()  / "uploads"
+# Parent of the uploads folder; in split inference mode it must be the same shared
+# volume on the API and on every inference worker node
+BASE_DIR= Path(os.getenv("UPLOADS_ROOT", "/tmp")).resolve()  / "uploads"
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png"}
 MAX_FILE_SIZE_MB = 25
 MAX_FILE_SIZE = MAX_FILE_SIZE_MB * 1024 * 1024
 
+BACKFILL_CHUNK_SIZE = 8
+
+# Inference memory budget (peak RSS) used to size detector batches
+INFERENCE_MEMORY_BUDGET_MB = int(os.getenv("INFERENCE_MEMORY_BUDGET_MB", "3072"))
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "16"))
+
+# CPU scheduling for inference workers (see core/cpu_topology.py)
+THREAD_CONFIG_PATH = Path(os.getenv("THREAD_CONFIG_PATH", "thread_config.json"))
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "0") == "1"
+
+# Inference scheduling: images per fair-queue slice, and admission limits beyond
+# which new uploads get 429 + Retry-After (see services/inference_scheduler.py)
+SCHEDULER_SLICE_SIZE = int(os.getenv("SCHEDULER_SLICE_SIZE", "8"))
+SCHEDULER_MAX_QUEUED_IMAGES = int(os.getenv("SCHEDULER_MAX_QUEUED_IMAGES", "400"))
+SCHEDULER_MIN_FREE_MEMORY_MB = int(os.getenv("SCHEDULER_MIN_FREE_MEMORY_MB", "256"))
+
+# Archive uploads: images per inference batch while the archive streams in
+ARCHIVE_BATCH_SIZE = 8
+
+# Orthomosaics: (Geo)TIFFs processed window by window (see services/mosaic_service.py)
+MOSAIC_EXTENSIONS = {".tif", ".tiff"}
+MOSAIC_MAX_FILE_SIZE = int(os.getenv("MOSAIC_MAX_FILE_SIZE_MB", "20480")) * 1024 * 1024
+MOSAIC_WINDOW = int(os.getenv("MOSAIC_WINDOW", "4096"))
+MOSAIC_OVERLAP = int(os.getenv("MOSAIC_OVERLAP", "512"))
+MOSAIC_BATCH_SIZE = int(os.getenv("MOSAIC_BATCH_SIZE", "4"))
+
+# Survey videos: frames sampled every VIDEO_SAMPLE_INTERVAL seconds ("interval") or whenever
+# less than VIDEO_SAMPLE_OVERLAP of the previous sample is still in view ("overlap")
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".mkv"}
+VIDEO_MAX_FILE_SIZE = int(os.getenv("VIDEO_MAX_FILE_SIZE_MB", "4096")) * 1024 * 1024
+VIDEO_SAMPLING = os.getenv("VIDEO_SAMPLING", "overlap")
+VIDEO_SAMPLE_INTERVAL = float(os.getenv("VIDEO_SAMPLE_INTERVAL", "2.0"))
+VIDEO_SAMPLE_OVERLAP = float(os.getenv("VIDEO_SAMPLE_OVERLAP", "0.3"))
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "4"))
+
+# Resumable chunked uploads: largest accepted chunk, files per upload and the
+# most completed files handed to inference together
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(4 * 1024 * 1024)))
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "2000"))
+UPLOAD_BATCH_SIZE = 8
+
+# Spatial/temporal image index (kept outside the statically served uploads folder)
+INDEX_DB_PATH = BASE_DIR.parent / "uploads_index.sqlite3"
+
+# Near-duplicate detection: skip inference for images within this many differing hash bits.
+# Off by default: distinct low-texture open-water frames can fall within the threshold and
+# would silently take another frame's counts; validate the threshold on survey data first
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "0") == "1"
+DEDUP_HAMMING_THRESHOLD = int(os.getenv("DEDUP_HAMMING_THRESHOLD", "6"))
+
+# Empty-frame prefilter: a low-resolution detector pass; frames where it finds nothing
+# skip the full detector and classifier (validate with validate_prefilter.py first)
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "0") == "1"
+PREFILTER_IMGSZ = int(os.getenv("PREFILTER_IMGSZ", "320"))
+PREFILTER_CONF = float(os.getenv("PREFILTER_CONF", "0.1"))
+
+# Session store disk budget (/tmp is RAM-backed on Cloud Run): regenerable artifacts are
+# evicted down to the low-water fraction when it is exceeded, uploads that still do not fit get 507
+STORAGE_BUDGET_MB = int(os.getenv("STORAGE_BUDGET_MB", "2048"))
+STORAGE_LOW_WATER_FRACTION = 0.9
+STORAGE_STALE_UPLOAD_MINUTES = int(os.getenv("STORAGE_STALE_UPLOAD_MINUTES", "60"))
+
+# Model hot-swap (see services/model_registry.py): weights of loaded versions and the
+# promoted version shared by the server workers; admin endpoints are disabled without a token
+MODEL_DIR = BASE_DIR.parent / "models"
+MODEL_STATE_PATH = MODEL_DIR / "active.json"
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN", "")
+
+# Deleted sessions are renamed into the trash (same filesystem as BASE_DIR, outside the
+# served folder) and removed in the background at a bounded rate
+TRASH_DIR = BASE_DIR.parent / "uploads_trash"
+TRASH_REAP_MB_PER_SECOND = float(os.getenv("TRASH_REAP_MB_PER_SECOND", "64"))
+
+# Split inference (INFERENCE_MODE=queue): the API enqueues image slices in a durable SQLite
+# queue and inference_worker.py processes, here or on other nodes, lease and run them
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")
+JOB_QUEUE_PATH = Path(os.getenv("JOB_QUEUE_PATH", str(BASE_DIR.parent / "inference_jobs.sqlite3")))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "5"))
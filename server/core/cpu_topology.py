@@ -0,0 +1,143 @@
+"""
+CPU topology detection and thread planning for inference workers.
+Counts the CPUs actually usable by this container (affinity mask and cgroup
+quota, as on Cloud Run) and splits them between inference workers so torch,
+OpenCV and OpenMP thread pools do not oversubscribe the cores.
+"""
+import json
+import math
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from core.config import CPU_AFFINITY, THREAD_CONFIG_PATH
+from core.logger import setup_logger
+
+logger = setup_logger("cpu_topology", "logs/cpu_topology.log")
+
+
+class ThreadPlan(NamedTuple):
+    cpus: int
+    workers: int
+    torch_threads: int
+    opencv_threads: int
+    cpu_sets: List[List[int]]
+
+
+def _cgroup_cpu_limit() -> Optional[float]:
+    """
+    Return the cgroup CPU quota in CPUs, or None if unlimited/unknown.
+    Supports cgroup v2 (cpu.max) and v1 (cpu.cfs_quota_us / cpu.cfs_period_us).
+    """
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def usable_cpu_ids() -> List[int]:
+    """CPU ids this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def available_cpus() -> int:
+    """
+    Number of CPUs usable by this container: the affinity mask capped by any
+    cgroup quota (fractional quotas are rounded down, minimum 1).
+    """
+    cpus = len(usable_cpu_ids())
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.floor(limit)))
+    return max(1, cpus)
+
+
+def load_tuned_config(path: Path = THREAD_CONFIG_PATH) -> Optional[dict]:
+    """Load the autotuned thread settings if they were measured on the same CPU count."""
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r") as f:
+            tuned = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable thread config {path}: {e}")
+        return None
+    if tuned.get("cpus") != available_cpus():
+        logger.info(f"Ignoring thread config tuned for {tuned.get('cpus')} CPUs")
+        return None
+    return tuned
+
+
+def plan_threads(workers: int = 1) -> ThreadPlan:
+    """
+    Split the available CPUs evenly between `workers` inference workers.
+    Autotuned settings, when present, are used as an upper bound per worker.
+    """
+    cpu_ids = usable_cpu_ids()
+    cpus = available_cpus()
+    workers = max(1, workers)
+    per_worker = max(1, cpus // workers)
+
+    torch_threads = per_worker
+    opencv_threads = 1
+    tuned = load_tuned_config()
+    if tuned:
+        torch_threads = max(1, min(per_worker, tuned.get("torchThreads", per_worker)))
+        opencv_threads = max(0, min(per_worker, tuned.get("opencvThreads", opencv_threads)))
+
+    cpu_sets = [
+        cpu_ids[(i * per_worker) % len(cpu_ids):][:per_worker] or cpu_ids
+        for i in range(workers)
+    ]
+    return ThreadPlan(cpus, workers, torch_threads, opencv_threads, cpu_sets)
+
+
+def set_thread_env(plan: ThreadPlan) -> None:
+    """
+    Export thread-count environment variables. Must run before torch, OpenCV or
+    ultralytics are imported to take effect (ultralytics otherwise sizes
+    OMP_NUM_THREADS from os.cpu_count(), which ignores cgroup quotas).
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(plan.torch_threads)
+
+
+def apply_thread_plan(plan: ThreadPlan, worker_index: Optional[int] = None) -> None:
+    """
+    Apply the plan to the current process: torch intra-/inter-op threads, OpenCV
+    threads and, if CPU_AFFINITY is enabled, pin the worker to its CPU set.
+    """
+    import cv2
+    import torch
+
+    set_thread_env(plan)
+    torch.set_num_threads(plan.torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set once, before any inter-op work has started
+        pass
+    cv2.setNumThreads(plan.opencv_threads)
+
+    pinned = None
+    if CPU_AFFINITY and worker_index is not None and hasattr(os, "sched_setaffinity"):
+        pinned = plan.cpu_sets[worker_index % plan.workers]
+        os.sched_setaffinity(0, pinned)
+
+    logger.info(
+        f"pid {os.getpid()}: {plan.cpus} CPUs / {plan.workers} workers -> "
+        f"torch={plan.torch_threads} opencv={plan.opencv_threads} affinity={pinned}"
+    )
@@ -0,0 +1,37 @@
+# Gunicorn configuration for the multi-worker serving mode
+"""
+Runs `main:app` under several uvicorn workers that share one copy of the model
+weights: the app and both YOLO models are loaded in the master process, which
+then forks the workers (copy-on-write). Used by startup.sh when WEB_CONCURRENCY > 1.
+
+    gunicorn -c gunicorn_conf.py main:app
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('BACKEND_PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Inference on large uploads can take minutes; match the nginx proxy timeouts
+timeout = 1800
+graceful_timeout = 60
+
+
+def when_ready(server):
+    """Load the models in the master, after the app, before any worker is forked."""
+    from core.config import INFERENCE_MODE
+    if INFERENCE_MODE == "queue":
+        # inference_worker.py runs the images; a worker only loads the models if it runs a mosaic or video
+        server.log.info(f"INFERENCE_MODE=queue; forking {workers} workers without preloading models")
+        return
+    from services.model_service import prepare_models_for_fork
+    prepare_models_for_fork()
+    server.log.info(f"Models preloaded; forking {workers} workers")
+
+
+def post_fork(server, worker):
+    """Give each worker an even share of the CPUs (and its own CPU set if CPU_AFFINITY=1)."""
+    from core.cpu_topology import apply_thread_plan, plan_threads
+    plan = plan_threads(workers)
+    apply_thread_plan(plan, worker_index=worker.age)
+    server.log.info(f"Worker {worker.pid} using {plan.torch_threads} torch threads")
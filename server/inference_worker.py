@@ -0,0 +1,158 @@
+# Inference worker for the split API / inference deployment
+"""
+Leases image jobs from the shared job queue (services.job_queue), runs the
+upload pipeline on them and writes the results into the session folders, for
+an API started with INFERENCE_MODE=queue. Run as many as needed, on the API's
+node or on other nodes that mount the same uploads volume (UPLOADS_ROOT) and
+queue database (JOB_QUEUE_PATH).
+
+Each process runs one job at a time and renews its lease while it runs; a job
+that raises is retried with backoff, and one whose worker disappears is
+retried once its lease expires. SIGTERM/SIGINT finish the current job and exit.
+
+Usage (from the `server/` directory):
+    INFERENCE_MODE=queue UPLOADS_ROOT=/mnt/shared python inference_worker.py --processes 2
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+
+from core.config import BASE_DIR, JOB_LEASE_SECONDS
+from core.cpu_topology import apply_thread_plan, plan_threads, set_thread_env
+from core.logger import setup_logger
+from services import job_queue
+
+logger = setup_logger("inference_worker", "logs/inference_worker.log")
+
+# Seconds between an idle worker's queue maintenance (restoring failed jobs, purging old ones)
+MAINTENANCE_INTERVAL = 600
+
+_stop = threading.Event()
+
+
+def _keep_leased(job: job_queue.Job, worker_id: str, lease_seconds: float, done: threading.Event) -> None:
+    """Renew the job's lease until it is done; the lease is lost if this stops."""
+    while not done.wait(lease_seconds / 3):
+        try:
+            if not job_queue.heartbeat(job.id, worker_id, lease_seconds):
+                logger.warning(f"Lost the lease of job {job.id}; it may run again elsewhere")
+                return
+        except sqlite3.Error as e:
+            logger.warning(f"Could not renew the lease of job {job.id}: {e}")
+
+
+def run_job(job: job_queue.Job, worker_id: str, lease_seconds: float) -> bool:
+    """Run one leased job and record its outcome. Returns True if it completed."""
+    from services.pipeline_service import process_session_images
+
+    if not (BASE_DIR / job.session_id).is_dir():
+        job_queue.fail(job.id, worker_id, "Session was deleted", retry=False)
+        return False
+
+    done = threading.Event()
+    threading.Thread(target=_keep_leased, args=(job, worker_id, lease_seconds, done), daemon=True).start()
+    start = time.perf_counter()
+    try:
+        paths = job_queue.stage_images(job)
+        report = {} if job.want_report else None
+        summary = process_session_images(job.session_id, paths, job.touch, report)
+    except Exception as e:
+        logger.error(f"Job {job.id} ({job.session_id}) attempt {job.attempt} failed: {e}")
+        if job_queue.fail(job.id, worker_id, f"{type(e).__name__}: {e}") == "failed":
+            job_queue.restore_failed()
+        return False
+    finally:
+        done.set()
+
+    summary["report"] = report
+    if not job_queue.complete(job.id, worker_id, summary):
+        # Another worker took the job over; its staged originals are still in use
+        logger.warning(f"Job {job.id} finished after its lease was taken over; result dropped")
+        return False
+    job_queue.finish_staging(job)
+    logger.info(
+        f"Job {job.id} ({job.session_id}): {len(paths)} images, attempt {job.attempt}, "
+        f"{time.perf_counter() - start:.2f}s"
+    )
+    return True
+
+
+def work(worker_id: str, lease_seconds: float, poll_interval: float, max_jobs: int = 0) -> int:
+    """Claim and run jobs until stopped (or after `max_jobs`). Returns the number completed."""
+    completed = runs = 0
+    maintained = 0.0
+    logger.info(f"Worker {worker_id} polling {job_queue.JOB_QUEUE_PATH}")
+    while not _stop.is_set():
+        try:
+            job = job_queue.claim(worker_id, lease_seconds)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not claim a job: {e}")
+            job = None
+        if job is None:
+            if time.monotonic() - maintained > MAINTENANCE_INTERVAL:
+                maintained = time.monotonic()
+                job_queue.restore_failed()
+                job_queue.purge()
+            _stop.wait(poll_interval)
+            continue
+        completed += run_job(job, worker_id, lease_seconds)
+        runs += 1
+        if max_jobs and runs >= max_jobs:
+            break
+    return completed
+
+
+def _stop_on_signal(signum, frame) -> None:
+    _stop.set()
+
+
+def _worker_process(index: int, processes: int, args) -> None:
+    signal.signal(signal.SIGTERM, _stop_on_signal)
+    signal.signal(signal.SIGINT, _stop_on_signal)
+    apply_thread_plan(plan_threads(processes), worker_index=index)
+    work(f"{socket.gethostname()}:{os.getpid()}", args.lease, args.poll_interval, args.max_jobs)
+
+
+def run(args) -> None:
+    # Load the models once in the parent; forked workers share the weights.
+    set_thread_env(plan_threads(args.processes))
+    import services.model_service
+    if args.processes <= 1:
+        _worker_process(0, 1, args)
+        return
+    services.model_service.prepare_models_for_fork()
+
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+    children = [ctx.Process(target=_worker_process, args=(i, args.processes, args), name=f"inference-worker-{i}")
+                for i in range(args.processes)]
+    for child in children:
+        child.start()
+
+    def forward(signum, frame):
+        for child in children:
+            if child.is_alive():
+                os.kill(child.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        child.join()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run inference jobs from the shared job queue")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes on this node")
+    parser.add_argument("--lease", type=float, default=JOB_LEASE_SECONDS, help="Job lease in seconds")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls when idle")
+    parser.add_argument("--max-jobs", type=int, default=0, help="Exit after this many jobs per process (0 = never)")
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,294 @@
+# Concurrent load-testing harness for the Dugong Classification API
+"""
+Drives mixed traffic from many simulated sessions against the FastAPI app and
+reports throughput, latency percentiles and error rates per endpoint.
+
+By default the app from `main.py` is started in-process on a local port with
+the MongoDB auth database replaced by an in-memory stub, so the run needs no
+external services. Pass --url to target an already running instance instead.
+
+Usage (from the `server/` directory):
+    python load_test.py --sessions 8 --rounds 3 --files-per-upload 4
+    python load_test.py --url http://localhost:8000 --images-dir ./samples
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+
+class _StubResult:
+    def __init__(self, modified_count: int = 0):
+        self.modified_count = modified_count
+        self.inserted_id = None
+
+
+class _StubCollection:
+    """Minimal in-memory stand-in for the pymongo users collection."""
+
+    def __init__(self):
+        self._docs: List[dict] = []
+        self._lock = threading.Lock()
+
+    def _matches(self, doc: dict, query: dict) -> bool:
+        return all(doc.get(k) == v for k, v in query.items())
+
+    def find_one(self, query: dict):
+        with self._lock:
+            return next((dict(d) for d in self._docs if self._matches(d, query)), None)
+
+    def insert_one(self, doc: dict):
+        with self._lock:
+            self._docs.append(dict(doc))
+        return _StubResult()
+
+    def _update(self, query: dict, update: dict, many: bool) -> _StubResult:
+        modified = 0
+        with self._lock:
+            for doc in self._docs:
+                if not self._matches(doc, query):
+                    continue
+                doc.update(update.get("$set", {}))
+                for key in update.get("$unset", {}):
+                    doc.pop(key, None)
+                modified += 1
+                if not many:
+                    break
+        return _StubResult(modified)
+
+    def update_one(self, query: dict, update: dict):
+        return self._update(query, update, many=False)
+
+    def update_many(self, query: dict, update: dict):
+        return self._update(query, update, many=True)
+
+
+class _StubAdmin:
+    def command(self, *args, **kwargs):
+        return {"ok": 1}
+
+
+class _StubDatabase:
+    def __init__(self):
+        self._collections: Dict[str, _StubCollection] = defaultdict(_StubCollection)
+
+    def __getitem__(self, name: str) -> _StubCollection:
+        return self._collections[name]
+
+
+class StubMongoClient:
+    """Drop-in replacement for `pymongo.MongoClient` used by `auth.login`."""
+
+    _databases: Dict[str, _StubDatabase] = defaultdict(_StubDatabase)
+
+    def __init__(self, *args, **kwargs):
+        self.admin = _StubAdmin()
+
+    def __getitem__(self, name: str) -> _StubDatabase:
+        return self._databases[name]
+
+    def close(self):
+        pass
+
+
+def start_local_app(host: str, port: int):
+    """
+    Start the app from `main.py` in a background thread with a stubbed auth DB.
+
+    Returns:
+        The running uvicorn.Server instance.
+    """
+    import pymongo
+    pymongo.MongoClient = StubMongoClient  # must happen before auth.login is imported
+
+    import uvicorn
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Local server failed to start")
+        time.sleep(0.1)
+    return server
+
+
+def load_sample_images(images_dir: Optional[Path], count: int, size: int) -> List[Tuple[str, bytes]]:
+    """
+    Return (filename, jpeg bytes) pairs, either read from a directory of real
+    survey frames or synthesised as noise images of the given size.
+    """
+    if images_dir is not None:
+        paths = sorted(p for p in images_dir.iterdir() if p.suffix.lower() in {".jpg", ".jpeg", ".png"})
+        if not paths:
+            raise SystemExit(f"No images found in {images_dir}")
+        return [(p.name, p.read_bytes()) for p in paths]
+
+    import cv2
+    rng = np.random.default_rng(0)
+    samples = []
+    for i in range(count):
+        img = rng.integers(0, 255, size=(size, size, 3), dtype=np.uint8)
+        ok, buf = cv2.imencode(".jpg", img)
+        if not ok:
+            raise RuntimeError("Failed to encode synthetic image")
+        samples.append((f"loadtest_{i:03d}_20250101.jpg", buf.tobytes()))
+    return samples
+
+
+class LoadStats:
+    """Thread-safe per-endpoint latency and error recorder."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+        self._errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, endpoint: str, latency: float, ok: bool):
+        with self._lock:
+            self._latencies[endpoint].append(latency)
+            if not ok:
+                self._errors[endpoint] += 1
+
+    def summary(self, wall_seconds: float) -> Dict[str, dict]:
+        report = {}
+        with self._lock:
+            for endpoint, latencies in sorted(self._latencies.items()):
+                arr = np.asarray(latencies) * 1000.0
+                p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+                report[endpoint] = {
+                    "requests": len(latencies),
+                    "errors": self._errors[endpoint],
+                    "errorRate": self._errors[endpoint] / len(latencies),
+                    "throughput": len(latencies) / wall_seconds,
+                    "p50_ms": float(p50),
+                    "p95_ms": float(p95),
+                    "p99_ms": float(p99),
+                }
+        return report
+
+
+def _timed(stats: LoadStats, endpoint: str, call) -> Optional[requests.Response]:
+    start = time.perf_counter()
+    try:
+        response = call()
+        ok = response.status_code < 400
+    except requests.RequestException:
+        response, ok = None, False
+    stats.record(endpoint, time.perf_counter() - start, ok)
+    return response
+
+
+def simulate_session(base_url: str, samples: List[Tuple[str, bytes]], args, stats: LoadStats, seed: int):
+    """
+    Run one simulated dashboard session: upload batches, poll status, delete an
+    image, export the CSV and finally close the tab via the cleanup beacon.
+    """
+    rng = random.Random(seed)
+    session_id = f"loadtest-{uuid.uuid4()}"
+    http = requests.Session()
+    uploaded: List[str] = []
+
+    for _ in range(args.rounds):
+        batch = rng.sample(samples, min(args.files_per_upload, len(samples)))
+        files = []
+        for name, data in batch:
+            unique_name = f"{uuid.uuid4().hex[:8]}_{name}"
+            files.append(("files", (unique_name, data, "image/jpeg")))
+            uploaded.append(unique_name)
+        _timed(stats, "upload-multiple", lambda: http.post(
+            f"{base_url}/api/upload-multiple/", data={"session_id": session_id},
+            files=files, timeout=args.timeout))
+
+        for _ in range(args.polls):
+            _timed(stats, "session-status", lambda: http.get(
+                f"{base_url}/api/session-status/{session_id}", timeout=args.timeout))
+            time.sleep(args.poll_interval)
+
+        if uploaded and rng.random() < args.delete_probability:
+            victim = uploaded.pop(rng.randrange(len(uploaded)))
+            _timed(stats, "delete-image", lambda: http.delete(
+                f"{base_url}/api/delete-image/{session_id}/{victim}", timeout=args.timeout))
+
+        _timed(stats, "export-session-csv", lambda: http.get(
+            f"{base_url}/api/export-session-csv/{session_id}", timeout=args.timeout))
+
+    _timed(stats, "cleanup-session-beacon", lambda: http.post(
+        f"{base_url}/api/cleanup-session-beacon",
+        data={"session_id": session_id, "source": "load_test"}, timeout=args.timeout))
+
+
+def print_report(report: Dict[str, dict], wall_seconds: float):
+    header = f"{'endpoint':<24}{'reqs':>7}{'errors':>8}{'err%':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    total = 0
+    for endpoint, row in report.items():
+        total += row["requests"]
+        print(f"{endpoint:<24}{row['requests']:>7}{row['errors']:>8}{row['errorRate'] * 100:>6.1f}%"
+              f"{row['throughput']:>9.2f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    print("-" * len(header))
+    print(f"Total: {total} requests in {wall_seconds:.1f}s ({total / wall_seconds:.2f} req/s)")
+
+
+def run_load_test(args) -> Dict[str, dict]:
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server = start_local_app(args.host, args.port)
+        base_url = f"http://{args.host}:{args.port}"
+
+    samples = load_sample_images(args.images_dir, args.synthetic_images, args.image_size)
+    stats = LoadStats()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            futures = [
+                pool.submit(simulate_session, base_url, samples, args, stats, seed)
+                for seed in range(args.sessions)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        wall_seconds = time.perf_counter() - start
+        if server is not None:
+            server.should_exit = True
+
+    report = stats.summary(wall_seconds)
+    print_report(report, wall_seconds)
+    if args.json:
+        args.json.write_text(json.dumps({"wallSeconds": wall_seconds, "endpoints": report}, indent=2))
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Concurrent load test for the Dugong Classification API")
+    parser.add_argument("--url", default=None, help="Target an existing instance instead of starting one locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sessions", type=int, default=4, help="Number of concurrent simulated sessions")
+    parser.add_argument("--rounds", type=int, default=2, help="Upload rounds per session")
+    parser.add_argument("--files-per-upload", type=int, default=3)
+    parser.add_argument("--polls", type=int, default=3, help="session-status polls after each upload")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--delete-probability", type=float, default=0.5)
+    parser.add_argument("--images-dir", type=Path, default=None, help="Directory of sample survey images")
+    parser.add_argument("--synthetic-images", type=int, default=8)
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--json", type=Path, default=None, help="Also write the report as JSON")
+    return parser
+
+
+if __name__ == "__main__":
+    run_load_test(build_parser().parse_args())
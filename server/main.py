@@ -6,10 +6,18 @@ from starlette.middleware.sessions import SessionMiddleware
 from dotenv import load_dotenv
 import asyncio
 import os
+from core.cpu_topology import apply_thread_plan, plan_threads, set_thread_env
+
+# Size OpenMP/MKL pools from the container's real CPU budget before torch is imported
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+thread_plan = plan_threads(WEB_CONCURRENCY)
+set_thread_env(thread_plan)
+
 from auth.login import router as login_router
 from api.routes import router as api_router
 # from auth.google_auth import router as auth_router
 from core.cleanup import cleanup_expired_sessions
+from services.trash_service import start_reaper
 from core.logger import setup_logger
 from core.config import BASE_DIR
 from fastapi.staticfiles import StaticFiles
@@ -51,9 +59,13 @@ app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
 # Background task: periodically clean expired session folders
 @app.on_event("startup")
 async def startup_event():
+    apply_thread_plan(thread_plan)
+    app_logger.info(f"Thread plan: {thread_plan}")
     app_logger.info("Starting session-based cleanup background task")
     # Start cleanup with 5-minute intervals and 15-minute session expiry
     asyncio.create_task(cleanup_expired_sessions(interval_seconds=300, expiry_minutes=15))
+    # Remove deleted sessions in the background, resuming trash left by a previous run
+    start_reaper()
 
 # Register routers
 app.include_router(api_router, prefix="/api")     # Main API
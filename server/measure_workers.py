@@ -0,0 +1,111 @@
+# Memory and throughput scaling of the multi-worker serving mode
+"""
+Starts the backend under gunicorn (see gunicorn_conf.py) with increasing worker
+counts and, for each, records the memory of the master and each worker and the
+request throughput under the load_test.py traffic mix.
+
+USS is memory unique to a process; PSS splits shared pages between the processes
+sharing them. With preloaded models the weights appear in PSS/RSS of every worker
+but not in its USS, so USS is the per-worker overhead of adding a worker.
+
+Usage (from the `server/` directory):
+    python measure_workers.py --workers 1 2 4 --sessions 8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import psutil
+import requests
+
+from load_test import build_parser as build_load_parser, run_load_test
+
+
+def wait_until_healthy(url: str, proc: subprocess.Popen, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {proc.returncode}")
+        try:
+            if requests.get(f"{url}/health", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"Backend at {url} did not become healthy within {timeout}s")
+
+
+def memory_snapshot(master_pid: int) -> Dict[str, object]:
+    """Return RSS/USS/PSS in MB for the gunicorn master and each worker."""
+    def mb(value: int) -> float:
+        return round(value / 2**20, 1)
+
+    master = psutil.Process(master_pid)
+    workers = []
+    for child in master.children():
+        info = child.memory_full_info()
+        workers.append({"pid": child.pid, "rssMB": mb(info.rss), "ussMB": mb(info.uss), "pssMB": mb(info.pss)})
+    info = master.memory_full_info()
+    return {
+        "master": {"rssMB": mb(info.rss), "ussMB": mb(info.uss), "pssMB": mb(info.pss)},
+        "workers": workers,
+        "totalPssMB": round(mb(info.pss) + sum(w["pssMB"] for w in workers), 1),
+    }
+
+
+def measure(worker_count: int, port: int, load_args: List[str], startup_timeout: float) -> dict:
+    env = dict(os.environ, WEB_CONCURRENCY=str(worker_count), BACKEND_PORT=str(port))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_healthy(url, proc, startup_timeout)
+        idle = memory_snapshot(proc.pid)
+        report = run_load_test(build_load_parser().parse_args(["--url", url, *load_args]))
+        loaded = memory_snapshot(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+
+    total_requests = sum(row["requests"] for row in report.values())
+    wall = max(row["requests"] / row["throughput"] for row in report.values() if row["throughput"])
+    return {
+        "workers": worker_count,
+        "idle": idle,
+        "afterLoad": loaded,
+        "requestsPerSecond": round(total_requests / wall, 2),
+        "uploadsPerSecond": round(report.get("upload-multiple", {}).get("throughput", 0.0), 3),
+        "endpoints": report,
+    }
+
+
+def print_summary(rows: List[dict]) -> None:
+    print(f"\n{'workers':>8}{'master RSS':>12}{'avg worker RSS':>16}{'avg worker USS':>16}{'total PSS':>11}{'req/s':>8}{'uploads/s':>11}")
+    for row in rows:
+        mem = row["afterLoad"]
+        workers = mem["workers"] or [{"rssMB": 0.0, "ussMB": 0.0}]
+        avg_rss = sum(w["rssMB"] for w in workers) / len(workers)
+        avg_uss = sum(w["ussMB"] for w in workers) / len(workers)
+        print(f"{row['workers']:>8}{mem['master']['rssMB']:>12.1f}{avg_rss:>16.1f}{avg_uss:>16.1f}"
+              f"{mem['totalPssMB']:>11.1f}{row['requestsPerSecond']:>8.2f}{row['uploadsPerSecond']:>11.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-worker memory and throughput vs worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--json", type=Path, default=None)
+    args, load_args = parser.parse_known_args()
+
+    rows = [measure(n, args.port, load_args, args.startup_timeout) for n in args.workers]
+    print_summary(rows)
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2))
@@ -0,0 +1,57 @@
+# Windowed detection on a local orthomosaic
+"""
+Runs the windowed mosaic detector (services.mosaic_service) over a TIFF/GeoTIFF
+on disk and writes the detections as GeoJSON: one point per animal with its
+mosaic pixel box, map coordinates and, for WGS84 geographic or UTM mosaics,
+longitude/latitude. Only the windows being processed are held in memory, so
+mosaics far larger than RAM work.
+
+Usage (from the `server/` directory):
+    python process_mosaic.py /data/survey_ortho.tif --window 4096 --overlap 512 --out survey_ortho.geojson
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from core.config import MOSAIC_BATCH_SIZE, MOSAIC_OVERLAP, MOSAIC_WINDOW
+from services.mosaic_service import MosaicReader, detect_mosaic, to_geojson
+from services.postprocess import PostprocessParams, count_classes
+
+
+def run(args) -> dict:
+    with MosaicReader(args.mosaic) as reader:
+        georeference = reader.georeference
+        print(f"{args.mosaic.name}: {reader.width} x {reader.height} px, {reader.samples} bands, "
+              f"{'EPSG:' + str(georeference.epsg) if georeference else 'not georeferenced'}")
+
+    def progress(done: int, total: int) -> None:
+        print(f"\r  windows {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    params = PostprocessParams(conf=args.conf)
+    det, info = detect_mosaic(args.mosaic, params, args.window, args.overlap, args.batch_size, progress)
+    print(file=sys.stderr)
+
+    out = args.out or args.mosaic.with_suffix(".geojson")
+    with open(out, "w") as f:
+        json.dump(to_geojson(det, georeference), f)
+    dugong_count, calf_count = count_classes(det)
+    summary = {**info, "dugongCount": dugong_count, "motherCalfCount": calf_count, "geojson": str(out)}
+    print(f"{dugong_count} dugongs, {calf_count} mother-calf pairs; {info['windows']} windows "
+          f"({info['emptyWindows']} without data) in {info['elapsedMs'] / 1000:.1f} s -> {out}")
+    return summary
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Detect dugongs on a large orthomosaic TIFF/GeoTIFF")
+    parser.add_argument("mosaic", type=Path)
+    parser.add_argument("--window", type=int, default=MOSAIC_WINDOW, help="Window side in mosaic pixels")
+    parser.add_argument("--overlap", type=int, default=MOSAIC_OVERLAP, help="Overlap between windows in pixels")
+    parser.add_argument("--batch-size", type=int, default=MOSAIC_BATCH_SIZE, help="Windows per detector call")
+    parser.add_argument("--conf", type=float, default=PostprocessParams().conf)
+    parser.add_argument("--out", type=Path, help="GeoJSON output (default: next to the mosaic)")
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -1,7 +1,34 @@
 from pydantic import BaseModel, Field
-from typing import Literal
+from typing import List, Literal, Optional
 
 class MoveImageRequest(BaseModel):
     sessionId: str
     imageName: str
-    targetClass: Literal["feeding", "resting"] 
\ No newline at end of file
+    targetClass: Literal["feeding", "resting"]
+
+class ReprocessRequest(BaseModel):
+    """Post-processing settings; omitted fields keep the session's current value."""
+    conf: Optional[float] = Field(None, ge=0.05, le=1.0)
+    iou: Optional[float] = Field(None, gt=0.0, le=1.0)
+    max_det: Optional[int] = Field(None, ge=1, le=3000)
+    nms_iou_min: Optional[float] = Field(None, gt=0.0, le=1.0)
+    nms_iou_max: Optional[float] = Field(None, gt=0.0, le=1.0)
+    nested_overlap: Optional[float] = Field(None, gt=0.0, le=1.0)
+    class_agnostic: Optional[bool] = None
+    reset: bool = False
+
+class UploadFileSpec(BaseModel):
+    name: str
+    size: int = Field(..., gt=0)
+
+class CreateUploadRequest(BaseModel):
+    """Files of a resumable upload; chunkSize defaults to (and is capped at) UPLOAD_CHUNK_SIZE."""
+    files: List[UploadFileSpec]
+    chunkSize: Optional[int] = Field(None, gt=0)
+
+class LoadModelRequest(BaseModel):
+    """Weights of a candidate model version (http(s) URLs or paths on the server)."""
+    detector: str
+    classifier: Optional[str] = None
+    version: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+    shadowFraction: float = Field(0.0, ge=0.0, le=1.0)
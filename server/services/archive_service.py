@@ -0,0 +1,372 @@
+"""
+Streaming extraction of uploaded ZIP/TAR archives for the Dugong Classification system.
+Archives are read sequentially from the request body as it arrives (never buffered
+whole in memory or on disk) and images are handed to inference in batches while
+the rest of the archive is still uploading.
+"""
+
+import io
+import queue
+import struct
+import tarfile
+import threading
+import zlib
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from core.config import ALLOWED_EXTENSIONS, BASE_DIR, MAX_FILE_SIZE
+from core.logger import setup_logger
+from services.inference_scheduler import process_images_fairly
+
+logger = setup_logger("archive_service", "logs/archive_service.log")
+
+READ_SIZE = 1024 * 1024
+_EOF = object()
+
+ZIP_LOCAL_HEADER = 0x04034B50
+ZIP_DATA_DESCRIPTOR = 0x08074B50
+ZIP_CENTRAL_HEADERS = {0x02014B50, 0x06054B50, 0x06064B50, 0x05054B50}
+
+Member = Tuple[str, Iterator[bytes]]
+
+
+class ArchiveError(ValueError):
+    """Raised for archives that cannot be extracted in a streaming fashion."""
+
+
+class BodyStream(io.RawIOBase):
+    """
+    Blocking file-like view over request body chunks pushed from the event loop.
+    A bounded queue gives backpressure: the upload is only read as fast as the
+    archive is extracted.
+    """
+
+    def __init__(self, max_chunks: int = 32):
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_chunks)
+        self._buffer = b""
+        self._eof = False
+        self.aborted = False
+
+    def try_feed(self, chunk: bytes) -> bool:
+        """Queue a chunk without blocking; False if the queue is full."""
+        if self.aborted:
+            return True
+        try:
+            self._queue.put_nowait(chunk)
+            return True
+        except queue.Full:
+            return False
+
+    def feed(self, chunk: bytes) -> None:
+        """Queue a chunk, blocking while the extractor is behind (drops data once aborted)."""
+        while not self.aborted:
+            try:
+                self._queue.put(chunk, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self) -> None:
+        self.feed(_EOF)
+
+    def abort(self) -> None:
+        """Called once the extractor stops reading, so the producer drops the rest instead of blocking."""
+        self.aborted = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._eof:
+            item = self._queue.get()
+            if item is _EOF:
+                self._eof = True
+            else:
+                self._buffer = bytes(item)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class _PushbackReader:
+    """Sequential reader with the ability to return over-read bytes."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._pending = b""
+
+    def read(self, n: int) -> bytes:
+        out = self._pending[:n]
+        self._pending = self._pending[n:]
+        while len(out) < n:
+            data = self._raw.read(n - len(out))
+            if not data:
+                break
+            out += data
+        return out
+
+    def read_exact(self, n: int) -> bytes:
+        data = self.read(n)
+        if len(data) != n:
+            raise ArchiveError("Unexpected end of ZIP stream")
+        return data
+
+    def unread(self, data: bytes) -> None:
+        self._pending = data + self._pending
+
+
+def _extra_fields(extra: bytes) -> Iterator[Tuple[int, bytes]]:
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, size = struct.unpack_from("<HH", extra, pos)
+        yield tag, extra[pos + 4:pos + 4 + size]
+        pos += 4 + size
+
+
+def _zip64_sizes(extra: bytes, csize: int, usize: int) -> Tuple[int, int]:
+    for tag, field in _extra_fields(extra):
+        if tag == 0x0001:
+            offset = 0
+            if usize == 0xFFFFFFFF:
+                usize, = struct.unpack_from("<Q", field, offset)
+                offset += 8
+            if csize == 0xFFFFFFFF:
+                csize, = struct.unpack_from("<Q", field, offset)
+            break
+    return csize, usize
+
+
+def iter_zip_members(stream) -> Iterator[Member]:
+    """
+    Walk a ZIP archive through its local file headers without seeking.
+
+    Stored and deflated entries are supported; entries written with a trailing
+    data descriptor must be deflated, since a stored entry's end cannot be found
+    without the central directory. Each member's chunk iterator must be consumed
+    (or abandoned) before advancing to the next member.
+    """
+    reader = _PushbackReader(stream)
+    while True:
+        signature = reader.read(4)
+        if len(signature) < 4:
+            return
+        sig, = struct.unpack("<I", signature)
+        if sig in ZIP_CENTRAL_HEADERS:
+            return
+        if sig != ZIP_LOCAL_HEADER:
+            raise ArchiveError("Invalid ZIP local file header")
+
+        (_, flags, method, _, _, _, csize, usize, name_len, extra_len) = struct.unpack(
+            "<HHHHHIIIHH", reader.read_exact(26)
+        )
+        name = reader.read_exact(name_len).decode("utf-8" if flags & 0x800 else "cp437")
+        extra = reader.read_exact(extra_len)
+        csize, usize = _zip64_sizes(extra, csize, usize)
+        has_descriptor = bool(flags & 0x08)
+        descriptor_size = 20 if any(tag == 0x0001 for tag, _ in _extra_fields(extra)) else 12
+        if flags & 0x01:
+            raise ArchiveError(f"Encrypted ZIP entries are not supported: {name}")
+        if method not in (0, 8):
+            raise ArchiveError(f"Unsupported ZIP compression method {method} for {name}")
+        if has_descriptor and method == 0:
+            raise ArchiveError(f"Stored ZIP entry with data descriptor cannot be streamed: {name}")
+
+        consumed = {"done": False}
+
+        def chunks(csize=csize, method=method, has_descriptor=has_descriptor,
+                   descriptor_size=descriptor_size) -> Iterator[bytes]:
+            inflater = zlib.decompressobj(-zlib.MAX_WBITS) if method == 8 else None
+            remaining = None if has_descriptor else csize
+            while remaining is None or remaining > 0:
+                data = reader.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+                if not data:
+                    raise ArchiveError("Unexpected end of ZIP stream")
+                if remaining is not None:
+                    remaining -= len(data)
+                if inflater is None:
+                    yield data
+                    continue
+                out = inflater.decompress(data)
+                if out:
+                    yield out
+                if inflater.eof:
+                    reader.unread(inflater.unused_data)
+                    break
+            if inflater is not None and not inflater.eof:
+                tail = inflater.flush()
+                if tail:
+                    yield tail
+            if has_descriptor:
+                head = reader.read_exact(4)
+                if struct.unpack("<I", head)[0] != ZIP_DATA_DESCRIPTOR:
+                    reader.unread(head)
+                reader.read_exact(descriptor_size)
+            consumed["done"] = True
+
+        member_chunks = chunks()
+        yield name, member_chunks
+        if not consumed["done"]:
+            for _ in member_chunks:
+                pass
+
+
+def iter_tar_members(stream) -> Iterator[Member]:
+    """Walk a (optionally gzip/bz2/xz compressed) TAR archive in stream mode."""
+    with tarfile.open(fileobj=stream, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            handle = archive.extractfile(member)
+
+            def chunks(handle=handle) -> Iterator[bytes]:
+                while True:
+                    data = handle.read(READ_SIZE)
+                    if not data:
+                        return
+                    yield data
+
+            yield member.name, chunks()
+
+
+def iter_archive_members(stream) -> Iterator[Member]:
+    """Detect ZIP vs TAR from the leading bytes and walk the members."""
+    reader = io.BufferedReader(stream, buffer_size=READ_SIZE)
+    magic = reader.peek(4)[:4]
+    if magic[:4] == b"PK\x03\x04":
+        return iter_zip_members(reader)
+    return iter_tar_members(reader)
+
+
+def _unique_path(directory: Path, name: str) -> Path:
+    path = directory / name
+    counter = 1
+    while path.exists():
+        path = directory / f"{Path(name).stem}_{counter}{Path(name).suffix}"
+        counter += 1
+    return path
+
+
+def extract_images(stream, dest_dir: Path, on_image: Callable[[Path], None]) -> Tuple[List[str], List[str]]:
+    """
+    Extract image members matching ALLOWED_EXTENSIONS into dest_dir as they arrive.
+    Each file is written under a temporary name and renamed once complete, then
+    passed to on_image.
+
+    Returns:
+        (extracted file names, skipped member names)
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    extracted, skipped = [], []
+    for member_name, chunks in iter_archive_members(stream):
+        base = Path(member_name).name
+        if (
+            not base
+            or base.startswith(".")
+            or "__MACOSX" in member_name
+            or Path(base).suffix.lower() not in ALLOWED_EXTENSIONS
+        ):
+            skipped.append(member_name)
+            continue
+
+        target = _unique_path(dest_dir, base)
+        partial = target.with_name(f".{target.name}.part")
+        size = 0
+        with open(partial, "wb") as f:
+            for data in chunks:
+                size += len(data)
+                if size > MAX_FILE_SIZE:
+                    break
+                f.write(data)
+        if size > MAX_FILE_SIZE:
+            partial.unlink()
+            logger.warning(f"Skipped {member_name}: larger than {MAX_FILE_SIZE} bytes")
+            skipped.append(member_name)
+            continue
+        partial.rename(target)
+        extracted.append(target.name)
+        on_image(target)
+    return extracted, skipped
+
+
+def process_archive_stream(stream: BodyStream, session_id: str, batch_size: int) -> dict:
+    """
+    Extract images from the streamed archive and run detection in batches as soon
+    as each batch is complete, overlapping inference with the upload.
+
+    Returns:
+        dict: Summary of extracted, skipped and processed files
+    """
+    images_dir = BASE_DIR / session_id / "images"
+    ready: "queue.Queue" = queue.Queue()
+    processed: List[str] = []
+    duplicates: Dict[str, str] = {}
+    errors: List[str] = []
+
+    def infer_worker():
+        batch: List[Path] = []
+        finished = False
+        while not finished:
+            item = ready.get()
+            if item is _EOF:
+                finished = True
+            else:
+                batch.append(item)
+            if batch and (finished or len(batch) >= batch_size):
+                try:
+                    summary = process_images_fairly(session_id, batch)
+                    processed.extend(summary["processed"])
+                    duplicates.update(summary["duplicates"])
+                except Exception as e:
+                    logger.error(f"Inference failed for archive batch in {session_id}: {e}")
+                    errors.append(str(e))
+                batch = []
+
+    worker = threading.Thread(target=infer_worker, name=f"archive-infer-{session_id}", daemon=True)
+    worker.start()
+    extract_error: Optional[Exception] = None
+    extracted, skipped = [], []
+    try:
+        extracted, skipped = extract_images(stream, images_dir, ready.put)
+    except Exception as e:
+        # Malformed archives fail in many ways (bad names, truncated headers, ...); report them all
+        extract_error = e
+        logger.error(f"Archive extraction failed for {session_id}: {type(e).__name__}: {e}")
+    finally:
+        # The extractor may stop before the end of the body (e.g. a ZIP's central
+        # directory is never read); let the producer drain the rest without blocking
+        stream.abort()
+        ready.put(_EOF)
+        worker.join()
+
+    return {
+        "extracted": extracted,
+        "skipped": skipped,
+        "processed": processed,
+        "duplicates": duplicates,
+        "errors": errors + ([str(extract_error)] if extract_error else []),
+    }
+
+
+def start_archive_stream(stream: BodyStream, session_id: str, batch_size: int) -> Future:
+    """
+    Run process_archive_stream on a dedicated thread.
+
+    The extractor blocks on the body for as long as the upload lasts, while the
+    route feeds the body through the default executor; sharing that executor
+    could leave no thread to feed the extractor it is waiting on.
+
+    Returns:
+        Future: Resolves to the process_archive_stream summary
+    """
+    future: Future = Future()
+
+    def extract():
+        try:
+            future.set_result(process_archive_stream(stream, session_id, batch_size))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=extract, name=f"archive-extract-{session_id}", daemon=True).start()
+    return future
@@ -0,0 +1,241 @@
+"""
+Background backfill jobs for the Dugong Classification system.
+Runs detection on session images missing from metadata in fixed-size chunks,
+persisting metadata and progress after every chunk so jobs can be resumed or cancelled.
+A job runs in the server worker that started it; other workers cancel it through
+a flag in the progress file, which the job reads between chunks.
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import psutil
+
+from core.config import BASE_DIR, BACKFILL_CHUNK_SIZE
+from core.logger import setup_logger
+from services.metadata_service import chunked, load_metadata, session_lock
+from services.inference_scheduler import Reservation, scheduler, submit_images
+
+logger = setup_logger("backfill_service", "logs/backfill_service.log")
+
+PROGRESS_FILENAME = "backfill_job.json"
+
+
+class BackfillRunning(RuntimeError):
+    """Raised by start_backfill when another server worker is already backfilling the session."""
+
+    def __init__(self, status: dict):
+        super().__init__(f"A backfill of {status.get('sessionId')} is already running in process {status.get('pid')}")
+        self.status = status
+
+
+class BackfillJob:
+    """Progress and control state for one session's backfill."""
+
+    def __init__(self, session_id: str, files: List[str], chunk_size: int):
+        self.session_id = session_id
+        self.files = files
+        self.chunk_size = chunk_size
+        self.status = "running"
+        self.processed = 0
+        self.added_files: List[str] = []
+        self.error: Optional[str] = None
+        self.started_at = datetime.utcnow().isoformat()
+        self.finished_at: Optional[str] = None
+        self.cancel_requested = False
+        self.task: Optional[asyncio.Task] = None
+        # Admitted images not submitted yet; released chunk by chunk
+        self.reservation: Optional[Reservation] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "sessionId": self.session_id,
+            "status": self.status,
+            "total": len(self.files),
+            "processed": self.processed,
+            "chunkSize": self.chunk_size,
+            "addedFiles": self.added_files,
+            "error": self.error,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "cancelRequested": self.cancel_requested,
+        }
+
+
+_jobs: Dict[str, BackfillJob] = {}
+
+
+def find_missing_files(session_id: str) -> List[str]:
+    """
+    List image files in the session folder that have no metadata entry yet
+    (hidden files are partial uploads/extractions still being written).
+    """
+    session_dir = BASE_DIR / session_id
+    images_dir = session_dir / "images"
+    if not images_dir.exists():
+        return []
+    processed_files = set(load_metadata(session_dir)["images"])
+    return sorted(
+        f.name for f in images_dir.iterdir()
+        if f.is_file() and not f.name.startswith(".") and f.name not in processed_files
+    )
+
+
+def _read_progress(session_id: str) -> Optional[dict]:
+    """
+    The persisted progress file; a "running" job whose process is gone (or is
+    this process, which does not know it) is reported as "interrupted".
+    """
+    path = BASE_DIR / session_id / PROGRESS_FILENAME
+    if not path.exists():
+        return None
+    with open(path, "r") as f:
+        status = json.load(f)
+    owner = status.get("pid")
+    if status.get("status") == "running" and (owner == os.getpid() or not psutil.pid_exists(owner or 0)):
+        status["status"] = "interrupted"
+    return status
+
+
+def _write_progress(job: BackfillJob) -> None:
+    """Write the job's progress file. Caller holds the session lock."""
+    path = BASE_DIR / job.session_id / PROGRESS_FILENAME
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({**job.to_dict(), "pid": os.getpid()}, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _persist_progress(job: BackfillJob) -> None:
+    """Persist progress, first picking up a cancellation requested by another server worker."""
+    session_dir = BASE_DIR / job.session_id
+    if not session_dir.exists():
+        return
+    with session_lock(session_dir):
+        path = session_dir / PROGRESS_FILENAME
+        if path.exists():
+            with open(path, "r") as f:
+                persisted = json.load(f)
+            if persisted.get("pid") == os.getpid() and persisted.get("cancelRequested"):
+                job.cancel_requested = True
+        _write_progress(job)
+
+
+async def _run_job(job: BackfillJob) -> None:
+    images_dir = BASE_DIR / job.session_id / "images"
+    try:
+        for chunk in chunked(job.files, job.chunk_size):
+            if job.cancel_requested:
+                job.status = "cancelled"
+                break
+            paths = [images_dir / name for name in chunk]
+            future = await asyncio.to_thread(submit_images, job.session_id, paths, False)
+            job.reservation.release(len(chunk))
+            await asyncio.wrap_future(future)
+            job.processed += len(chunk)
+            job.added_files.extend(chunk)
+            await asyncio.to_thread(_persist_progress, job)
+            logger.info(f"Backfill {job.session_id}: {job.processed}/{len(job.files)}")
+        else:
+            job.status = "completed"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.error(f"Backfill {job.session_id} failed after {job.processed} files: {e}")
+    finally:
+        job.reservation.release()
+        job.finished_at = datetime.utcnow().isoformat()
+        try:
+            await asyncio.to_thread(_persist_progress, job)
+        except OSError as e:
+            logger.warning(f"Could not persist backfill progress for {job.session_id}: {e}")
+
+
+def _claim_backfill(session_id: str, chunk_size: int) -> BackfillJob:
+    """Create the job under the session lock, so two workers cannot both start one."""
+    with session_lock(BASE_DIR / session_id):
+        status = _read_progress(session_id)
+        if status is not None and status.get("status") == "running":
+            raise BackfillRunning(status)
+        files = find_missing_files(session_id)
+        job = BackfillJob(session_id, files, chunk_size)
+        if not job.files:
+            job.status = "completed"
+            job.finished_at = job.started_at
+            return job
+        job.reservation = scheduler.admit(len(files))
+        try:
+            _write_progress(job)
+        except Exception:
+            job.reservation.release()
+            raise
+    return job
+
+
+async def start_backfill(session_id: str, chunk_size: int = BACKFILL_CHUNK_SIZE) -> BackfillJob:
+    """
+    Start (or resume) a backfill job for a session.
+    Returns the running job if one is already in progress. Resuming works because
+    completed chunks are already in metadata and are therefore no longer missing.
+    Raises SchedulerBusy when the inference queue cannot take the missing files,
+    and BackfillRunning when another server worker is backfilling the session.
+    """
+    job = _jobs.get(session_id)
+    if job is not None and job.status == "running":
+        return job
+
+    job = await asyncio.to_thread(_claim_backfill, session_id, chunk_size)
+    running = _jobs.get(session_id)
+    if running is not None and running.status == "running":
+        # A concurrent request in this worker claimed it first
+        if job.reservation is not None:
+            job.reservation.release()
+        return running
+    _jobs[session_id] = job
+    if job.files:
+        job.task = asyncio.create_task(_run_job(job))
+        logger.info(f"Started backfill {session_id}: {len(job.files)} files in chunks of {chunk_size}")
+    return job
+
+
+def cancel_backfill(session_id: str) -> Optional[dict]:
+    """
+    Request cancellation; the job stops after the chunk currently being processed.
+    A job running in another server worker is flagged in its progress file.
+    Returns the job's status, or None if the session has no backfill job.
+    """
+    job = _jobs.get(session_id)
+    if job is not None and job.status == "running":
+        job.cancel_requested = True
+        return job.to_dict()
+
+    session_dir = BASE_DIR / session_id
+    if not session_dir.exists():
+        return job.to_dict() if job is not None else None
+    with session_lock(session_dir):
+        status = _read_progress(session_id)
+        if status is None or status.get("status") != "running":
+            return job.to_dict() if job is not None else status
+        status["cancelRequested"] = True
+        path = session_dir / PROGRESS_FILENAME
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(status, f, indent=4)
+        os.replace(tmp_path, path)
+    logger.info(f"Requested cancellation of backfill {session_id} running in process {status.get('pid')}")
+    return status
+
+
+def get_backfill_status(session_id: str) -> Optional[dict]:
+    """
+    Return job progress, falling back to the persisted progress file when the job
+    runs in another server worker, or ran in a previous process (reported as
+    "interrupted" if it never finished).
+    """
+    job = _jobs.get(session_id)
+    if job is not None:
+        return job.to_dict()
+    return _read_progress(session_id)
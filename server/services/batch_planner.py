@@ -0,0 +1,109 @@
+"""
+Memory-aware batch sizing for detector inference.
+Sizes batches from image dimensions and available memory, and shrinks them
+after memory pressure so peak RSS stays under the configured budget.
+"""
+
+from pathlib import Path
+from typing import List
+
+import psutil
+from PIL import Image
+
+from core.config import INFERENCE_MAX_BATCH, INFERENCE_MEMORY_BUDGET_MB
+from core.logger import setup_logger
+
+logger = setup_logger("batch_planner", "logs/batch_planner.log")
+
+# Decoded BGR frame (3 bytes/pixel) is held roughly three times per image:
+# the loader copy, Results.orig_img and the annotation copy.
+BYTES_PER_PIXEL = 9
+# Fraction of the budget above which the next batch is halved
+PRESSURE_FRACTION = 0.85
+
+
+def image_pixels(path: Path) -> int:
+    """
+    Return width * height from the image header without decoding pixel data.
+    """
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+        return width * height
+    except Exception as e:
+        logger.warning(f"Could not read dimensions of {path}: {e}")
+        return 4000 * 3000
+
+
+def is_out_of_memory(error: BaseException) -> bool:
+    """True for MemoryError and torch/OpenCV allocation failures."""
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+
+class AdaptiveBatcher:
+    """
+    Plans successive detector batches under a peak-RSS budget.
+
+    Args:
+        budget_mb: Peak RSS the process should stay under
+        max_batch: Upper bound on images per batch
+    """
+
+    def __init__(self, budget_mb: int = INFERENCE_MEMORY_BUDGET_MB, max_batch: int = INFERENCE_MAX_BATCH):
+        self.budget = budget_mb * 1024 * 1024
+        self.max_batch = max(1, max_batch)
+        self.cap = self.max_batch
+        self.process = psutil.Process()
+        self.batch_sizes: List[int] = []
+        self.peak_rss = self.process.memory_info().rss
+
+    def headroom(self) -> int:
+        """Bytes that can still be allocated without breaching budget or system memory."""
+        rss = self.process.memory_info().rss
+        available = psutil.virtual_memory().available
+        return max(0, min(self.budget - rss, int(available * 0.8)))
+
+    def next_batch(self, pending: List[Path]) -> List[Path]:
+        """
+        Take as many of the pending images as fit in the current headroom.
+        Always returns at least one image so progress is guaranteed.
+        """
+        headroom = self.headroom()
+        batch: List[Path] = []
+        used = 0
+        for path in pending[:self.cap]:
+            cost = image_pixels(path) * BYTES_PER_PIXEL
+            if batch and used + cost > headroom:
+                break
+            batch.append(path)
+            used += cost
+        return batch
+
+    def record_batch(self, size: int) -> None:
+        """Record a completed batch and shrink the cap if RSS came close to the budget."""
+        rss = self.process.memory_info().rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.batch_sizes.append(size)
+        if rss > self.budget * PRESSURE_FRACTION and self.cap > 1:
+            self.cap = max(1, size // 2)
+            logger.warning(f"RSS {rss / 2**20:.0f} MB near budget; batch cap reduced to {self.cap}")
+
+    def on_memory_error(self, size: int) -> bool:
+        """
+        Halve the cap after an allocation failure.
+
+        Returns:
+            bool: True if the batch should be retried with a smaller size
+        """
+        if size <= 1:
+            return False
+        self.cap = max(1, size // 2)
+        logger.warning(f"Out of memory with batch of {size}; retrying with cap {self.cap}")
+        return True
+
+    def report(self) -> dict:
+        return {
+            "batchSizes": self.batch_sizes,
+            "peakRssMB": round(self.peak_rss / 2**20, 1),
+            "budgetMB": round(self.budget / 2**20, 1),
+        }
@@ -0,0 +1,154 @@
+"""
+Near-duplicate frame detection with perceptual hashes.
+Each session keeps a compact index of 64-bit difference hashes (8 bytes per
+image) that is compared with vectorised XOR + popcount, so lookups stay fast for
+tens of thousands of images.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from core.config import DEDUP_HAMMING_THRESHOLD
+from core.logger import setup_logger
+from services.detection_store import RAW_STORE_DIRNAME, DetectionStore
+from services.metadata_service import session_lock
+from services.postprocess import keep_original
+
+logger = setup_logger("dedup_service", "logs/dedup_service.log")
+
+HASHES_FILENAME = "phash.npy"
+NAMES_FILENAME = "phash_names.json"
+
+# Bit count for every byte value, used to popcount uint64 hashes viewed as bytes
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(path: Path) -> int:
+    """
+    64-bit difference hash of an image: compares neighbouring pixels of a 9x8
+    grayscale thumbnail, so it is insensitive to resolution and recompression.
+    JPEGs are decoded at 1/8 scale to keep hashing cheap.
+    """
+    img = cv2.imread(str(path), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        raise ValueError(f"Could not decode {path}")
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming_distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    """Hamming distance from `value` to every hash in a uint64 array."""
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return _POPCOUNT8[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HashIndex:
+    """Perceptual hashes of one session's processed images."""
+
+    def __init__(self, session_dir: Path):
+        self.session_dir = session_dir
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.names: List[str] = []
+        hashes_path = session_dir / HASHES_FILENAME
+        names_path = session_dir / NAMES_FILENAME
+        if hashes_path.exists() and names_path.exists():
+            self.hashes = np.load(hashes_path)
+            with open(names_path, "r") as f:
+                self.names = json.load(f)
+
+    def nearest(self, value: int) -> Tuple[int, int]:
+        """Return (index, distance) of the closest hash, or (-1, 65) if empty."""
+        if not len(self.hashes):
+            return -1, 65
+        distances = hamming_distances(self.hashes, value)
+        idx = int(distances.argmin())
+        return idx, int(distances[idx])
+
+    def add(self, name: str, value: int) -> None:
+        self.hashes = np.append(self.hashes, np.uint64(value))
+        self.names.append(name)
+
+    def remove(self, name: str) -> None:
+        keep = [i for i, n in enumerate(self.names) if n != name]
+        self.hashes = self.hashes[keep]
+        self.names = [self.names[i] for i in keep]
+
+    def save(self) -> None:
+        hashes_path = self.session_dir / HASHES_FILENAME
+        tmp = hashes_path.with_name(f".{hashes_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, self.hashes)
+        os.replace(tmp, hashes_path)
+        names_path = self.session_dir / NAMES_FILENAME
+        tmp = names_path.with_name(f".{names_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.names, f)
+        os.replace(tmp, names_path)
+
+
+def find_duplicates(session_dir: Path, paths: List[Path], threshold: int = DEDUP_HAMMING_THRESHOLD) -> Dict[str, str]:
+    """
+    Hash new images and match them against the session and earlier images in
+    the same upload. Unique images are added to the index.
+
+    Returns:
+        dict: duplicate file name -> name of the image it duplicates
+    """
+    duplicates: Dict[str, str] = {}
+    with session_lock(session_dir):
+        index = HashIndex(session_dir)
+        for path in paths:
+            try:
+                value = dhash(path)
+            except ValueError as e:
+                logger.warning(str(e))
+                continue
+            idx, distance = index.nearest(value)
+            if idx >= 0 and distance <= threshold and index.names[idx] != path.name:
+                duplicates[path.name] = index.names[idx]
+                continue
+            if idx >= 0 and index.names[idx] == path.name:
+                # Re-upload of the same file name replaces the old hash
+                index.remove(path.name)
+            index.add(path.name, value)
+        index.save()
+    if duplicates:
+        logger.info(f"{session_dir.name}: {len(duplicates)} near-duplicates skipped: {duplicates}")
+    return duplicates
+
+
+def forget_image(session_dir: Path, name: str) -> None:
+    """Drop a deleted image from the session's hash index."""
+    if not (session_dir / HASHES_FILENAME).exists():
+        return
+    with session_lock(session_dir):
+        index = HashIndex(session_dir)
+        index.remove(name)
+        index.save()
+
+
+def reuse_outputs(output_dir: Path, duplicate: str, original: str) -> None:
+    """
+    Give a duplicate the original's annotated image and detections. Sessions
+    processed before the detection store existed only have YOLO label files,
+    which are copied instead (they are normalised, so they fit either copy).
+    """
+    annotated = output_dir / "images" / original
+    if annotated.exists():
+        uploaded = output_dir / "images" / duplicate
+        if uploaded.exists():
+            keep_original(uploaded, output_dir)
+        shutil.copyfile(annotated, uploaded)
+    DetectionStore(output_dir, RAW_STORE_DIRNAME).copy(duplicate, original)
+    if DetectionStore(output_dir).copy(duplicate, original):
+        return
+    label = output_dir / "labels" / f"{Path(original).stem}.txt"
+    if label.exists():
+        shutil.copyfile(label, output_dir / "labels" / f"{Path(duplicate).stem}.txt")
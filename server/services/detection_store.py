@@ -0,0 +1,309 @@
+"""
+Columnar detection store for a session.
+All boxes of a session live in a handful of flat binary column files under
+`<session>/detections/` that are appended batch by batch and read back through
+np.memmap, so analysis and re-rendering never open one label file per image.
+YOLO text labels are generated from the store on export.
+
+Layout:
+    boxes.f32      N x 4 float32, xyxy in pixels
+    scores.f32     N float32 confidences
+    classes.u8     N uint8 class ids
+    image_idx.u32  N uint32 row in the image table
+    images.json    image table (name, width, height, start, count, live) and the
+                   committed row count; rewritten atomically after the columns are
+                   appended, so it is the commit point for readers and crash recovery
+
+`detections_raw/` holds the same layout for the permissive, pre-post-processing
+detector output that re-thresholding starts from.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from core.logger import setup_logger
+
+logger = setup_logger("detection_store", "logs/detection_store.log")
+
+STORE_DIRNAME = "detections"
+RAW_STORE_DIRNAME = "detections_raw"
+TABLE_FILENAME = "images.json"
+LOCK_FILENAME = ".lock"
+
+# column name -> (dtype, values per row)
+COLUMNS = {
+    "boxes.f32": (np.float32, 4),
+    "scores.f32": (np.float32, 1),
+    "classes.u8": (np.uint8, 1),
+    "image_idx.u32": (np.uint32, 1),
+}
+# Rewrite the columns once superseded/deleted rows outnumber live ones
+COMPACT_MIN_DEAD_ROWS = 10000
+
+
+class ImageDetections(NamedTuple):
+    """Detections of one image; arrays may be read-only memmap views."""
+    name: str
+    width: int
+    height: int
+    boxes: np.ndarray    # (n, 4) xyxy pixels
+    scores: np.ndarray   # (n,)
+    classes: np.ndarray  # (n,)
+
+
+def store_dir(session_dir: Path, dirname: str = STORE_DIRNAME) -> Path:
+    return session_dir / dirname
+
+
+def from_result(name: str, res) -> ImageDetections:
+    """Convert an Ultralytics Results object into an ImageDetections record."""
+    height, width = res.orig_shape
+    if res.boxes is None or not len(res.boxes):
+        boxes = np.zeros((0, 4), dtype=np.float32)
+        scores = np.zeros(0, dtype=np.float32)
+        classes = np.zeros(0, dtype=np.uint8)
+    else:
+        boxes = res.boxes.xyxy.cpu().numpy().astype(np.float32)
+        scores = res.boxes.conf.cpu().numpy().astype(np.float32)
+        classes = res.boxes.cls.cpu().numpy().astype(np.uint8)
+    return ImageDetections(name, int(width), int(height), boxes, scores, classes)
+
+
+def yolo_label_text(det: ImageDetections) -> str:
+    """Render detections in YOLO label format (class cx cy w h, normalised)."""
+    lines = []
+    for (x1, y1, x2, y2), cls_id in zip(det.boxes.tolist(), det.classes.tolist()):
+        cx = (x1 + x2) / 2 / det.width
+        cy = (y1 + y2) / 2 / det.height
+        w = (x2 - x1) / det.width
+        h = (y2 - y1) / det.height
+        lines.append(f"{cls_id} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n")
+    return "".join(lines)
+
+
+class DetectionStore:
+    """Append-only columnar detections of one session (or bulk output folder)."""
+
+    def __init__(self, session_dir: Path, dirname: str = STORE_DIRNAME):
+        self.path = store_dir(session_dir, dirname)
+
+    # -- locking and table ------------------------------------------------
+
+    @contextmanager
+    def _locked(self, shared: bool = False):
+        """
+        Serialise writers across threads and processes (each open() gets its own
+        flock). Readers take the lock shared while loading the table and mapping
+        the columns, so compaction never swaps files underneath them.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / LOCK_FILENAME, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _load_table(self) -> dict:
+        try:
+            with open(self.path / TABLE_FILENAME, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"rows": 0, "images": []}
+
+    def _save_table(self, table: dict) -> None:
+        path = self.path / TABLE_FILENAME
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(table, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _latest(table: dict) -> Dict[str, int]:
+        """Map image name -> index of its live record in the image table."""
+        return {img["name"]: i for i, img in enumerate(table["images"]) if img["live"]}
+
+    def _truncate_uncommitted(self, rows: int) -> None:
+        """Drop bytes appended by a writer that died before committing the table."""
+        for column, (dtype, width) in COLUMNS.items():
+            path = self.path / column
+            expected = rows * width * np.dtype(dtype).itemsize
+            if path.exists() and path.stat().st_size != expected:
+                os.truncate(path, expected)
+
+    # -- writing ----------------------------------------------------------
+
+    def append(self, detections: Iterable[ImageDetections]) -> None:
+        """
+        Append detections for several images. A name that is already stored is
+        superseded (its old rows stay in the columns until compaction).
+        """
+        detections = list(detections)
+        if not detections:
+            return
+        with self._locked():
+            table = self._load_table()
+            self._truncate_uncommitted(table["rows"])
+            latest = self._latest(table)
+
+            rows = table["rows"]
+            columns = {name: [] for name in COLUMNS}
+            for det in detections:
+                if det.name in latest:
+                    table["images"][latest[det.name]]["live"] = False
+                latest[det.name] = len(table["images"])
+                count = len(det.scores)
+                table["images"].append({
+                    "name": det.name, "width": det.width, "height": det.height,
+                    "start": rows, "count": count, "live": True,
+                })
+                columns["boxes.f32"].append(np.asarray(det.boxes, dtype=np.float32).reshape(-1, 4))
+                columns["scores.f32"].append(np.asarray(det.scores, dtype=np.float32))
+                columns["classes.u8"].append(np.asarray(det.classes, dtype=np.uint8))
+                columns["image_idx.u32"].append(np.full(count, latest[det.name], dtype=np.uint32))
+                rows += count
+
+            for column, parts in columns.items():
+                with open(self.path / column, "ab") as f:
+                    f.write(np.concatenate(parts).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            table["rows"] = rows
+            self._save_table(table)
+            self._maybe_compact(table)
+
+    def remove(self, name: str) -> None:
+        """Drop an image's detections (rows are reclaimed by compaction)."""
+        if not (self.path / TABLE_FILENAME).exists():
+            return
+        with self._locked():
+            table = self._load_table()
+            idx = self._latest(table).get(name)
+            if idx is None:
+                return
+            table["images"][idx]["live"] = False
+            self._save_table(table)
+
+    def copy(self, name: str, source: str) -> bool:
+        """Store `source`'s detections again under `name`; returns False if `source` is unknown."""
+        det = self.get(source)
+        if det is None:
+            return False
+        self.append([det._replace(name=name, boxes=np.array(det.boxes), scores=np.array(det.scores),
+                                  classes=np.array(det.classes))])
+        return True
+
+    def _maybe_compact(self, table: dict) -> None:
+        live_rows = sum(img["count"] for img in table["images"] if img["live"])
+        dead_rows = table["rows"] - live_rows
+        if dead_rows >= COMPACT_MIN_DEAD_ROWS and dead_rows > live_rows:
+            self._compact(table)
+
+    def _compact(self, table: dict) -> None:
+        """Rewrite the columns with live rows only. Caller holds the lock."""
+        columns = self._open_columns(table["rows"])
+        live = [img for img in table["images"] if img["live"]]
+        new_table = {"rows": 0, "images": []}
+        parts = {name: [] for name in COLUMNS}
+        for new_idx, img in enumerate(live):
+            sl = slice(img["start"], img["start"] + img["count"])
+            parts["boxes.f32"].append(np.array(columns["boxes.f32"][sl]))
+            parts["scores.f32"].append(np.array(columns["scores.f32"][sl]))
+            parts["classes.u8"].append(np.array(columns["classes.u8"][sl]))
+            parts["image_idx.u32"].append(np.full(img["count"], new_idx, dtype=np.uint32))
+            new_table["images"].append({**img, "start": new_table["rows"]})
+            new_table["rows"] += img["count"]
+        del columns
+
+        for column, (dtype, width) in COLUMNS.items():
+            data = np.concatenate(parts[column]) if parts[column] else np.zeros(0, dtype=dtype)
+            tmp = self.path / f".{column}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data.astype(dtype).tobytes())
+            os.replace(tmp, self.path / column)
+        self._save_table(new_table)
+        logger.info(f"Compacted {self.path}: {table['rows']} -> {new_table['rows']} rows")
+
+    # -- reading ----------------------------------------------------------
+
+    def _open_columns(self, rows: int) -> Dict[str, np.ndarray]:
+        columns = {}
+        for column, (dtype, width) in COLUMNS.items():
+            shape = (rows, width) if width > 1 else (rows,)
+            if rows == 0:
+                columns[column] = np.zeros(shape, dtype=dtype)
+            else:
+                columns[column] = np.memmap(self.path / column, dtype=dtype, mode="r", shape=shape)
+        return columns
+
+    def _snapshot(self) -> Tuple[dict, Dict[str, np.ndarray]]:
+        """Consistent (table, mapped columns) pair; mappings stay valid after the lock is released."""
+        if not self.path.exists():
+            return {"rows": 0, "images": []}, self._open_columns(0)
+        with self._locked(shared=True):
+            table = self._load_table()
+            return table, self._open_columns(table["rows"])
+
+    def columns(self) -> Tuple[Dict[str, np.ndarray], List[dict]]:
+        """
+        Memory-map the committed columns.
+
+        Returns:
+            (columns, images): read-only arrays keyed by column file name, and the
+            image table; rows whose image record has live=False are stale
+        """
+        table, columns = self._snapshot()
+        return columns, table["images"]
+
+    def get(self, name: str) -> Optional[ImageDetections]:
+        """Detections of one image, or None if it is not stored."""
+        table, columns = self._snapshot()
+        idx = self._latest(table).get(name)
+        if idx is None:
+            return None
+        img = table["images"][idx]
+        sl = slice(img["start"], img["start"] + img["count"])
+        return ImageDetections(
+            name, img["width"], img["height"],
+            columns["boxes.f32"][sl], columns["scores.f32"][sl], columns["classes.u8"][sl],
+        )
+
+    def names(self) -> List[str]:
+        return list(self._latest(self._load_table()))
+
+    def __iter__(self) -> Iterator[ImageDetections]:
+        """Iterate live images in insertion order, all served from one mapping."""
+        table, columns = self._snapshot()
+        for img in table["images"]:
+            if not img["live"]:
+                continue
+            sl = slice(img["start"], img["start"] + img["count"])
+            yield ImageDetections(
+                img["name"], img["width"], img["height"],
+                columns["boxes.f32"][sl], columns["scores.f32"][sl], columns["classes.u8"][sl],
+            )
+
+    def write_yolo_labels(self, label_dir: Path, names: Optional[Iterable[str]] = None) -> int:
+        """
+        Write `<stem>.txt` YOLO label files for all (or the given) images.
+
+        Returns:
+            int: Number of label files written
+        """
+        wanted = set(names) if names is not None else None
+        label_dir.mkdir(parents=True, exist_ok=True)
+        written = 0
+        for det in self:
+            if wanted is not None and det.name not in wanted:
+                continue
+            with open(label_dir / f"{Path(det.name).stem}.txt", "w") as f:
+                f.write(yolo_label_text(det))
+            written += 1
+        return written
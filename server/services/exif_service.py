@@ -0,0 +1,90 @@
+"""
+EXIF/GPS metadata extraction for uploaded survey images.
+Reads capture time, GPS position and altitude from the original file headers
+(before annotation overwrites the image without EXIF).
+"""
+
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from PIL import Image
+
+from core.logger import setup_logger
+
+logger = setup_logger("exif_service", "logs/exif_service.log")
+
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+TAG_DATETIME = 306
+TAG_DATETIME_ORIGINAL = 36867
+# DJI drones store height above the take-off point in XMP
+DJI_RELATIVE_ALTITUDE = re.compile(rb'drone-dji:RelativeAltitude="?([+-]?\d+(?:\.\d+)?)')
+
+
+def _dms_to_degrees(dms, ref: Optional[str]) -> Optional[float]:
+    try:
+        degrees, minutes, seconds = (float(v) for v in dms)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    value = degrees + minutes / 60.0 + seconds / 3600.0
+    return -value if ref in ("S", "W") else value
+
+
+def _parse_exif_datetime(value) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S").isoformat()
+    except ValueError:
+        return None
+
+
+def extract_image_metadata(path: Path) -> dict:
+    """
+    Extract capture time and position from an image.
+
+    Returns:
+        dict: capturedAt (ISO), latitude, longitude, altitude (m above sea level)
+              and relativeAltitude (m above take-off, DJI only); missing values are None
+    """
+    info = {"capturedAt": None, "latitude": None, "longitude": None, "altitude": None, "relativeAltitude": None}
+    try:
+        with Image.open(path) as img:
+            exif = img.getexif()
+            exif_ifd = exif.get_ifd(EXIF_IFD)
+            info["capturedAt"] = (
+                _parse_exif_datetime(exif_ifd.get(TAG_DATETIME_ORIGINAL))
+                or _parse_exif_datetime(exif.get(TAG_DATETIME))
+            )
+            gps = exif.get_ifd(GPS_IFD)
+            if gps:
+                info["latitude"] = _dms_to_degrees(gps.get(2), gps.get(1))
+                info["longitude"] = _dms_to_degrees(gps.get(4), gps.get(3))
+                if gps.get(6) is not None:
+                    altitude = float(gps[6])
+                    info["altitude"] = -altitude if gps.get(5) == b"\x01" or gps.get(5) == 1 else altitude
+    except Exception as e:
+        logger.warning(f"Could not read EXIF from {path}: {e}")
+
+    try:
+        with open(path, "rb") as f:
+            match = DJI_RELATIVE_ALTITUDE.search(f.read(256 * 1024))
+        if match:
+            info["relativeAltitude"] = float(match.group(1))
+    except OSError:
+        pass
+    return info
+
+
+def extract_batch(paths: Iterable[Path]) -> Dict[str, dict]:
+    """Extract metadata for several images, keyed by file name."""
+    return {path.name: extract_image_metadata(path) for path in paths}
+
+
+def format_captured_date(captured_at: Optional[str]) -> Optional[str]:
+    """Convert an ISO timestamp to the DD/MM/YYYY form used in session metadata."""
+    if not captured_at:
+        return None
+    return datetime.fromisoformat(captured_at).strftime("%d/%m/%Y")
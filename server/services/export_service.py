@@ -0,0 +1,115 @@
+"""
+Streaming export of complete session results for the Dugong Classification system.
+Builds a ZIP of annotated images, YOLO label files and the session CSV on the fly,
+yielding compressed bytes as they are produced (no temp archive, flat memory).
+Label files are rendered from the session's DetectionStore.
+"""
+
+import io
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from core.logger import setup_logger
+from services.detection_store import DetectionStore, yolo_label_text
+from services.metadata_service import load_metadata, write_metadata_csv
+
+logger = setup_logger("export_service", "logs/export_service.log")
+
+COPY_SIZE = 1024 * 1024
+# Already-compressed formats are stored; deflating them only costs CPU
+STORED_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Unseekable write target that collects bytes until drained. zipfile detects
+    that it cannot seek and writes data descriptors instead of patching headers.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_session_files(session_dir: Path, folder: str = "images") -> Iterator[Tuple[str, Path]]:
+    """Yield (archive name, path) for the files of a session subfolder."""
+    directory = session_dir / folder
+    if not directory.is_dir():
+        return
+    for path in sorted(directory.iterdir()):
+        if path.is_file() and not path.name.startswith("."):
+            yield f"{folder}/{path.name}", path
+
+
+def iter_label_files(session_dir: Path) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (archive name, YOLO label text) for every stored image, followed by
+    label files of images processed before the detection store existed.
+    """
+    stored = set()
+    for det in DetectionStore(session_dir):
+        arcname = f"labels/{Path(det.name).stem}.txt"
+        stored.add(arcname)
+        yield arcname, yolo_label_text(det).encode("utf-8")
+    for arcname, path in iter_session_files(session_dir, "labels"):
+        if arcname not in stored:
+            try:
+                yield arcname, path.read_bytes()
+            except FileNotFoundError:
+                continue
+
+
+def stream_session_zip(session_dir: Path) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive of the session's results chunk by chunk.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        for arcname, path in iter_session_files(session_dir):
+            try:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                info.compress_type = (
+                    zipfile.ZIP_STORED if path.suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+                )
+                with open(path, "rb") as src, archive.open(info, "w", force_zip64=True) as dst:
+                    while True:
+                        data = src.read(COPY_SIZE)
+                        if not data:
+                            break
+                        dst.write(data)
+                        yield sink.drain()
+            except FileNotFoundError:
+                # Deleted while the export was running
+                logger.warning(f"Skipped {path} (removed during export)")
+                continue
+            yield sink.drain()
+
+        for arcname, data in iter_label_files(session_dir):
+            archive.writestr(
+                zipfile.ZipInfo(arcname, date_time=time.localtime()[:6]), data, compress_type=zipfile.ZIP_DEFLATED
+            )
+            yield sink.drain()
+
+        csv_buffer = io.StringIO()
+        write_metadata_csv(load_metadata(session_dir), csv_buffer)
+        archive.writestr(
+            zipfile.ZipInfo(f"{session_dir.name}.csv", date_time=time.localtime()[:6]),
+            csv_buffer.getvalue().encode("utf-8"),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+    yield sink.drain()
+    logger.info(f"Streamed session archive for {session_dir.name}")
+
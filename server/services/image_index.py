@@ -0,0 +1,335 @@
+"""
+Spatial and temporal index over images in all live sessions.
+Stored in SQLite next to the uploads folder (outside the static mount) so that
+bounding-box and date-range queries do not read any session metadata files.
+
+The same database keeps running totals (images, counts, feeding/resting split)
+per session, per session and captured date, and per captured date across all
+sessions. They are adjusted by the difference between an image's old and new
+row inside the write transaction, so reading them never scans image rows.
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from core.config import INDEX_DB_PATH
+from core.logger import setup_logger
+
+logger = setup_logger("image_index", "logs/image_index.log")
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    session_id TEXT NOT NULL,
+    image_name TEXT NOT NULL,
+    captured_at TEXT,
+    latitude REAL,
+    longitude REAL,
+    altitude REAL,
+    dugong_count INTEGER NOT NULL DEFAULT 0,
+    calf_count INTEGER NOT NULL DEFAULT 0,
+    total_count INTEGER NOT NULL DEFAULT 0,
+    image_class TEXT,
+    PRIMARY KEY (session_id, image_name)
+);
+CREATE INDEX IF NOT EXISTS idx_images_position ON images (latitude, longitude);
+CREATE INDEX IF NOT EXISTS idx_images_captured_at ON images (captured_at);
+CREATE TABLE IF NOT EXISTS session_date_totals (
+    session_id TEXT NOT NULL,
+    captured_date TEXT NOT NULL,
+    images INTEGER NOT NULL DEFAULT 0,
+    dugong_count INTEGER NOT NULL DEFAULT 0,
+    calf_count INTEGER NOT NULL DEFAULT 0,
+    total_count INTEGER NOT NULL DEFAULT 0,
+    feeding INTEGER NOT NULL DEFAULT 0,
+    resting INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, captured_date)
+);
+CREATE TABLE IF NOT EXISTS session_totals (
+    session_id TEXT PRIMARY KEY,
+    images INTEGER NOT NULL DEFAULT 0,
+    dugong_count INTEGER NOT NULL DEFAULT 0,
+    calf_count INTEGER NOT NULL DEFAULT 0,
+    total_count INTEGER NOT NULL DEFAULT 0,
+    feeding INTEGER NOT NULL DEFAULT 0,
+    resting INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS date_totals (
+    captured_date TEXT PRIMARY KEY,
+    images INTEGER NOT NULL DEFAULT 0,
+    dugong_count INTEGER NOT NULL DEFAULT 0,
+    calf_count INTEGER NOT NULL DEFAULT 0,
+    total_count INTEGER NOT NULL DEFAULT 0,
+    feeding INTEGER NOT NULL DEFAULT 0,
+    resting INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+AGGREGATE_COLUMNS = ("images", "dugong_count", "calf_count", "total_count", "feeding", "resting")
+UNKNOWN_DATE = "unknown"
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's connection to the index database, creating the schema once."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        INDEX_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(INDEX_DB_PATH), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+        if conn.execute("SELECT 1 FROM images LIMIT 1").fetchone() and not conn.execute(
+            "SELECT 1 FROM session_totals LIMIT 1"
+        ).fetchone():
+            # Index built before aggregates existed
+            rebuild_aggregates()
+    return conn
+
+
+@contextmanager
+def _write_transaction():
+    """
+    Exclusive write transaction: old rows are read and aggregates adjusted
+    atomically with respect to other threads and worker processes.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def _contribution(captured_at, dugong, calf, total, image_class) -> tuple:
+    """Return (captured date, values) one image adds to the aggregates, in AGGREGATE_COLUMNS order."""
+    image_class = (image_class or "").lower()
+    return (
+        captured_at[:10] if captured_at else UNKNOWN_DATE,
+        (1, dugong or 0, calf or 0, total or 0, int(image_class == "feeding"), int(image_class == "resting")),
+    )
+
+
+def _row_contribution(row: sqlite3.Row) -> tuple:
+    return _contribution(
+        row["captured_at"], row["dugong_count"], row["calf_count"], row["total_count"], row["image_class"]
+    )
+
+
+def _adjust(conn: sqlite3.Connection, session_id: str, captured_date: str, values: Iterable[int], sign: int) -> None:
+    """Add (sign=1) or subtract (sign=-1) one image's values from all aggregate tables."""
+    values = [sign * v for v in values]
+    sets = ", ".join(f"{c} = {c} + excluded.{c}" for c in AGGREGATE_COLUMNS)
+    cols = ", ".join(AGGREGATE_COLUMNS)
+    marks = ", ".join("?" for _ in AGGREGATE_COLUMNS)
+    conn.execute(
+        f"INSERT INTO session_date_totals (session_id, captured_date, {cols}) VALUES (?, ?, {marks}) "
+        f"ON CONFLICT (session_id, captured_date) DO UPDATE SET {sets}",
+        [session_id, captured_date, *values],
+    )
+    conn.execute(
+        f"INSERT INTO session_totals (session_id, {cols}) VALUES (?, {marks}) "
+        f"ON CONFLICT (session_id) DO UPDATE SET {sets}",
+        [session_id, *values],
+    )
+    conn.execute(
+        f"INSERT INTO date_totals (captured_date, {cols}) VALUES (?, {marks}) "
+        f"ON CONFLICT (captured_date) DO UPDATE SET {sets}",
+        [captured_date, *values],
+    )
+
+
+def _prune(conn: sqlite3.Connection) -> None:
+    """Drop aggregate rows that no longer cover any image."""
+    for table in ("session_date_totals", "session_totals", "date_totals"):
+        conn.execute(f"DELETE FROM {table} WHERE images <= 0")
+
+
+def rebuild_aggregates() -> None:
+    """Recompute all aggregate tables from the image rows."""
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in ("session_date_totals", "session_totals", "date_totals"):
+            conn.execute(f"DELETE FROM {table}")
+        for row in conn.execute("SELECT * FROM images").fetchall():
+            captured_date, values = _row_contribution(row)
+            _adjust(conn, row["session_id"], captured_date, values, 1)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def entry_captured_at(entry: dict) -> Optional[str]:
+    """Best-known capture time: EXIF timestamp, else the DD/MM/YYYY captured date."""
+    if entry.get("capturedAt"):
+        return entry["capturedAt"]
+    try:
+        return datetime.strptime(entry.get("capturedDate", ""), "%d/%m/%Y").isoformat()
+    except ValueError:
+        return None
+
+
+def upsert_images(session_id: str, entries: Dict[str, dict]) -> None:
+    """Insert or replace index rows for session images from their metadata entries."""
+    rows = [
+        (
+            session_id, name, entry_captured_at(entry),
+            entry.get("latitude"), entry.get("longitude"), entry.get("altitude"),
+            entry.get("dugongCount", 0), entry.get("motherCalfCount", 0),
+            entry.get("totalCount", 0), entry.get("imageClass"),
+        )
+        for name, entry in entries.items()
+    ]
+    with _write_transaction() as conn:
+        for row in rows:
+            old = conn.execute(
+                "SELECT * FROM images WHERE session_id = ? AND image_name = ?", (session_id, row[1])
+            ).fetchone()
+            if old is not None:
+                _adjust(conn, session_id, *_row_contribution(old), -1)
+            _adjust(conn, session_id, *_contribution(row[2], *row[6:10]), 1)
+            conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        _prune(conn)
+
+
+def remove_image(session_id: str, image_name: str) -> None:
+    with _write_transaction() as conn:
+        old = conn.execute(
+            "SELECT * FROM images WHERE session_id = ? AND image_name = ?", (session_id, image_name)
+        ).fetchone()
+        if old is None:
+            return
+        _adjust(conn, session_id, *_row_contribution(old), -1)
+        conn.execute("DELETE FROM images WHERE session_id = ? AND image_name = ?", (session_id, image_name))
+        _prune(conn)
+
+
+def remove_session(session_id: str) -> None:
+    with _write_transaction() as conn:
+        cols = ", ".join(AGGREGATE_COLUMNS)
+        for row in conn.execute(
+            f"SELECT captured_date, {cols} FROM session_date_totals WHERE session_id = ?", (session_id,)
+        ).fetchall():
+            conn.execute(
+                f"UPDATE date_totals SET {', '.join(f'{c} = {c} - ?' for c in AGGREGATE_COLUMNS)} "
+                f"WHERE captured_date = ?",
+                [*(row[c] for c in AGGREGATE_COLUMNS), row["captured_date"]],
+            )
+        conn.execute("DELETE FROM session_date_totals WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM session_totals WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM images WHERE session_id = ?", (session_id,))
+        _prune(conn)
+
+
+def _totals(row) -> dict:
+    values = dict(row) if row is not None else {c: 0 for c in AGGREGATE_COLUMNS}
+    return {
+        "images": values["images"],
+        "dugongCount": values["dugong_count"],
+        "motherCalfCount": values["calf_count"],
+        "totalCount": values["total_count"],
+        "feeding": values["feeding"],
+        "resting": values["resting"],
+    }
+
+
+def aggregates(session_id: Optional[str] = None) -> dict:
+    """
+    Running totals for one session, or for all sessions when session_id is None,
+    with a per-captured-date breakdown (dates are YYYY-MM-DD or "unknown").
+    """
+    conn = get_connection()
+    cols = ", ".join(AGGREGATE_COLUMNS)
+    if session_id is not None:
+        totals = conn.execute(f"SELECT {cols} FROM session_totals WHERE session_id = ?", (session_id,)).fetchone()
+        by_date = conn.execute(
+            f"SELECT captured_date, {cols} FROM session_date_totals WHERE session_id = ? ORDER BY captured_date",
+            (session_id,),
+        ).fetchall()
+    else:
+        totals = conn.execute(
+            f"SELECT {', '.join(f'COALESCE(SUM({c}), 0) AS {c}' for c in AGGREGATE_COLUMNS)} FROM date_totals"
+        ).fetchone()
+        by_date = conn.execute(f"SELECT captured_date, {cols} FROM date_totals ORDER BY captured_date").fetchall()
+    result = {
+        "totals": _totals(totals),
+        "byDate": [{"capturedDate": row["captured_date"], **_totals(row)} for row in by_date],
+    }
+    if session_id is None:
+        result["sessions"] = conn.execute("SELECT COUNT(*) FROM session_totals").fetchone()[0]
+    return result
+
+
+def search(
+    min_lat: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    min_lon: Optional[float] = None,
+    max_lon: Optional[float] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = 1000,
+) -> dict:
+    """
+    Find images inside a bounding box and/or capture-time range across sessions.
+
+    Args:
+        min_lat, max_lat, min_lon, max_lon: Bounding box in decimal degrees
+        start, end: Inclusive ISO date/time bounds on the capture time
+        limit: Maximum number of image rows returned (totals cover all matches)
+
+    Returns:
+        dict: Matching images and summed counts
+    """
+    clauses, params = [], []
+    for column, op, value in (
+        ("latitude", ">=", min_lat), ("latitude", "<=", max_lat),
+        ("longitude", ">=", min_lon), ("longitude", "<=", max_lon),
+    ):
+        if value is not None:
+            clauses.append(f"{column} {op} ?")
+            params.append(value)
+    if start:
+        clauses.append("captured_at >= ?")
+        params.append(start)
+    if end:
+        # A bare date includes the whole day
+        clauses.append("captured_at <= ?")
+        params.append(end if "T" in end else f"{end}T23:59:59.999999")
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    conn = get_connection()
+    totals = conn.execute(
+        f"SELECT COUNT(*) AS images, COALESCE(SUM(dugong_count), 0) AS dugongCount, "
+        f"COALESCE(SUM(calf_count), 0) AS motherCalfCount, COALESCE(SUM(total_count), 0) AS totalCount, "
+        f"COUNT(DISTINCT session_id) AS sessions FROM images {where}",
+        params,
+    ).fetchone()
+    rows = conn.execute(
+        f"SELECT * FROM images {where} ORDER BY captured_at LIMIT ?", [*params, limit]
+    ).fetchall()
+    return {
+        "totals": dict(totals),
+        "images": [
+            {
+                "sessionId": row["session_id"],
+                "imageName": row["image_name"],
+                "capturedAt": row["captured_at"],
+                "latitude": row["latitude"],
+                "longitude": row["longitude"],
+                "altitude": row["altitude"],
+                "dugongCount": row["dugong_count"],
+                "motherCalfCount": row["calf_count"],
+                "totalCount": row["total_count"],
+                "imageClass": row["image_class"],
+            }
+            for row in rows
+        ],
+    }
@@ -0,0 +1,394 @@
+"""
+Fair scheduling and admission control for model inference.
+All inference in a server process runs through one scheduler: work is queued
+per session and served by deficit round robin, so a session with a 500-image
+upload gets its share of the detector between the slices of everyone else's
+work instead of ahead of it. New work is refused up front (HTTP 429 with a
+Retry-After estimate) when the queue or memory is already beyond what the
+process can finish in reasonable time.
+
+With INFERENCE_MODE=queue, image slices go to the shared job queue instead
+(services.job_queue) and are run by inference_worker.py processes; admission
+then also counts the images waiting there. Mosaic and video windows, which are
+decoded in memory here, still run on this scheduler.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import psutil
+
+from core.config import (
+    INFERENCE_MEMORY_BUDGET_MB,
+    INFERENCE_MODE,
+    SCHEDULER_MAX_QUEUED_IMAGES,
+    SCHEDULER_MIN_FREE_MEMORY_MB,
+    SCHEDULER_SLICE_SIZE,
+)
+from core.logger import setup_logger
+from services import job_queue
+from services.batch_planner import PRESSURE_FRACTION
+from services.pipeline_service import process_session_images
+
+logger = setup_logger("inference_scheduler", "logs/inference_scheduler.log")
+
+# Images of credit a session earns per round-robin turn (times its weight)
+QUANTUM = SCHEDULER_SLICE_SIZE
+# Smoothing of the seconds-per-image estimate used for Retry-After
+EWMA_ALPHA = 0.2
+DEFAULT_SECONDS_PER_IMAGE = 2.0
+MAX_RETRY_AFTER = 600
+# Recent queue waits kept for the percentiles in metrics()
+WAIT_SAMPLES = 1000
+# Seconds the shared job queue's stats are reused for, so admission does not query it per request
+QUEUE_STATS_MAX_AGE = 2.0
+
+
+class SchedulerBusy(RuntimeError):
+    """Raised by admit() when new work cannot be accepted; carries a Retry-After hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class _Job:
+    __slots__ = ("session_id", "cost", "fn", "args", "kwargs", "future", "enqueued")
+
+    def __init__(self, session_id: str, cost: int, fn: Callable, args: tuple, kwargs: dict):
+        self.session_id = session_id
+        self.cost = max(1, cost)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class Reservation:
+    """
+    Images admitted by InferenceScheduler.admit() but not submitted yet. They
+    count against the queue limit until released, so concurrent requests cannot
+    all pass admission before any of them has queued its work.
+    """
+
+    def __init__(self, scheduler: "InferenceScheduler", cost: int):
+        self._scheduler = scheduler
+        self.remaining = cost
+
+    def release(self, cost: Optional[int] = None) -> None:
+        """Release `cost` images (default: all that remain) once they are submitted or dropped."""
+        with self._scheduler._cond:
+            released = self.remaining if cost is None else min(cost, self.remaining)
+            self.remaining -= released
+            self._scheduler._reserved_cost -= released
+
+    def __enter__(self) -> "Reservation":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+class InferenceScheduler:
+    """
+    Per-session fair queue in front of the models.
+
+    Args:
+        max_queued: Admission limit on queued images (cost units)
+        min_free_mb: Refuse new work when system memory available drops below this
+        workers: Threads running jobs; the models are not thread-safe, so keep 1
+    """
+
+    def __init__(self, max_queued: int = SCHEDULER_MAX_QUEUED_IMAGES,
+                 min_free_mb: int = SCHEDULER_MIN_FREE_MEMORY_MB, workers: int = 1):
+        self.max_queued = max_queued
+        self.min_free = min_free_mb * 1024 * 1024
+        self.workers = workers
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._deficit: Dict[str, int] = {}
+        self._weights: Dict[str, float] = {}
+        self._queued_cost = 0
+        self._running_cost = 0
+        self._reserved_cost = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._process = psutil.Process()
+        # RSS with the models loaded (see set_memory_baseline)
+        self._memory_baseline = 0
+        self._queue_stats: Optional[dict] = None
+        self._queue_stats_at = 0.0
+        self._queue_stats_lock = threading.Lock()
+        # metrics
+        self._seconds_per_image = DEFAULT_SECONDS_PER_IMAGE
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._images_done = 0
+
+    # -- admission --------------------------------------------------------
+
+    def _shared_queue_stats(self) -> Optional[dict]:
+        """job_queue.stats() at most QUEUE_STATS_MAX_AGE seconds old; None unless INFERENCE_MODE=queue."""
+        if INFERENCE_MODE != "queue":
+            return None
+        with self._queue_stats_lock:
+            if self._queue_stats is None or time.monotonic() - self._queue_stats_at > QUEUE_STATS_MAX_AGE:
+                self._queue_stats = job_queue.stats()
+                self._queue_stats_at = time.monotonic()
+            return self._queue_stats
+
+    def set_memory_baseline(self, rss: Optional[int] = None) -> None:
+        """
+        Record the process RSS once the models are loaded (default: now). The
+        admission memory check only counts usage above it, so models larger than
+        the budget do not get every request refused.
+        """
+        rss = self._process.memory_info().rss if rss is None else rss
+        budget = INFERENCE_MEMORY_BUDGET_MB * 1024 * 1024
+        if rss >= budget * PRESSURE_FRACTION:
+            logger.error(
+                f"Loaded models take {rss / 2**20:.0f} MB of the {INFERENCE_MEMORY_BUDGET_MB} MB "
+                f"INFERENCE_MEMORY_BUDGET_MB; raise it"
+                + ("" if rss < budget else " (admission now only checks free system memory)")
+            )
+        with self._cond:
+            self._memory_baseline = rss
+
+    def _over_memory_budget(self) -> bool:
+        """Whether RSS has used PRESSURE_FRACTION of the budget's headroom above the loaded models."""
+        budget = INFERENCE_MEMORY_BUDGET_MB * 1024 * 1024
+        baseline = self._memory_baseline
+        if baseline >= budget:
+            return False
+        return self._process.memory_info().rss > baseline + (budget - baseline) * PRESSURE_FRACTION
+
+    def retry_after(self, queue_stats: Optional[dict] = None) -> int:
+        """Seconds until the current backlog is expected to drain."""
+        backlog = self._reserved_cost + self._queued_cost + self._running_cost
+        seconds = backlog * self._seconds_per_image / self.workers
+        if queue_stats is not None:
+            queued = queue_stats["queuedImages"] + queue_stats["runningImages"]
+            per_image = queue_stats["secondsPerImage"] or DEFAULT_SECONDS_PER_IMAGE
+            seconds += queued * per_image / max(1, queue_stats["workers"])
+        return int(min(MAX_RETRY_AFTER, max(1, math.ceil(seconds))))
+
+    def admit(self, cost: int) -> Reservation:
+        """
+        Check that `cost` more images can be accepted and reserve them; raise
+        SchedulerBusy otherwise. Called once by request handlers before any work is
+        saved or queued, off the event loop since it may query the shared job queue.
+        The caller releases the reservation as the images are submitted, or if the
+        request fails before they are.
+        """
+        queue_stats = self._shared_queue_stats()
+        with self._cond:
+            reason = None
+            queued = self._reserved_cost + self._queued_cost + (queue_stats["queuedImages"] if queue_stats else 0)
+            if queued and queued + cost > self.max_queued:
+                reason = f"Inference queue is full ({queued} images waiting)"
+            elif psutil.virtual_memory().available < self.min_free:
+                reason = "Server is low on memory"
+            elif self._over_memory_budget():
+                reason = "Inference memory budget is exhausted"
+            if reason is None:
+                self._reserved_cost += cost
+                return Reservation(self, cost)
+            self._rejected += 1
+            retry = self.retry_after(queue_stats)
+        logger.warning(f"Rejected {cost} images: {reason}; retry after {retry}s")
+        raise SchedulerBusy(reason, retry)
+
+    # -- submission -------------------------------------------------------
+
+    def set_weight(self, session_id: str, weight: float) -> None:
+        """Give a session a larger (or smaller) share of the detector; default 1."""
+        with self._cond:
+            self._weights[session_id] = max(0.1, weight)
+
+    def submit(self, session_id: str, cost: int, fn: Callable, *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs) for a session; `cost` is the number of images it processes."""
+        job = _Job(session_id, cost, fn, args, kwargs)
+        with self._cond:
+            self._ensure_workers()
+            if session_id not in self._queues:
+                self._queues[session_id] = deque()
+                self._deficit[session_id] = 0
+            self._queues[session_id].append(job)
+            self._queued_cost += job.cost
+            self._cond.notify()
+        return job.future
+
+    def run(self, session_id: str, cost: int, fn: Callable, *args, **kwargs):
+        """Queue a job and block the calling thread until it finishes."""
+        return self.submit(session_id, cost, fn, *args, **kwargs).result()
+
+    async def run_async(self, session_id: str, cost: int, fn: Callable, *args, **kwargs):
+        """Queue a job and await it without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(session_id, cost, fn, *args, **kwargs))
+
+    # -- dispatch ---------------------------------------------------------
+
+    def _ensure_workers(self) -> None:
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"inference-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_job(self) -> _Job:
+        """
+        Deficit round robin over sessions with queued work. Caller holds the lock.
+        The session at the head of the rotation tops up its credit until its next
+        job fits, then moves to the back, so every session is served in turn in
+        proportion to its weight regardless of how much it has queued.
+        """
+        while True:
+            session_id, jobs = next(iter(self._queues.items()))
+            job = jobs[0]
+            if self._deficit[session_id] < job.cost:
+                self._deficit[session_id] += max(1, int(QUANTUM * self._weights.get(session_id, 1.0)))
+                self._queues.move_to_end(session_id)
+                continue
+            jobs.popleft()
+            self._deficit[session_id] -= job.cost
+            if not jobs:
+                # Idle sessions do not bank credit
+                del self._queues[session_id]
+                del self._deficit[session_id]
+            return job
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queues:
+                    self._cond.wait()
+                job = self._next_job()
+                self._queued_cost -= job.cost
+                self._running_cost += job.cost
+                wait = time.monotonic() - job.enqueued
+                self._waits.append(wait)
+
+            start = time.monotonic()
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except BaseException as e:
+                job.future.set_exception(e)
+                failed = True
+            else:
+                job.future.set_result(result)
+                failed = False
+            elapsed = time.monotonic() - start
+
+            with self._cond:
+                self._running_cost -= job.cost
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+                    self._images_done += job.cost
+                    per_image = elapsed / job.cost
+                    self._seconds_per_image += EWMA_ALPHA * (per_image - self._seconds_per_image)
+            logger.info(
+                f"Job for {job.session_id}: {job.cost} images, waited {wait:.2f}s, ran {elapsed:.2f}s"
+                + (" (failed)" if failed else "")
+            )
+
+    # -- metrics ----------------------------------------------------------
+
+    def metrics(self) -> dict:
+        """Queue depth per session, queue-wait percentiles and throughput counters."""
+        queue_stats = self._shared_queue_stats()
+        with self._cond:
+            waits = list(self._waits)
+            return {
+                "mode": INFERENCE_MODE,
+                "queuedImages": self._queued_cost,
+                "runningImages": self._running_cost,
+                "reservedImages": self._reserved_cost,
+                "queuedBySession": {s: sum(j.cost for j in q) for s, q in self._queues.items()},
+                "queueWaitSeconds": {
+                    "p50": _percentile(waits, 0.5),
+                    "p95": _percentile(waits, 0.95),
+                    "max": max(waits) if waits else None,
+                    "samples": len(waits),
+                },
+                "secondsPerImage": round(self._seconds_per_image, 3),
+                "retryAfter": self.retry_after(queue_stats),
+                "completedJobs": self._completed,
+                "failedJobs": self._failed,
+                "rejectedRequests": self._rejected,
+                "imagesProcessed": self._images_done,
+                "maxQueuedImages": self.max_queued,
+                "jobQueue": queue_stats,
+            }
+
+
+scheduler = InferenceScheduler()
+
+
+def submit_images(session_id: str, image_paths: List[Path], touch: bool = True,
+                  report: Optional[dict] = None) -> Future:
+    """
+    process_session_images for one slice of images saved in `<session>/images`:
+    on this process's scheduler, or as a job for the inference workers when
+    INFERENCE_MODE=queue. Either way the future resolves to the slice summary.
+    """
+    if INFERENCE_MODE == "queue":
+        return job_queue.client.submit(session_id, image_paths, touch, report)
+    return scheduler.submit(session_id, len(image_paths), process_session_images, session_id, image_paths,
+                            touch, report)
+
+
+def submit_image_slices(session_id: str, image_paths: List[Path], touch: bool = True,
+                        report: Optional[dict] = None) -> List[Tuple[Future, Optional[dict]]]:
+    """
+    submit_images for slices of SCHEDULER_SLICE_SIZE images, so other sessions
+    are served between them. Returns each slice's future and report.
+    """
+    slices = []
+    for start in range(0, len(image_paths), SCHEDULER_SLICE_SIZE):
+        paths = image_paths[start:start + SCHEDULER_SLICE_SIZE]
+        slice_report = {} if report is not None else None
+        slices.append((submit_images(session_id, paths, touch, slice_report), slice_report))
+    return slices
+
+
+def _merge_slices(results: List[Tuple[dict, Optional[dict]]], report: Optional[dict]) -> dict:
+    summary = {"processed": [], "duplicates": {}}
+    for result, slice_report in results:
+        summary["processed"].extend(result["processed"])
+        summary["duplicates"].update(result["duplicates"])
+        if report is not None and slice_report:
+            report.setdefault("slices", []).append(slice_report)
+    return summary
+
+
+def process_images_fairly(session_id: str, image_paths: List[Path], touch: bool = True,
+                          report: Optional[dict] = None) -> dict:
+    """
+    process_session_images through the scheduler in slices (see submit_image_slices).
+    Blocks until every slice is done; returns the merged summary.
+    """
+    slices = submit_image_slices(session_id, image_paths, touch, report)
+    return _merge_slices([(future.result(), slice_report) for future, slice_report in slices], report)
+
+
+async def gather_image_slices(slices: List[Tuple[Future, Optional[dict]]], report: Optional[dict] = None) -> dict:
+    """Await the slices from submit_image_slices without holding a thread; returns the merged summary."""
+    results = [(await asyncio.wrap_future(future), slice_report) for future, slice_report in slices]
+    return _merge_slices(results, report)
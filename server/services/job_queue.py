@@ -0,0 +1,384 @@
+"""
+Durable inference job queue for the split deployment (INFERENCE_MODE=queue).
+The API enqueues slices of images saved in a session; inference_worker.py
+processes on any node that mounts the same uploads volume lease the jobs, run
+the pipeline and write the results into the session folder, then mark the job
+done. Jobs live in SQLite next to the uploads folder, in rollback-journal mode:
+WAL keeps its index in shared memory, which processes on different nodes of a
+network filesystem do not share, so it is only safe on a single host.
+
+Delivery is at least once: a worker renews its lease while it runs a job; a job
+whose lease expires (worker crashed or unreachable) or that raised is queued
+again with exponential backoff, up to JOB_MAX_ATTEMPTS attempts. Running a job
+twice is harmless because the worker sets the slice's original images aside
+until the job is done (see stage_images), so every attempt starts from the same
+input and overwrites the same outputs.
+
+Sessions take turns: a new job goes in the round after its session's previous
+waiting job, but no earlier than the oldest waiting round, and workers take
+jobs round by round, so a large upload does not hold back a small one.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from core.config import (
+    BASE_DIR,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_QUEUE_PATH,
+    JOB_RETRY_BACKOFF_SECONDS,
+)
+from core.logger import setup_logger
+
+logger = setup_logger("job_queue", "logs/job_queue.log")
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    round INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT,
+    restored INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state_round ON jobs (state, round, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs (session_id, state);
+"""
+
+# Per-session folder holding the original images of unfinished jobs
+JOBS_DIRNAME = ".jobs"
+# Seconds between the API's checks for finished jobs
+POLL_INTERVAL = 0.5
+# Finished jobs are kept this long before purge() deletes them
+FINISHED_RETENTION_SECONDS = 24 * 3600
+# Recently finished jobs the seconds-per-image estimate is taken from
+RATE_SAMPLE_JOBS = 50
+
+
+class JobFailed(RuntimeError):
+    """A job failed on its last attempt; the message is its last error."""
+
+
+class Job(NamedTuple):
+    id: int
+    session_id: str
+    image_names: List[str]
+    touch: bool
+    want_report: bool
+    attempt: int
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's connection to the queue database, creating the schema once."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        JOB_QUEUE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(JOB_QUEUE_PATH), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def _write_transaction():
+    """Exclusive write transaction, so a job is leased by one worker process at a time."""
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# -- producer -----------------------------------------------------------------
+
+def enqueue(session_id: str, image_names: List[str], touch: bool = True, want_report: bool = False) -> int:
+    """Queue process_session_images for images saved in `<session>/images`. Returns the job id."""
+    now = time.time()
+    payload = json.dumps({"images": image_names, "touch": touch, "report": want_report})
+    with _write_transaction() as conn:
+        last = conn.execute(
+            "SELECT MAX(round) FROM jobs WHERE session_id = ? AND state IN ('queued', 'leased')", (session_id,)
+        ).fetchone()[0]
+        oldest = conn.execute("SELECT MIN(round) FROM jobs WHERE state = 'queued'").fetchone()[0]
+        job_round = max(last + 1 if last is not None else 0, oldest or 0)
+        cursor = conn.execute(
+            "INSERT INTO jobs (session_id, payload, cost, round, available_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, payload, max(1, len(image_names)), job_round, now, now),
+        )
+    return cursor.lastrowid
+
+
+def fetch(job_ids: Iterable[int]) -> Dict[int, sqlite3.Row]:
+    """State, result and error of jobs by id (purged jobs are missing)."""
+    job_ids = list(job_ids)
+    rows = {}
+    conn = get_connection()
+    for start in range(0, len(job_ids), 500):
+        chunk = job_ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(f"SELECT id, state, result, error FROM jobs WHERE id IN ({placeholders})", chunk):
+            rows[row["id"]] = row
+    return rows
+
+
+def stats() -> dict:
+    """Queued and running images, live workers and the recent seconds per image."""
+    now = time.time()
+    conn = get_connection()
+    by_state = {row["state"]: (row["jobs"], row["images"]) for row in conn.execute(
+        "SELECT state, COUNT(*) AS jobs, SUM(cost) AS images FROM jobs GROUP BY state"
+    )}
+    workers = conn.execute(
+        "SELECT COUNT(DISTINCT lease_owner) FROM jobs WHERE state = 'leased' AND lease_until >= ?", (now,)
+    ).fetchone()[0]
+    seconds, images = conn.execute(
+        "SELECT SUM(finished_at - started_at), SUM(cost) FROM (SELECT finished_at, started_at, cost FROM jobs "
+        "WHERE state = 'done' ORDER BY finished_at DESC LIMIT ?)", (RATE_SAMPLE_JOBS,)
+    ).fetchone()
+    return {
+        "queuedJobs": by_state.get("queued", (0, 0))[0],
+        "queuedImages": by_state.get("queued", (0, 0))[1] or 0,
+        "runningJobs": by_state.get("leased", (0, 0))[0],
+        "runningImages": by_state.get("leased", (0, 0))[1] or 0,
+        "doneJobs": by_state.get("done", (0, 0))[0],
+        "failedJobs": by_state.get("failed", (0, 0))[0],
+        "workers": workers,
+        "secondsPerImage": round(seconds / images, 3) if images else None,
+    }
+
+
+# -- consumer -----------------------------------------------------------------
+
+def _release(conn: sqlite3.Connection, job_id: int, attempts: int, error: str, now: float,
+             retry: bool = True) -> str:
+    """Queue a job again with backoff, or fail it when out of attempts. Returns the new state."""
+    if retry and attempts < JOB_MAX_ATTEMPTS:
+        delay = JOB_RETRY_BACKOFF_SECONDS * 2 ** max(0, attempts - 1)
+        conn.execute(
+            "UPDATE jobs SET state = 'queued', lease_owner = NULL, lease_until = NULL, error = ?, available_at = ? "
+            "WHERE id = ?", (error, now + delay, job_id),
+        )
+        logger.warning(f"Job {job_id} attempt {attempts} failed ({error}); retrying in {delay:.0f}s")
+        return "queued"
+    conn.execute(
+        "UPDATE jobs SET state = 'failed', lease_owner = NULL, lease_until = NULL, error = ?, finished_at = ? "
+        "WHERE id = ?", (error, now, job_id),
+    )
+    logger.error(f"Job {job_id} failed after {attempts} attempts: {error}")
+    return "failed"
+
+
+def claim(worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Job]:
+    """Lease the next job (requeueing jobs whose lease expired first), or None if nothing is due."""
+    now = time.time()
+    with _write_transaction() as conn:
+        for row in conn.execute(
+            "SELECT id, attempts, lease_owner FROM jobs WHERE state = 'leased' AND lease_until < ?", (now,)
+        ).fetchall():
+            _release(conn, row["id"], row["attempts"], f"lease of {row['lease_owner']} expired", now)
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE state = 'queued' AND available_at <= ? ORDER BY round, id LIMIT 1", (now,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET state = 'leased', attempts = attempts + 1, lease_owner = ?, lease_until = ?, "
+            "started_at = ? WHERE id = ?", (worker_id, now + lease_seconds, now, row["id"]),
+        )
+    payload = json.loads(row["payload"])
+    return Job(row["id"], row["session_id"], payload["images"], payload["touch"], payload["report"],
+               row["attempts"] + 1)
+
+
+def heartbeat(job_id: int, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+    """Extend a lease; False if the worker no longer holds it."""
+    with _write_transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+            (time.time() + lease_seconds, job_id, worker_id),
+        )
+    return cursor.rowcount == 1
+
+
+def complete(job_id: int, worker_id: str, result: dict) -> bool:
+    """
+    Mark a job done. Also accepted after the lease expired as long as no other
+    worker has taken the job since; returns False otherwise (the job will run again).
+    """
+    with _write_transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET state = 'done', result = ?, error = NULL, finished_at = ?, lease_owner = NULL, "
+            "lease_until = NULL, restored = 1 WHERE id = ? AND ((state = 'leased' AND lease_owner = ?) OR state = 'queued')",
+            (json.dumps(result), time.time(), job_id, worker_id),
+        )
+    return cursor.rowcount == 1
+
+
+def fail(job_id: int, worker_id: str, error: str, retry: bool = True) -> Optional[str]:
+    """Give up an attempt; returns the job's new state, or None if the lease was already lost."""
+    with _write_transaction() as conn:
+        row = conn.execute(
+            "SELECT attempts FROM jobs WHERE id = ? AND state = 'leased' AND lease_owner = ?", (job_id, worker_id)
+        ).fetchone()
+        if row is None:
+            return None
+        return _release(conn, job_id, row["attempts"], error, time.time(), retry)
+
+
+def purge(retention_seconds: float = FINISHED_RETENTION_SECONDS) -> int:
+    """Delete finished jobs older than the retention period. Returns the number deleted."""
+    with _write_transaction() as conn:
+        cursor = conn.execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'failed') AND restored = 1 AND finished_at < ?",
+            (time.time() - retention_seconds,),
+        )
+    return cursor.rowcount
+
+
+# -- staging ------------------------------------------------------------------
+
+def staging_dir(session_id: str, job_id: int) -> Path:
+    return BASE_DIR / session_id / JOBS_DIRNAME / str(job_id)
+
+
+def stage_images(job: Job) -> List[Path]:
+    """
+    Move a job's images from `<session>/images` into its staging folder and
+    return the staged paths. The pipeline reads the staged originals and writes
+    its annotated copies into `images/`, so a retry after a crash starts from
+    the untouched originals again. Images staged by an earlier attempt are
+    reused; images that no longer exist are left out.
+    """
+    session_dir = BASE_DIR / job.session_id
+    staging = staging_dir(job.session_id, job.id)
+    staging.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name in job.image_names:
+        staged = staging / name
+        if not staged.exists():
+            try:
+                os.rename(session_dir / "images" / name, staged)
+            except FileNotFoundError:
+                continue
+        paths.append(staged)
+    return paths
+
+
+def _remove_staging(staging: Path) -> None:
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        staging.parent.rmdir()
+    except OSError:
+        pass
+
+
+def finish_staging(job: Job) -> None:
+    """Drop the staged originals of a finished job (its outputs are in `images/`)."""
+    _remove_staging(staging_dir(job.session_id, job.id))
+
+
+def restore_failed() -> int:
+    """
+    Put the staged originals of failed jobs back into `images/`, so the images
+    are still there (unprocessed, for a backfill) after the queue gave up on
+    them. Returns the number of jobs restored.
+    """
+    conn = get_connection()
+    rows = conn.execute("SELECT id, session_id FROM jobs WHERE state = 'failed' AND restored = 0").fetchall()
+    for row in rows:
+        staging = staging_dir(row["session_id"], row["id"])
+        if staging.is_dir():
+            for staged in staging.iterdir():
+                try:
+                    os.replace(staged, BASE_DIR / row["session_id"] / "images" / staged.name)
+                except OSError as e:
+                    logger.warning(f"Could not restore {staged} of failed job {row['id']}: {e}")
+            _remove_staging(staging)
+        with _write_transaction() as write:
+            write.execute("UPDATE jobs SET restored = 1 WHERE id = ?", (row["id"],))
+    return len(rows)
+
+
+# -- API side -----------------------------------------------------------------
+
+class JobClient:
+    """Enqueues jobs from the API and resolves their futures once a worker has finished them."""
+
+    def __init__(self, poll_interval: float = POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._waiting: Dict[int, Tuple[Future, Optional[dict]]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, session_id: str, image_paths: List[Path], touch: bool = True,
+               report: Optional[dict] = None) -> Future:
+        """
+        Queue process_session_images for images in `<session>/images`. The future
+        resolves to its summary, or raises JobFailed; `report` is filled on success.
+        """
+        job_id = enqueue(session_id, [p.name for p in image_paths], touch, report is not None)
+        future: Future = Future()
+        with self._lock:
+            self._waiting[job_id] = (future, report)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._poll, name="job-queue-poller", daemon=True)
+                self._thread.start()
+        return future
+
+    def _poll(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                job_ids = list(self._waiting)
+            if not job_ids:
+                continue
+            try:
+                rows = fetch(job_ids)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not check job states: {e}")
+                continue
+            for job_id in job_ids:
+                row = rows.get(job_id)
+                if row is not None and row["state"] not in ("done", "failed"):
+                    continue
+                with self._lock:
+                    future, report = self._waiting.pop(job_id)
+                if row is None:
+                    future.set_exception(JobFailed(f"Job {job_id} is no longer in the queue"))
+                elif row["state"] == "failed":
+                    future.set_exception(JobFailed(row["error"] or f"Job {job_id} failed"))
+                else:
+                    result = json.loads(row["result"])
+                    slice_report = result.pop("report", None) or {}
+                    if report is not None:
+                        report.update(slice_report)
+                    future.set_result(result)
+
+
+client = JobClient()
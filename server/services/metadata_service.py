@@ -0,0 +1,268 @@
+"""
+Service for reading and writing per-session metadata in the Dugong Classification system.
+Shared by the API routes and the offline tools so both produce the same layout and CSV.
+"""
+
+import csv
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from core.logger import setup_logger
+from services import image_index
+from services.exif_service import format_captured_date
+
+logger = setup_logger("metadata_service", "logs/metadata_service.log")
+
+METADATA_FILENAME = "session_metadata.json"
+LOCK_FILENAME = ".metadata.lock"
+
+# Last touch_session() per session in this process (monotonic seconds)
+_touched: Dict[str, float] = {}
+
+
+def extract_captured_date(image_name: str) -> str:
+    """
+    Extract captured date from image filename.
+    Looks for pattern _YYYYMMDD in the filename.
+    Returns formatted date or 'N/A' if not found.
+    """
+    # Regular expression to match the pattern after first underscore with 8 digits (assumed to be YYYYMMDD)
+    match = re.search(r'_(\d{8})', image_name)
+
+    if not match:
+        return "N/A"
+
+    raw_date = match.group(1)
+    year = raw_date[:4]
+    month = raw_date[4:6]
+    day = raw_date[6:8]
+
+    # Basic date validation
+    try:
+        datetime(int(year), int(month), int(day))
+        return f"{day}/{month}/{year}"
+    except ValueError:
+        return "N/A"
+
+
+def metadata_path(session_dir: Path) -> Path:
+    """Return the metadata file path for a session folder."""
+    return session_dir / METADATA_FILENAME
+
+
+@contextmanager
+def session_lock(session_dir: Path):
+    """
+    Hold an exclusive lock on a session's metadata for a read-modify-write cycle.
+    Uses flock so concurrent requests, threads and worker processes are serialised.
+    """
+    session_dir.mkdir(parents=True, exist_ok=True)
+    with open(session_dir / LOCK_FILENAME, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def load_metadata(session_dir: Path) -> dict:
+    """
+    Load session metadata, returning an empty image table if none exists yet.
+    """
+    path = metadata_path(session_dir)
+    if not path.exists():
+        return {"images": {}}
+    with open(path, "r") as f:
+        metadata = json.load(f)
+    metadata.setdefault("images", {})
+    return metadata
+
+
+def save_metadata(session_dir: Path, metadata: dict) -> None:
+    """
+    Atomically write session metadata so readers never observe a partial file.
+    """
+    path = metadata_path(session_dir)
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def touch_session(session_dir: Path, min_interval: float = 0.0) -> None:
+    """
+    Refresh a session's last_activity (creating its metadata if needed) so the
+    cleanup task does not expire it. Skipped if this process touched the session
+    less than `min_interval` seconds ago, to keep per-chunk calls cheap.
+    """
+    now = time.monotonic()
+    if min_interval and now - _touched.get(session_dir.name, float("-inf")) < min_interval:
+        return
+    with session_lock(session_dir):
+        metadata = load_metadata(session_dir)
+        metadata["last_activity"] = datetime.utcnow().isoformat()
+        save_metadata(session_dir, metadata)
+    _touched[session_dir.name] = now
+
+
+def set_counts(entry: dict, dugong_count: int, calf_count: int) -> dict:
+    """Set an image entry's detection counts (a mother-calf pair counts as two animals)."""
+    entry["dugongCount"] = dugong_count
+    entry["motherCalfCount"] = calf_count
+    entry["totalCount"] = dugong_count + (2 * calf_count)
+    return entry
+
+
+def build_image_entry(
+    file_name: str, dugong_count: int, calf_count: int, image_class: str, exif: Optional[dict] = None
+) -> dict:
+    """
+    Build the per-image metadata record stored under metadata["images"].
+    The captured date comes from the EXIF timestamp when available, otherwise
+    from the _YYYYMMDD filename pattern.
+    """
+    exif = exif or {}
+    return {
+        "dugongCount": dugong_count,
+        "motherCalfCount": calf_count,
+        "totalCount": dugong_count + (2 * calf_count),
+        "imageClass": image_class.capitalize(),
+        "capturedDate": format_captured_date(exif.get("capturedAt")) or extract_captured_date(file_name),
+        "capturedAt": exif.get("capturedAt"),
+        "latitude": exif.get("latitude"),
+        "longitude": exif.get("longitude"),
+        "altitude": exif.get("altitude"),
+        "relativeAltitude": exif.get("relativeAltitude"),
+        "uploadedAt": datetime.utcnow().isoformat()
+    }
+
+
+def record_results(
+    session_dir: Path,
+    file_names: Iterable[str],
+    results: Iterable[Tuple[int, int, str, Path]],
+    touch: bool = True,
+    exif: Optional[Dict[str, dict]] = None,
+    index: bool = True,
+    model_version: Optional[str] = None,
+) -> dict:
+    """
+    Merge model results into the session metadata and persist it.
+
+    Args:
+        session_dir: Session folder holding the metadata file
+        file_names: Metadata keys, aligned with results
+        results: Tuples returned by run_model_on_images
+        touch: Whether to refresh last_activity
+        exif: Capture metadata from extract_batch, keyed by file name
+        index: Whether to add the images to the cross-session image index
+        model_version: Id of the model version that produced the results (stored as modelVersion)
+
+    Returns:
+        dict: The updated metadata
+    """
+    exif = exif or {}
+    updated = {}
+    with session_lock(session_dir):
+        metadata = load_metadata(session_dir)
+        for file_name, (dugong_count, calf_count, image_class, _) in zip(file_names, results):
+            entry = build_image_entry(
+                file_name, dugong_count, calf_count, image_class, exif.get(Path(file_name).name)
+            )
+            if model_version:
+                entry["modelVersion"] = model_version
+            metadata["images"][file_name] = entry
+            updated[file_name] = entry
+        if touch:
+            metadata["last_activity"] = datetime.utcnow().isoformat()
+        save_metadata(session_dir, metadata)
+
+    if index and updated:
+        try:
+            image_index.upsert_images(session_dir.name, updated)
+        except Exception as e:
+            logger.error(f"Failed to index images for {session_dir.name}: {e}")
+    return metadata
+
+
+def record_duplicates(session_dir: Path, duplicates: Dict[str, str], touch: bool = True, index: bool = True) -> List[str]:
+    """
+    Record near-duplicate images by reusing the metadata of the image they duplicate.
+
+    Args:
+        session_dir: Session folder holding the metadata file
+        duplicates: Duplicate file name -> original file name
+
+    Returns:
+        list: Duplicates whose original has no metadata (they need normal processing)
+    """
+    unresolved = []
+    updated = {}
+    with session_lock(session_dir):
+        metadata = load_metadata(session_dir)
+        for name, original in duplicates.items():
+            source = metadata["images"].get(original)
+            if source is None:
+                unresolved.append(name)
+                continue
+            entry = {**source, "duplicateOf": original, "uploadedAt": datetime.utcnow().isoformat()}
+            metadata["images"][name] = entry
+            updated[name] = entry
+        if touch:
+            metadata["last_activity"] = datetime.utcnow().isoformat()
+        save_metadata(session_dir, metadata)
+
+    if index and updated:
+        try:
+            image_index.upsert_images(session_dir.name, updated)
+        except Exception as e:
+            logger.error(f"Failed to index duplicates for {session_dir.name}: {e}")
+    return unresolved
+
+
+def iter_csv_rows(metadata: dict) -> Iterator[Dict[str, object]]:
+    """
+    Yield one CSV row per image with upper-cased metadata columns.
+    """
+    for image_name, data in metadata.get("images", {}).items():
+        row = {"IMAGE_NAME": image_name, **{k.upper(): v for k, v in data.items()}}
+        if "TOTALCOUNT" not in row:
+            row["TOTALDUGONGCOUNT"] = row.get("DUGONGCOUNT", 0) + 2 * row.get("MOTHERCALFCOUNT", 0)
+
+        # Ensure captured date is included, default to "N/A" if not present
+        if "CAPTUREDDATE" not in row:
+            row["CAPTUREDDATE"] = extract_captured_date(image_name)
+        yield row
+
+
+def write_metadata_csv(metadata: dict, output: TextIO) -> int:
+    """
+    Write the session CSV export to a text stream.
+
+    Returns:
+        int: Number of rows written
+    """
+    rows = list(iter_csv_rows(metadata))
+    if not rows:
+        return 0
+    # Union of columns in first-seen order, since older entries may lack newer fields
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    writer = csv.DictWriter(output, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+    return len(rows)
+
+
+def chunked(items: List, size: int) -> Iterator[List]:
+    """Yield consecutive slices of at most `size` items."""
+    size = max(1, size)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,366 @@
+"""
+Versioned detector/classifier pairs with zero-downtime replacement.
+A candidate version is downloaded and loaded in a background thread while the
+active one keeps serving. Optionally it runs in shadow on a sample of live
+batches (its output is only compared, never stored), and promotion swaps the
+active reference atomically: work that already pinned the old version finishes
+on it, the next batch picks up the new one. Promotions are written to a state
+file so every server worker of the instance follows.
+"""
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import requests
+
+from core.config import MODEL_DIR, MODEL_STATE_PATH
+from core.logger import setup_logger
+
+logger = setup_logger("model_registry", "logs/model_registry.log")
+
+# Seconds between checks of the state file for a version promoted by another worker
+SYNC_INTERVAL = 5.0
+DOWNLOAD_CHUNK = 1024 * 1024
+
+
+class RegistryError(RuntimeError):
+    """Raised for admin operations that do not apply to the registry's current state."""
+
+
+class ModelVersion:
+    """A loaded detector/classifier pair and where its weights came from."""
+
+    def __init__(self, version: str, detector, classifier, detector_path: Path, classifier_path: Path):
+        self.version = version
+        self.detector = detector
+        self.classifier = classifier
+        self.detector_path = detector_path
+        self.classifier_path = classifier_path
+        self.loaded_at = datetime.utcnow().isoformat()
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "detector": str(self.detector_path),
+            "classifier": str(self.classifier_path),
+            "loadedAt": self.loaded_at,
+        }
+
+
+def weights_version(*paths: Path) -> str:
+    """Content id of a set of weight files (first 12 hex digits of their joint sha256)."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def fetch_weights(source: str, dest: Path) -> Path:
+    """Copy weights from an http(s) URL or a local path to `dest`."""
+    if source.startswith(("http://", "https://")):
+        with requests.get(source, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(dest, "wb") as f:
+                for block in response.iter_content(DOWNLOAD_CHUNK):
+                    f.write(block)
+    else:
+        shutil.copyfile(source, dest)
+    return dest
+
+
+def load_version(detector_path: Path, classifier_path: Path, version: Optional[str] = None,
+                 classifier=None) -> ModelVersion:
+    """
+    Load a pair of weight files and warm them up on a blank frame, so the first
+    batch after promotion does not pay for lazy initialisation.
+
+    Args:
+        classifier: An already loaded classifier to reuse instead of loading classifier_path
+    """
+    from ultralytics import YOLO
+
+    detector = YOLO(str(detector_path))
+    classifier = classifier or YOLO(str(classifier_path))
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    detector.predict(blank, save=False, verbose=False)
+    classifier.predict(blank, save=False, verbose=False)
+    version = version or weights_version(detector_path, classifier_path)
+    return ModelVersion(version, detector, classifier, detector_path, classifier_path)
+
+
+class ShadowStats:
+    """Running comparison of a candidate against the active version on the same images."""
+
+    def __init__(self):
+        self.images = 0
+        self.count_matches = 0
+        self.count_abs_diff = 0
+        self.active_total = 0
+        self.candidate_total = 0
+        self.class_matches = 0
+        self.active_seconds = 0.0
+        self.candidate_seconds = 0.0
+
+    def add(self, active_counts: List[int], candidate_counts: List[int], active_classes: List[str],
+            candidate_classes: List[str], active_seconds: float, candidate_seconds: float) -> None:
+        for a, c in zip(active_counts, candidate_counts):
+            self.count_matches += a == c
+            self.count_abs_diff += abs(a - c)
+            self.active_total += a
+            self.candidate_total += c
+        self.class_matches += sum(a == c for a, c in zip(active_classes, candidate_classes))
+        self.images += len(active_counts)
+        self.active_seconds += active_seconds
+        self.candidate_seconds += candidate_seconds
+
+    def summary(self) -> dict:
+        n = max(1, self.images)
+        return {
+            "images": self.images,
+            "countAgreement": round(self.count_matches / n, 4),
+            "meanAbsCountDiff": round(self.count_abs_diff / n, 4),
+            "activeTotalCount": self.active_total,
+            "candidateTotalCount": self.candidate_total,
+            "classAgreement": round(self.class_matches / n, 4),
+            "activeSecondsPerImage": round(self.active_seconds / n, 4),
+            "candidateSecondsPerImage": round(self.candidate_seconds / n, 4),
+        }
+
+
+class ModelRegistry:
+    """
+    Active model version of this process plus at most one candidate.
+
+    Args:
+        active: The version loaded at startup
+    """
+
+    def __init__(self, active: ModelVersion):
+        self._active = active
+        self._candidate: Optional[ModelVersion] = None
+        self._candidate_state = None  # None | "loading" | "ready" | "failed"
+        self._candidate_error: Optional[str] = None
+        self._promote_when_ready = False
+        self._shadow_fraction = 0.0
+        self._shadow = ShadowStats()
+        self._history: List[dict] = []
+        self._lock = threading.Lock()
+        self._synced_at = 0.0
+        self._state_mtime = 0.0
+
+    # -- serving ----------------------------------------------------------
+
+    def active(self) -> ModelVersion:
+        """The version new work should use; callers keep the reference for the whole batch."""
+        self._sync()
+        return self._active
+
+    def shadow_candidate(self) -> Optional[ModelVersion]:
+        """The candidate, if it is in shadow mode and this batch is sampled."""
+        with self._lock:
+            candidate = self._candidate if self._candidate_state == "ready" else None
+            fraction = self._shadow_fraction
+        if candidate is None or random.random() >= fraction:
+            return None
+        return candidate
+
+    def record_shadow(self, candidate: ModelVersion, *args) -> None:
+        """Add one batch's comparison (see ShadowStats.add), unless the candidate changed meanwhile."""
+        with self._lock:
+            if candidate is self._candidate:
+                self._shadow.add(*args)
+
+    # -- administration ---------------------------------------------------
+
+    def load_candidate(self, detector: str, classifier: Optional[str] = None, version: Optional[str] = None,
+                       shadow_fraction: float = 0.0) -> dict:
+        """
+        Start loading a candidate in the background from URLs or local paths.
+        Without `classifier` the active classifier is kept.
+
+        Raises:
+            RegistryError: a candidate is already loading
+        """
+        with self._lock:
+            if self._candidate_state == "loading":
+                raise RegistryError("A candidate model is already loading")
+            self._reset_candidate()
+            self._candidate_state = "loading"
+            self._shadow_fraction = shadow_fraction
+        threading.Thread(
+            target=self._load, args=(detector, classifier, version), name="model-load", daemon=True
+        ).start()
+        return self.status()
+
+    def _reset_candidate(self) -> None:
+        self._candidate = None
+        self._candidate_state = None
+        self._candidate_error = None
+        self._promote_when_ready = False
+        self._shadow = ShadowStats()
+
+    def _load(self, detector: str, classifier: Optional[str], version: Optional[str],
+              follow: bool = False) -> None:
+        active = self._active
+        staging = MODEL_DIR / f".staging-{uuid.uuid4().hex}"
+        try:
+            target = MODEL_DIR / version if version else None
+            published = follow and (target / "detector.pt").exists() and (target / "classifier.pt").exists()
+            if not published:
+                staging.mkdir(parents=True, exist_ok=True)
+                fetch_weights(detector, staging / "detector.pt")
+                # The classifier weights are stored with every version, even when the object is reused
+                fetch_weights(classifier or str(active.classifier_path), staging / "classifier.pt")
+                version = version or weights_version(staging / "detector.pt", staging / "classifier.pt")
+                # Kept under the version id so other workers load the same files
+                target = MODEL_DIR / version
+                if target.exists():
+                    same = weights_version(staging / "detector.pt", staging / "classifier.pt") == \
+                        weights_version(target / "detector.pt", target / "classifier.pt")
+                    shutil.rmtree(staging)
+                    if not same:
+                        raise RegistryError(f"Version {version} already exists with different weights")
+                else:
+                    os.replace(staging, target)
+            loaded = load_version(target / "detector.pt", target / "classifier.pt", version,
+                                  classifier=None if classifier else active.classifier)
+        except Exception as e:
+            shutil.rmtree(staging, ignore_errors=True)
+            logger.error(f"Loading model candidate from {detector} failed: {e}")
+            with self._lock:
+                self._candidate_state = "failed"
+                self._candidate_error = str(e)
+            return
+
+        with self._lock:
+            self._candidate = loaded
+            self._candidate_state = "ready"
+            promote = self._promote_when_ready
+        logger.info(f"Model candidate {loaded.version} loaded")
+        if follow or promote:
+            # A followed promotion is already published by the worker that made it
+            self.promote(publish=not follow)
+
+    def _load_published(self, state: dict) -> None:
+        """Follow a promotion made by another worker: load its weights and swap once ready."""
+        with self._lock:
+            if self._candidate_state == "loading":
+                return
+            if self._candidate is not None and self._candidate.version == state["version"]:
+                ready = self._candidate_state == "ready"
+            else:
+                ready = False
+                self._reset_candidate()
+                self._candidate_state = "loading"
+        if ready:
+            self.promote(publish=False)
+            return
+        logger.info(f"Following promotion of model {state['version']}")
+        threading.Thread(
+            target=self._load, args=(state["detector"], state["classifier"], state["version"], True),
+            name="model-load", daemon=True,
+        ).start()
+
+    def promote(self, publish: bool = True) -> dict:
+        """
+        Make the loaded candidate the active version (or promote it as soon as it
+        finishes loading). In-flight batches finish on the version they started with.
+
+        Raises:
+            RegistryError: there is no candidate
+        """
+        with self._lock:
+            if self._candidate_state == "loading":
+                self._promote_when_ready = True
+                return self._status()
+            if self._candidate_state != "ready":
+                raise RegistryError("No loaded candidate model to promote")
+            previous, self._active = self._active, self._candidate
+            self._history.append({
+                "version": self._active.version,
+                "replaced": previous.version,
+                "promotedAt": datetime.utcnow().isoformat(),
+                "shadow": self._shadow.summary() if self._shadow.images else None,
+            })
+            self._reset_candidate()
+            self._shadow_fraction = 0.0
+            if publish:
+                self._publish()
+        logger.info(f"Promoted model {self._active.version} (replacing {previous.version})")
+        return self.status()
+
+    def discard(self) -> dict:
+        """Drop the candidate (a load in progress is discarded when it finishes)."""
+        with self._lock:
+            if self._candidate_state == "loading":
+                raise RegistryError("The candidate is still loading")
+            self._reset_candidate()
+            self._shadow_fraction = 0.0
+        return self.status()
+
+    # -- cross-worker state -----------------------------------------------
+
+    def _publish(self) -> None:
+        """Write the active version to the state file. Caller holds the lock."""
+        state = {
+            "version": self._active.version,
+            "detector": str(self._active.detector_path),
+            "classifier": str(self._active.classifier_path),
+            "promotedAt": datetime.utcnow().isoformat(),
+        }
+        MODEL_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = MODEL_STATE_PATH.with_name(f".{MODEL_STATE_PATH.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, MODEL_STATE_PATH)
+        self._state_mtime = MODEL_STATE_PATH.stat().st_mtime
+
+    def _sync(self) -> None:
+        """Start following the state file if another worker promoted a different version."""
+        now = time.monotonic()
+        if now - self._synced_at < SYNC_INTERVAL:
+            return
+        self._synced_at = now
+        try:
+            mtime = MODEL_STATE_PATH.stat().st_mtime
+            if mtime == self._state_mtime:
+                return
+            with open(MODEL_STATE_PATH) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._state_mtime = mtime
+        if state.get("version") != self._active.version:
+            self._load_published(state)
+
+    # -- reporting --------------------------------------------------------
+
+    def _status(self) -> dict:
+        candidate = None
+        if self._candidate_state is not None:
+            candidate = {
+                "state": self._candidate_state,
+                "error": self._candidate_error,
+                "promoteWhenReady": self._promote_when_ready,
+                "shadowFraction": self._shadow_fraction,
+                "shadow": self._shadow.summary(),
+                **(self._candidate.describe() if self._candidate else {}),
+            }
+        return {"active": self._active.describe(), "candidate": candidate, "history": list(self._history)}
+
+    def status(self) -> dict:
+        """Active version, candidate state with its shadow comparison, and promotion history."""
+        with self._lock:
+            return self._status()
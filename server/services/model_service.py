@@ -5,11 +5,28 @@ Handles model inference and detection result processing.
 
 from pathlib import Path
 from ultralytics import YOLO
-from core.config import BASE_DIR
+from core.config import BASE_DIR, PREFILTER_CONF, PREFILTER_ENABLED, PREFILTER_IMGSZ
 from core.logger import setup_logger
-from typing import List, Tuple
+from services.batch_planner import AdaptiveBatcher, is_out_of_memory
+from services.detection_store import RAW_STORE_DIRNAME, DetectionStore, ImageDetections, from_result
+from services.inference_scheduler import scheduler
+from services.model_registry import ModelRegistry, ModelVersion, weights_version
+from services.postprocess import (
+    RAW_CONF,
+    RAW_IOU,
+    RAW_MAX_DET,
+    PostprocessParams,
+    count_classes,
+    draw_detections,
+    keep_original,
+    postprocess_batch,
+)
+from typing import List, Optional, Tuple
 import requests
 
+import gc
+import time
+import shutil
 import numpy as np
 import torch
 import os
@@ -33,6 +50,37 @@ with open("classification_model.pt", "wb") as f:
     
 classification_model = YOLO("classification_model.pt")
 
+# Versions are ids of the weight contents; admin endpoints swap in new ones at runtime
+registry = ModelRegistry(ModelVersion(
+    weights_version(Path("MLmodel.pt"), Path("classification_model.pt")),
+    model,
+    classification_model,
+    Path("MLmodel.pt").resolve(),
+    Path("classification_model.pt").resolve(),
+))
+
+# Admission control only counts memory used above the loaded models
+scheduler.set_memory_baseline()
+
+def prepare_models_for_fork():
+    """
+    Prepare the loaded models to be shared by forked server workers.
+
+    Layers are fused here, in the parent, so each worker's predictor finds the
+    model already fused instead of building private fused copies of the weights.
+    The parent is kept single-threaded so no OpenMP pool exists at fork time, and
+    gc.freeze() stops collector passes from touching (and un-sharing) the pages
+    holding the long-lived model objects.
+    """
+    torch.set_num_threads(1)
+    active = registry.active()
+    for loaded in (active.detector, active.classifier):
+        loaded.model.eval()
+        loaded.fuse()
+    gc.collect()
+    gc.freeze()
+    logger.info("Models fused and frozen for copy-on-write sharing across workers")
+
 def remove_small_boxes(
     results,
     min_side: int = 20,        # minimum width/height in pixels
@@ -176,151 +224,34 @@ def filter_by_scale_per_image(
 
     return out
 
-def remove_nested_class0(
-    results,
-    parent_cls: int = 1,
-    child_cls: int = 0,
-    overlap_thr: float = 0.8,  # fraction of child area inside parent
-    verbose: bool = True,
-):
-    """
-    Removes child boxes if they are mostly contained within a parent box of another class.
-    
-    Args:
-        results: List of YOLO Results objects.
-        parent_cls: Class index considered as parent.
-        child_cls: Class index considered as child (to remove).
-        overlap_thr: Fraction of child area that must lie inside a parent to remove it.
-    """
-    from ultralytics.engine.results import Boxes
-    cleaned = []
-
-    for res in results:
-        if res is None or not len(res.boxes):
-            cleaned.append(res)
-            continue
-
-        device = res.boxes.data.device
-        boxes = res.boxes.xyxy
-        scores = res.boxes.conf
-        cls = res.boxes.cls if hasattr(res.boxes, "cls") else torch.zeros_like(scores, device=device)
-
-        keep = torch.ones(len(boxes), dtype=torch.bool, device=device)
-
-        parents_idx = (cls == parent_cls).nonzero(as_tuple=True)[0]
-        children_idx = (cls == child_cls).nonzero(as_tuple=True)[0]
-
-        for ci in children_idx:
-            c_box = boxes[ci]
-            c_area = (c_box[2] - c_box[0]) * (c_box[3] - c_box[1])
-            if c_area <= 0:
-                continue
-
-            # Compute overlap with each parent
-            for pi in parents_idx:
-                p_box = boxes[pi]
-                # Intersection box
-                ix1 = torch.max(c_box[0], p_box[0])
-                iy1 = torch.max(c_box[1], p_box[1])
-                ix2 = torch.min(c_box[2], p_box[2])
-                iy2 = torch.min(c_box[3], p_box[3])
-
-                iw = torch.clamp(ix2 - ix1, min=0)
-                ih = torch.clamp(iy2 - iy1, min=0)
-                inter_area = iw * ih
-
-                frac_inside = inter_area / (c_area + 1e-6)
-                if frac_inside >= overlap_thr:
-                    keep[ci] = False
-                    break  # no need to check other parents
-
-        kept_boxes = boxes[keep]
-        kept_scores = scores[keep].unsqueeze(1)
-        kept_cls = cls[keep].unsqueeze(1)
-
-        if kept_boxes.numel() == 0:
-            res.boxes = Boxes(torch.empty((0, 6), device=device), orig_shape=res.orig_shape)
-        else:
-            res.boxes = Boxes(torch.cat([kept_boxes, kept_scores, kept_cls], dim=1), orig_shape=res.orig_shape)
-
-        if verbose:
-            name = os.path.basename(getattr(res, "path", "image"))
-            removed = (~keep).sum().item()
-            print(f"[{name}] Nested {child_cls} removed: {removed}")
-
-        cleaned.append(res)
-
-    return cleaned
-
-def fully_dynamic_nms(preds, iou_min=0.1, iou_max=0.6):
-    from ultralytics.engine.results import Boxes
-
-    processed_results = []
-    for res in preds:
-        if res is None or not len(res.boxes):
-            processed_results.append(res)
-            continue
-
-        boxes = res.boxes.xyxy.cpu()
-        scores = res.boxes.conf.cpu()
-        cls = res.boxes.cls.cpu() if hasattr(res.boxes, 'cls') else torch.zeros_like(scores)
-
-        if boxes.numel() == 0:
-            processed_results.append(res)
-            continue
-
-        if res.orig_img is not None:
-            img_height, img_width = res.orig_img.shape[:2]
-        else:
-            img_height, img_width = 1, 1
-
-        heights = boxes[:, 3] - boxes[:, 1]
-        widths = boxes[:, 2] - boxes[:, 0]
-        sizes = torch.sqrt(heights * widths)
-        median_size = float(torch.median(sizes))
-        min_size, max_size = 10, 200
-        clipped_size = np.clip(median_size, min_size, max_size)
-        relative_size = (clipped_size - min_size) / (max_size - min_size)
-        iou_thr = iou_max - relative_size * (iou_max - iou_min)
-        print(f"[{os.path.basename(res.path)}] Median size: {median_size:.2f}, IoU: {iou_thr:.3f}, Relative size : {relative_size}")
-        keep = torch.ops.torchvision.nms(boxes, scores, float(iou_thr))
-
-        kept_boxes = boxes[keep]
-        kept_scores = scores[keep].unsqueeze(1)
-        kept_cls = cls[keep].unsqueeze(1)
-        final_data = torch.cat([kept_boxes, kept_scores, kept_cls], dim=1).to(res.boxes.data.device)
 
-        res.boxes = Boxes(final_data, orig_shape=res.orig_shape)
-        processed_results.append(res)
-
-    return processed_results
-
-def run_model_on_images(
-    image_paths: List[Path], session_id: str
-) -> List[Tuple[int, int, str, Path]]:
+def detect_batch(image_paths: List[Path], version: Optional[ModelVersion] = None, imgsz: Optional[int] = None):
     """
-    Run dugong detection model on a batch of images and save detection results.
-    Also saves images with colored bounding boxes after dynamic NMS.
+    Run the detector on one batch of images and return its raw output.
+    Thresholds are permissive (RAW_CONF/RAW_IOU) so the result can be cached and
+    post-processed with any settings later, see services.postprocess.
+    `imgsz` overrides the model's input size (used by sweep_params.py).
     """
-    results = []
-    logger.info(f"Running model on batch: {[str(p) for p in image_paths]}")
+    detector = (version or registry.active()).detector
+    size = {"imgsz": imgsz} if imgsz else {}
     # 1. Perform prediction to get the initial results
-    batch_results = model.predict(
+    batch_results = detector.predict(
         source=[str(p) for p in image_paths],
-        conf=0.3,
+        conf=RAW_CONF,
         save=False,
         show_labels=False,
         show_conf=False,
         project=None,
         name=None,
-        iou=0.3,
-        max_det=1000
+        iou=RAW_IOU,
+        max_det=RAW_MAX_DET,
+        **size
     )
 
-    # 2. Apply the custom NMS function to the results
-    processed_results = fully_dynamic_nms(batch_results)
+    # 2. The post-processing chain (conf/iou thresholds, dynamic NMS, nested box
+    #    removal) runs in apply_postprocess on the cached raw detections.
     # # 3. remove too small boxes
-    # processed_results = remove_small_boxes(processed_results, min_side=10, min_rel_area=7e-5)
+    # processed_results = remove_small_boxes(batch_results, min_side=10, min_rel_area=7e-5)
     # # 4. remove different scalled boxes
     # processed_results = filter_by_scale_per_image(
     #     processed_results,
@@ -332,55 +263,208 @@ def run_model_on_images(
     #     keep_at_least=1,        # optional: avoid empty results by keeping the largest box
     #     verbose=True
     # )
-    # # 5. remove overlap boxes
-    processed_results = remove_nested_class0(processed_results, parent_cls=1, child_cls=0, overlap_thr=0.8)
-    # 6. Prepare output folders
-    label_dir = BASE_DIR / session_id / "labels"
-    label_dir.mkdir(parents=True, exist_ok=True)
-    final_results_folder = BASE_DIR / session_id / "images"
-    final_results_folder.mkdir(parents=True, exist_ok=True)
+    return batch_results
+
+def detect_windows(frames: List[np.ndarray], version: Optional[ModelVersion] = None):
+    """
+    Run the detector on in-memory BGR frames (windows cut from a mosaic) and
+    return its raw output, with the same permissive thresholds as detect_batch.
+    """
+    return (version or registry.active()).detector.predict(
+        source=list(frames),
+        conf=RAW_CONF,
+        iou=RAW_IOU,
+        max_det=RAW_MAX_DET,
+        save=False,
+        verbose=False,
+    )
+
+
+def prefilter_batch(image_paths: List[Path], imgsz: int = PREFILTER_IMGSZ, conf: float = PREFILTER_CONF,
+                    version: Optional[ModelVersion] = None):
+    """
+    Cheap first stage of the cascade: run the detector at low resolution and
+    return its results; a frame with no box at all is treated as empty.
+    """
+    return (version or registry.active()).detector.predict(
+        source=[str(p) for p in image_paths],
+        imgsz=imgsz,
+        conf=conf,
+        iou=RAW_IOU,
+        max_det=1,
+        save=False,
+        verbose=False,
+    )
 
-    # Define colors for classes (B, G, R)
-    color_map = {
-        0: (255, 0, 0),   # Blue for Dugong (class 0)
-        1: (0, 0, 255)    # Red for Calf (class 1)
-    }
-
-    for image_path, res in zip(image_paths, processed_results):
-        class_ids = res.boxes.cls.int().tolist() if res.boxes is not None else []
-        dugong_count = class_ids.count(0)
-        calf_count = class_ids.count(1)
-        # find the class of the image
-        temp_results = classification_model.predict(image_path,  save=False,show_conf=False,project=None)
-        top5_class_names = temp_results[0].names
-        top1_class_id = temp_results[0].probs.top1
-        image_class = top5_class_names[top1_class_id]
-        label_path = label_dir / f"{image_path.stem}.txt"
 
+def save_empty_outputs(image_path: Path, res, final_results_folder: Path) -> Tuple[ImageDetections, Tuple[int, int, str, Path]]:
+    """
+    Record a frame the prefilter found empty: zero counts, class "empty" and the
+    unannotated image as its result image.
+    """
+    height, width = res.orig_shape
+    det = ImageDetections(
+        image_path.name, int(width), int(height),
+        np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.uint8),
+    )
+    save_path = final_results_folder / image_path.name
+    if image_path.resolve() != save_path.resolve():
+        shutil.copyfile(image_path, save_path)
+    return det, (0, 0, "empty", save_path)
+
+
+def classify_image(image_path: Path, version: Optional[ModelVersion] = None) -> str:
+    """Top-1 class of a whole image from the classification model."""
+    classifier = (version or registry.active()).classifier
+    temp_results = classifier.predict(image_path,  save=False,show_conf=False,project=None)
+    top5_class_names = temp_results[0].names
+    top1_class_id = temp_results[0].probs.top1
+    return top5_class_names[top1_class_id]
+
+
+def save_image_outputs(
+    image_path: Path, det: ImageDetections, final_results_folder: Path, version: Optional[ModelVersion] = None
+) -> Tuple[int, int, str, Path]:
+    """
+    Classify one image and write its annotated copy; the unannotated image is
+    kept under `originals/` (see keep_original) so re-thresholding can redraw it.
+    Boxes are persisted separately in the session's DetectionStore.
+    """
+    dugong_count, calf_count = count_classes(det)
+    image_path = keep_original(image_path, final_results_folder.parent)
+    # find the class of the image
+    image_class = classify_image(image_path, version)
+
+    # Save image with colored bounding boxes
+    img = cv2.imread(str(image_path))
+    if img is not None and len(det.scores) > 0:
+        draw_detections(img, det)
+    save_path = final_results_folder / image_path.name
+    cv2.imwrite(str(save_path), img)
+    logger.info(f"Saved image with NMS and colored boxes: {save_path}")
+
+    return dugong_count, calf_count, image_class, save_path
+
+def shadow_batch(
+    candidate: ModelVersion, image_paths: List[Path], params: PostprocessParams
+) -> Tuple[List[int], List[str], float]:
+    """
+    Run a shadow candidate on images the active version is processing.
+    Nothing is stored; returns total counts, image classes and detector seconds.
+    """
+    start = time.perf_counter()
+    results = detect_batch(image_paths, candidate)
+    seconds = time.perf_counter() - start
+    raw = [from_result(image_path.name, res) for image_path, res in zip(image_paths, results)]
+    counts = [dugongs + 2 * calves for dugongs, calves in map(count_classes, postprocess_batch(raw, params))]
+    classes = [classify_image(image_path, candidate) for image_path in image_paths]
+    return counts, classes, seconds
+
+
+def run_model_on_images(
+    image_paths: List[Path],
+    session_id: str,
+    output_dir: Optional[Path] = None,
+    report: Optional[dict] = None,
+    params: Optional[PostprocessParams] = None,
+    prefilter: Optional[bool] = None,
+    version: Optional[ModelVersion] = None,
+) -> List[Tuple[int, int, str, Path]]:
+    """
+    Run dugong detection model on a batch of images and save detection results.
+    Also saves images with colored bounding boxes after dynamic NMS.
+
+    Images are fed to the detector in memory-aware batches (see AdaptiveBatcher);
+    a batch that runs out of memory is retried at half the size. Each batch's raw
+    detector output and its post-processed boxes are appended to the folder's
+    columnar DetectionStores; YOLO label files are generated from them on export.
+
+    With PREFILTER_ENABLED, each batch first goes through a low-resolution detector
+    pass; frames where it finds nothing get a zero-count "empty" result without
+    running the full detector or the classifier (and have no raw detections cached).
+
+    Args:
+        image_paths: Images to process
+        session_id: Session identifier
+        output_dir: Folder receiving `detections/` and `images/` (default: the session folder)
+        report: Optional dict filled with the chosen batch sizes, peak RSS and prefilter skips
+        params: Post-processing settings (default: PostprocessParams())
+        prefilter: Override PREFILTER_ENABLED
+        version: Model version to use for every batch (default: the active one when called);
+                 a candidate in shadow mode also runs on a sample of batches for comparison
+    """
+    results = []
+    logger.info(f"Running model on batch: {[str(p) for p in image_paths]}")
+
+    # Prepare output folders
+    output_dir = output_dir or BASE_DIR / session_id
+    store = DetectionStore(output_dir)
+    raw_store = DetectionStore(output_dir, RAW_STORE_DIRNAME)
+    params = params or PostprocessParams()
+    prefilter = PREFILTER_ENABLED if prefilter is None else prefilter
+    version = version or registry.active()
+    skipped = 0
+    final_results_folder = output_dir / "images"
+    final_results_folder.mkdir(parents=True, exist_ok=True)
+
+    batcher = AdaptiveBatcher()
+    pending = list(image_paths)
+    while pending:
+        batch = batcher.next_batch(pending)
         try:
-            with open(label_path, "w") as f:
-                for box, cls_id in zip(res.boxes.xywhn, res.boxes.cls.int()):
-                    cx, cy, w, h = box.tolist()
-                    f.write(f"{cls_id} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n")
-            logger.info(f"Saved label file: {label_path}")
-        except Exception as e:
-            logger.error(f"Failed to save label for {image_path.name}: {e}")
+            candidates, empty = batch, []
+            if prefilter:
+                screened = prefilter_batch(batch, version=version)
+                candidates = [p for p, res in zip(batch, screened) if len(res.boxes)]
+                empty = [(p, res) for p, res in zip(batch, screened) if not len(res.boxes)]
+                del screened
+            start = time.perf_counter()
+            processed_results = detect_batch(candidates, version) if candidates else []
+            active_seconds = time.perf_counter() - start
+        except (RuntimeError, MemoryError) as e:
+            if is_out_of_memory(e) and batcher.on_memory_error(len(batch)):
+                gc.collect()
+                continue
             raise
 
-        # Save image with colored bounding boxes
-        img = cv2.imread(str(image_path))
-        if img is not None and len(res.boxes) > 0:
-            boxes = res.boxes.xyxy.cpu().numpy()
-            classes = res.boxes.cls.cpu().numpy().astype(int)
-            for box, cls in zip(boxes, classes):
-                x1, y1, x2, y2 = map(int, box)
-                color = color_map.get(cls, (0, 255, 0))
-                cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-        save_path = final_results_folder / image_path.name
-        cv2.imwrite(str(save_path), img)
-        logger.info(f"Saved image with NMS and colored boxes: {save_path}")
-
-        results.append((dugong_count, calf_count, image_class, save_path))
-
-    logger.info(f"Images with bounding boxes saved to {final_results_folder}")
+        raw = [from_result(image_path.name, res) for image_path, res in zip(candidates, processed_results)]
+        del processed_results
+        final = postprocess_batch(raw, params)
+        # Shadow before annotation overwrites uploaded images in place
+        shadow = registry.shadow_candidate() if candidates else None
+        shadow_result = None
+        if shadow is not None:
+            try:
+                shadow_result = shadow_batch(shadow, candidates, params)
+            except Exception as e:
+                logger.warning(f"Shadow run of model {shadow.version} failed: {e}")
+        by_name = {}
+        for image_path, det in zip(candidates, final):
+            by_name[image_path.name] = save_image_outputs(image_path, det, final_results_folder, version)
+        if shadow_result is not None:
+            active = [by_name[image_path.name] for image_path in candidates]
+            counts, classes, shadow_seconds = shadow_result
+            registry.record_shadow(
+                shadow, [d + 2 * c for d, c, _, _ in active], counts, [cls for _, _, cls, _ in active], classes,
+                active_seconds, shadow_seconds,
+            )
+        for image_path, res in empty:
+            det, by_name[image_path.name] = save_empty_outputs(image_path, res, final_results_folder)
+            final.append(det)
+        # Keep results aligned with image_paths
+        results.extend(by_name[image_path.name] for image_path in batch)
+        raw_store.append(raw)
+        store.append(final)
+        skipped += len(empty)
+        batcher.record_batch(len(batch))
+        pending = pending[len(batch):]
+
+    logger.info(
+        f"Images with bounding boxes saved to {final_results_folder}; batches: {batcher.report()}; "
+        f"prefilter skipped {skipped}/{len(image_paths)}"
+    )
+    if report is not None:
+        report.update(batcher.report())
+        if prefilter:
+            report["prefilterSkipped"] = skipped
     return results
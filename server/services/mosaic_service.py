@@ -0,0 +1,443 @@
+"""
+Windowed detection on large orthomosaic (Geo)TIFFs.
+Stitched survey mosaics of several gigapixels cannot be decoded whole, so the
+mosaic is read one overlapping window at a time (only the TIFF tiles/strips a
+window touches are decoded, or the pixels are memory-mapped when stored
+uncompressed) and fed to the detector in small batches. Detections are shifted
+into mosaic pixel coordinates, boxes cut by a window edge are left to the
+neighbouring window that sees them whole, duplicates in the overlaps are merged
+with a global class-aware NMS, and GeoTIFF georeferencing adds map and lon/lat
+coordinates.
+
+Results of a session mosaic `<session>/mosaics/<name>`:
+    <session>/detections_mosaic/          columnar boxes (DetectionStore), one record per mosaic
+    <session>/mosaics/<stem>.geojson      one point feature per detection
+    metadata["mosaics"][<name>]           counts, size, georeferencing and progress
+"""
+
+import json
+import math
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import tifffile
+import torch
+import torchvision
+
+from core.config import BASE_DIR, MOSAIC_BATCH_SIZE, MOSAIC_OVERLAP, MOSAIC_WINDOW
+from core.logger import setup_logger
+from services.detection_store import DetectionStore, ImageDetections, from_result
+from services.metadata_service import load_metadata, save_metadata, session_lock
+from services.postprocess import PostprocessParams, count_classes, postprocess_batch
+from services.inference_scheduler import scheduler
+from services.reprocess_service import session_params
+
+logger = setup_logger("mosaic_service", "logs/mosaic_service.log")
+
+MOSAICS_DIRNAME = "mosaics"
+MOSAIC_STORE_DIRNAME = "detections_mosaic"
+CLASS_NAMES = {0: "dugong", 1: "calf"}
+# Boxes within this many pixels of an inner window edge are cut off by the window
+EDGE_MARGIN = 2
+# Seconds between progress updates (which also keep the session from expiring)
+PROGRESS_INTERVAL = 10.0
+
+# GeoTIFF key values
+MODEL_TYPE_GEOGRAPHIC = 2
+RASTER_PIXEL_IS_POINT = 2
+EPSG_WGS84 = 4326
+
+
+class MosaicError(ValueError):
+    """Raised for TIFF layouts that cannot be read window by window."""
+
+
+class GeoReference(NamedTuple):
+    """Affine pixel -> map transform (x = a*col + b*row + c, y = d*col + e*row + f)."""
+    a: float
+    b: float
+    c: float
+    d: float
+    e: float
+    f: float
+    epsg: Optional[int]
+    geographic: bool
+
+    def to_map(self, col: np.ndarray, row: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return self.a * col + self.b * row + self.c, self.d * col + self.e * row + self.f
+
+    def to_lonlat(self, col: np.ndarray, row: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Longitude/latitude for WGS84 geographic or WGS84 UTM mosaics, else None."""
+        x, y = self.to_map(col, row)
+        if self.geographic and self.epsg in (None, EPSG_WGS84):
+            return x, y
+        if self.epsg and (32601 <= self.epsg <= 32660 or 32701 <= self.epsg <= 32760):
+            return utm_to_lonlat(x, y, self.epsg % 100, north=self.epsg < 32700)
+        return None
+
+
+def utm_to_lonlat(easting: np.ndarray, northing: np.ndarray, zone: int, north: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse transverse Mercator on the WGS84 ellipsoid (Snyder's series, sub-metre accuracy)."""
+    a, f, k0 = 6378137.0, 1 / 298.257223563, 0.9996
+    e2 = f * (2 - f)
+    ep2 = e2 / (1 - e2)
+    x = np.asarray(easting, dtype=np.float64) - 500000.0
+    y = np.asarray(northing, dtype=np.float64) - (0.0 if north else 10000000.0)
+
+    m = y / k0
+    mu = m / (a * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+    e1 = (1 - math.sqrt(1 - e2)) / (1 + math.sqrt(1 - e2))
+    phi1 = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * np.sin(2 * mu)
+            + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * np.sin(4 * mu)
+            + (151 * e1 ** 3 / 96) * np.sin(6 * mu)
+            + (1097 * e1 ** 4 / 512) * np.sin(8 * mu))
+
+    sin1, cos1, tan1 = np.sin(phi1), np.cos(phi1), np.tan(phi1)
+    c1 = ep2 * cos1 ** 2
+    t1 = tan1 ** 2
+    n1 = a / np.sqrt(1 - e2 * sin1 ** 2)
+    r1 = a * (1 - e2) / (1 - e2 * sin1 ** 2) ** 1.5
+    d = x / (n1 * k0)
+
+    lat = phi1 - (n1 * tan1 / r1) * (
+        d ** 2 / 2
+        - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * ep2) * d ** 4 / 24
+        + (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * ep2 - 3 * c1 ** 2) * d ** 6 / 720
+    )
+    lon = (
+        d
+        - (1 + 2 * t1 + c1) * d ** 3 / 6
+        + (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * ep2 + 24 * t1 ** 2) * d ** 5 / 120
+    ) / cos1
+    return np.degrees(lon) + (zone - 1) * 6 - 180 + 3, np.degrees(lat)
+
+
+def read_georeference(page) -> Optional[GeoReference]:
+    """Pixel -> map transform from the GeoTIFF tags of a page, or None if not georeferenced."""
+    if not page.is_geotiff:
+        return None
+    tags = page.geotiff_tags
+    geographic = int(tags.get("GTModelTypeGeoKey", 0) or 0) == MODEL_TYPE_GEOGRAPHIC
+    epsg_key = "GeographicTypeGeoKey" if geographic else "ProjectedCSTypeGeoKey"
+    try:
+        epsg = int(tags.get(epsg_key)) if tags.get(epsg_key) is not None else None
+    except (TypeError, ValueError):
+        epsg = None
+    # Pixel-is-point rasters reference pixel centres; shift to the pixel-corner convention
+    shift = -0.5 if int(tags.get("GTRasterTypeGeoKey", 1) or 1) == RASTER_PIXEL_IS_POINT else 0.0
+
+    transform = tags.get("ModelTransformation")
+    if transform is not None:
+        m = np.asarray(transform, dtype=np.float64).reshape(4, 4)
+        a, b, c, d, e, f = m[0, 0], m[0, 1], m[0, 3], m[1, 0], m[1, 1], m[1, 3]
+    else:
+        scale, tiepoint = tags.get("ModelPixelScale"), tags.get("ModelTiepoint")
+        if scale is None or tiepoint is None:
+            return None
+        i, j, _, x, y, _ = tiepoint[:6]
+        a, b, d, e = scale[0], 0.0, 0.0, -scale[1]
+        c, f = x - i * a, y - j * e
+    c, f = c + shift * (a + b), f + shift * (d + e)
+    return GeoReference(float(a), float(b), float(c), float(d), float(e), float(f), epsg, geographic)
+
+
+class MosaicReader:
+    """Window-by-window access to the full-resolution image of a TIFF."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._tif = tifffile.TiffFile(str(path))
+        self.page = self._tif.pages[0]
+        if self.page.planarconfig != 1 and self.page.samplesperpixel > 1:
+            raise MosaicError(f"{path.name}: planar (band-separate) TIFFs are not supported")
+        if self.page.imagedepth != 1:
+            raise MosaicError(f"{path.name}: volumetric TIFFs are not supported")
+        self.height, self.width = int(self.page.imagelength), int(self.page.imagewidth)
+        self.samples = int(self.page.samplesperpixel)
+        self.georeference = read_georeference(self.page)
+        # Uncompressed, contiguous pixels are sliced straight out of a memory map
+        self._memmap = tifffile.memmap(str(path), page=0, mode="r") if self.page.is_memmappable else None
+        self._chunk_h, self._chunk_w = (
+            (int(self.page.tilelength), int(self.page.tilewidth)) if self.page.is_tiled
+            else (int(self.page.rowsperstrip or self.height), self.width)
+        )
+        self._chunks_across = -(-self.width // self._chunk_w)
+        # JPEG-compressed tiles share quantisation/Huffman tables stored once in the page
+        self._decode_args = {"jpegtables": self.page.jpegtables, "jpegheader": self.page.jpegheader}
+
+    def close(self) -> None:
+        self._memmap = None
+        self._tif.close()
+
+    def __enter__(self) -> "MosaicReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def read_window(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        """
+        Pixels of the window as an (h, w, samples) array, decoding only the tiles or
+        strips it overlaps.
+        """
+        if self._memmap is not None:
+            return np.array(self._memmap[y:y + h, x:x + w]).reshape(h, w, self.samples)
+
+        out = np.zeros((h, w, self.samples), dtype=self.page.dtype)
+        fh = self._tif.filehandle
+        for ty in range(y // self._chunk_h, (y + h - 1) // self._chunk_h + 1):
+            for tx in range(x // self._chunk_w, (x + w - 1) // self._chunk_w + 1):
+                index = ty * self._chunks_across + tx
+                if not self.page.databytecounts[index]:
+                    continue  # sparse tile: stays zero (nodata)
+                fh.seek(self.page.dataoffsets[index])
+                segment, indices, _ = self.page.decode(
+                    fh.read(self.page.databytecounts[index]), index, **self._decode_args
+                )
+                if segment is None:
+                    continue
+                segment = segment.reshape(segment.shape[-3:])
+                top, left = indices[2], indices[3]
+                y0, y1 = max(y, top), min(y + h, top + segment.shape[0], self.height)
+                x0, x1 = max(x, left), min(x + w, left + segment.shape[1], self.width)
+                if y0 < y1 and x0 < x1:
+                    out[y0 - y:y1 - y, x0 - x:x1 - x] = segment[y0 - top:y1 - top, x0 - left:x1 - left]
+        return out
+
+
+def to_bgr8(pixels: np.ndarray) -> Tuple[np.ndarray, bool]:
+    """
+    Convert a window to the 8-bit BGR frame the detector expects.
+
+    Returns:
+        (frame, empty): empty is True when the window holds no data at all (zero
+        pixels or a fully transparent alpha band, as outside the surveyed area)
+    """
+    samples = pixels.shape[2]
+    if samples in (2, 4):
+        empty = not pixels[..., -1].any()
+        pixels = pixels[..., :-1]
+    else:
+        empty = not pixels.any()
+    if pixels.dtype != np.uint8:
+        peak = np.iinfo(pixels.dtype).max if pixels.dtype.kind in "ui" else max(float(pixels.max()), 1e-6)
+        pixels = np.clip(pixels.astype(np.float32) * (255.0 / peak), 0, 255).astype(np.uint8)
+    if pixels.shape[2] == 1:
+        pixels = np.repeat(pixels, 3, axis=2)
+    return np.ascontiguousarray(pixels[..., 2::-1]), empty
+
+
+def iter_windows(width: int, height: int, size: int, overlap: int) -> Iterator[Tuple[int, int, int, int]]:
+    """(x, y, w, h) of overlapping windows covering the mosaic; edge windows are shifted inwards."""
+    step = max(1, size - overlap)
+
+    def starts(extent: int) -> List[int]:
+        if extent <= size:
+            return [0]
+        positions = list(range(0, extent - size, step))
+        return positions + [extent - size]
+
+    for y in starts(height):
+        for x in starts(width):
+            yield x, y, min(size, width - x), min(size, height - y)
+
+
+def _inside_window(det: ImageDetections, x: int, y: int, width: int, height: int) -> np.ndarray:
+    """Mask of boxes not cut by an inner window edge (edges on the mosaic border are real)."""
+    boxes = np.asarray(det.boxes)
+    keep = np.ones(len(boxes), dtype=bool)
+    if x > 0:
+        keep &= boxes[:, 0] > EDGE_MARGIN
+    if y > 0:
+        keep &= boxes[:, 1] > EDGE_MARGIN
+    if x + det.width < width:
+        keep &= boxes[:, 2] < det.width - EDGE_MARGIN
+    if y + det.height < height:
+        keep &= boxes[:, 3] < det.height - EDGE_MARGIN
+    return keep
+
+
+def merge_windows(parts: List[ImageDetections], name: str, width: int, height: int,
+                  iou: float) -> ImageDetections:
+    """Concatenate per-window detections (already in mosaic pixels) and merge overlap duplicates."""
+    boxes = np.concatenate([np.asarray(p.boxes, dtype=np.float32).reshape(-1, 4) for p in parts] or [np.zeros((0, 4), np.float32)])
+    scores = np.concatenate([np.asarray(p.scores, dtype=np.float32) for p in parts] or [np.zeros(0, np.float32)])
+    classes = np.concatenate([np.asarray(p.classes, dtype=np.uint8) for p in parts] or [np.zeros(0, np.uint8)])
+    if len(scores):
+        keep = torchvision.ops.batched_nms(
+            torch.from_numpy(boxes), torch.from_numpy(scores), torch.from_numpy(classes.astype(np.int64)), iou
+        ).numpy()
+        keep.sort()
+        boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+    return ImageDetections(name, width, height, boxes, scores, classes)
+
+
+def detect_mosaic(
+    path: Path,
+    params: Optional[PostprocessParams] = None,
+    window: int = MOSAIC_WINDOW,
+    overlap: int = MOSAIC_OVERLAP,
+    batch_size: int = MOSAIC_BATCH_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+    detector: Optional[Callable[[List[np.ndarray]], list]] = None,
+) -> Tuple[ImageDetections, dict]:
+    """
+    Run the detector and post-processing over a mosaic window by window.
+    At most `batch_size` decoded windows are held in memory at a time.
+
+    Args:
+        path: TIFF/GeoTIFF file
+        params: Post-processing settings applied per window (default: PostprocessParams())
+        window: Window side in mosaic pixels (the detector resizes it like a camera frame)
+        overlap: Pixels shared by neighbouring windows; should exceed the largest animal
+        batch_size: Windows per detector call
+        progress: Optional callback(windows done, windows total)
+        detector: Runs the detector on a list of frames (default: model_service.detect_windows)
+
+    Returns:
+        (detections, info): detections in mosaic pixel coordinates, and a summary
+        with size, window counts and timing
+    """
+    if detector is None:
+        from services.model_service import detect_windows as detector
+
+    params = params or PostprocessParams()
+    start = time.perf_counter()
+    parts: List[ImageDetections] = []
+    with MosaicReader(path) as reader:
+        windows = list(iter_windows(reader.width, reader.height, window, overlap))
+        skipped = 0
+        for first in range(0, len(windows), batch_size):
+            frames, origins = [], []
+            for x, y, w, h in windows[first:first + batch_size]:
+                frame, empty = to_bgr8(reader.read_window(x, y, w, h))
+                if empty:
+                    skipped += 1
+                    continue
+                frames.append(frame)
+                origins.append((x, y))
+            if frames:
+                raw = [from_result(f"{x}_{y}", res) for (x, y), res in zip(origins, detector(frames))]
+                del frames
+                for (x, y), det in zip(origins, postprocess_batch(raw, params)):
+                    keep = _inside_window(det, x, y, reader.width, reader.height)
+                    parts.append(det._replace(
+                        boxes=np.asarray(det.boxes)[keep] + np.array([x, y, x, y], dtype=np.float32),
+                        scores=np.asarray(det.scores)[keep],
+                        classes=np.asarray(det.classes)[keep],
+                    ))
+            if progress is not None:
+                progress(min(first + batch_size, len(windows)), len(windows))
+        merged = merge_windows(parts, path.name, reader.width, reader.height, params.iou)
+        georeference = reader.georeference
+
+    info = {
+        "width": merged.width,
+        "height": merged.height,
+        "windows": len(windows),
+        "emptyWindows": skipped,
+        "windowSize": window,
+        "overlap": overlap,
+        "epsg": georeference.epsg if georeference else None,
+        "elapsedMs": round((time.perf_counter() - start) * 1000, 1),
+    }
+    logger.info(f"Mosaic {path.name}: {len(merged.scores)} detections, {info}")
+    return merged, info
+
+
+def to_geojson(det: ImageDetections, georeference: Optional[GeoReference]) -> dict:
+    """
+    One feature per detection with its mosaic pixel box, map coordinates and, when
+    the CRS allows it, a lon/lat point geometry at the box centre.
+    """
+    boxes = np.asarray(det.boxes, dtype=np.float64).reshape(-1, 4)
+    cols, rows = (boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2
+    map_xy = georeference.to_map(cols, rows) if georeference else None
+    lonlat = georeference.to_lonlat(cols, rows) if georeference else None
+    features = []
+    for i, (box, score, cls) in enumerate(zip(boxes.tolist(), np.asarray(det.scores).tolist(),
+                                              np.asarray(det.classes).tolist())):
+        properties = {
+            "class": CLASS_NAMES.get(cls, str(cls)),
+            "score": round(score, 4),
+            "pixelBox": [round(v, 1) for v in box],
+            "pixelCenter": [round(float(cols[i]), 1), round(float(rows[i]), 1)],
+        }
+        if map_xy is not None:
+            properties["mapX"], properties["mapY"] = float(map_xy[0][i]), float(map_xy[1][i])
+        geometry = None
+        if lonlat is not None:
+            properties["longitude"], properties["latitude"] = float(lonlat[0][i]), float(lonlat[1][i])
+            geometry = {"type": "Point", "coordinates": [properties["longitude"], properties["latitude"]]}
+        features.append({"type": "Feature", "geometry": geometry, "properties": properties})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _update_entry(session_dir: Path, name: str, values: dict) -> None:
+    with session_lock(session_dir):
+        metadata = load_metadata(session_dir)
+        metadata.setdefault("mosaics", {}).setdefault(name, {}).update(values)
+        metadata["last_activity"] = datetime.utcnow().isoformat()
+        save_metadata(session_dir, metadata)
+
+
+def process_session_mosaic(session_id: str, path: Path, params: Optional[PostprocessParams] = None) -> dict:
+    """
+    Detect animals on a mosaic saved under `<session>/mosaics/` and record the
+    result in the session (see module docstring).
+
+    Returns:
+        dict: The mosaic's metadata entry
+    """
+    session_dir = BASE_DIR / session_id
+    params = params or session_params(session_dir)
+    _update_entry(session_dir, path.name, {"status": "processing", "windowsDone": 0})
+    last_update = [time.monotonic()]
+
+    def progress(done: int, total: int) -> None:
+        if time.monotonic() - last_update[0] >= PROGRESS_INTERVAL:
+            last_update[0] = time.monotonic()
+            _update_entry(session_dir, path.name, {"windowsDone": done, "windows": total})
+
+    from services.model_service import detect_windows, registry
+    version = registry.active()
+
+    def detector(frames: List[np.ndarray]) -> list:
+        # One fair-queue job per window batch, so a mosaic does not hold the models
+        return scheduler.run(session_id, len(frames), detect_windows, frames, version)
+
+    try:
+        det, info = detect_mosaic(path, params, progress=progress, detector=detector)
+        with MosaicReader(path) as reader:
+            georeference = reader.georeference
+    except Exception as e:
+        logger.error(f"Mosaic {path.name} in {session_id} failed: {e}")
+        _update_entry(session_dir, path.name, {"status": "failed", "error": str(e)})
+        raise
+
+    DetectionStore(session_dir, MOSAIC_STORE_DIRNAME).append([det])
+    geojson_path = path.with_suffix(".geojson")
+    with open(geojson_path, "w") as f:
+        json.dump(to_geojson(det, georeference), f)
+
+    dugong_count, calf_count = count_classes(det)
+    entry = {
+        **info,
+        "status": "done",
+        "windowsDone": info["windows"],
+        "dugongCount": dugong_count,
+        "motherCalfCount": calf_count,
+        "totalCount": dugong_count + 2 * calf_count,
+        "geojson": f"{MOSAICS_DIRNAME}/{geojson_path.name}",
+        "modelVersion": version.version,
+        "processedAt": datetime.utcnow().isoformat(),
+    }
+    if georeference is not None:
+        center = georeference.to_lonlat(np.array([det.width / 2]), np.array([det.height / 2]))
+        if center is not None:
+            entry["longitude"], entry["latitude"] = float(center[0][0]), float(center[1][0])
+    _update_entry(session_dir, path.name, entry)
+    return entry
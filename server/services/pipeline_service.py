@@ -0,0 +1,73 @@
+"""
+End-to-end processing of images saved into a session folder.
+Shared by the upload, archive and backfill paths: reads EXIF, skips near-duplicates,
+runs the models on the remaining images and records everything in session metadata.
+"""
+
+from pathlib import Path
+from typing import List, Optional
+
+from core.config import BASE_DIR, DEDUP_ENABLED
+from core.logger import setup_logger
+from services.dedup_service import find_duplicates, reuse_outputs
+from services.exif_service import extract_batch
+from services.metadata_service import record_duplicates, record_results
+from services.reprocess_service import session_params
+
+logger = setup_logger("pipeline_service", "logs/pipeline_service.log")
+
+
+def process_session_images(
+    session_id: str,
+    image_paths: List[Path],
+    touch: bool = True,
+    report: Optional[dict] = None,
+) -> dict:
+    """
+    Process images already saved under `<session>/images`.
+
+    Args:
+        session_id: Session identifier
+        image_paths: Saved images to process
+        touch: Whether to refresh the session's last_activity
+        report: Optional dict filled with batching details from run_model_on_images
+
+    Returns:
+        dict: processed and duplicate file names
+    """
+    from services.model_service import registry, run_model_on_images
+
+    session_dir = BASE_DIR / session_id
+    # Pin one model version for the whole call, so a hot-swap never mixes versions within it
+    version = registry.active()
+    # Apply the session's tuned post-processing settings, if any
+    params = session_params(session_dir)
+    # Read EXIF/GPS before annotation overwrites the originals
+    exif = extract_batch(image_paths)
+
+    duplicates = find_duplicates(session_dir, image_paths) if DEDUP_ENABLED else {}
+    unique_paths = [p for p in image_paths if p.name not in duplicates]
+
+    if unique_paths:
+        results = run_model_on_images(unique_paths, session_id, report=report, params=params, version=version)
+        record_results(session_dir, [p.name for p in unique_paths], results, touch=touch, exif=exif,
+                       model_version=version.version)
+
+    if duplicates:
+        unresolved = record_duplicates(session_dir, duplicates, touch=touch)
+        for name, original in duplicates.items():
+            if name not in unresolved:
+                reuse_outputs(session_dir, name, original)
+        if unresolved:
+            # The original vanished (deleted or failed); process these normally
+            retry_paths = [p for p in image_paths if p.name in unresolved]
+            results = run_model_on_images(retry_paths, session_id, params=params, version=version)
+            record_results(session_dir, [p.name for p in retry_paths], results, touch=touch, exif=exif,
+                           model_version=version.version)
+            for name in unresolved:
+                duplicates.pop(name)
+
+    return {
+        "processed": [p.name for p in image_paths if p.name not in duplicates],
+        "duplicates": duplicates,
+    }
@@ -0,0 +1,333 @@
+"""
+Detection post-processing chain for the Dugong Classification system.
+Runs on cached raw detector output (see DetectionStore), so thresholds can be
+changed and re-applied to a whole session without running the models again.
+
+Chain: confidence threshold -> class-aware NMS (what YOLO.predict applied with
+conf/iou) -> max_det -> size-adaptive NMS -> nested calf/dugong removal.
+
+postprocess_batch runs the chain for a whole batch of images at once (one
+batched NMS call, vectorised per-image thresholds, padded IoU matrices);
+apply_postprocess is the per-image reference implementation.
+"""
+
+import os
+import shutil
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+import torchvision
+
+from core.logger import setup_logger
+from services.detection_store import ImageDetections
+
+logger = setup_logger("postprocess", "logs/postprocess.log")
+
+# Raw output cached per image: permissive enough that every setting of the
+# chain below can be re-applied later (the detector's own NMS is all but disabled)
+RAW_CONF = 0.05
+RAW_IOU = 0.95
+RAW_MAX_DET = 3000
+
+# Upper bound on elements of one padded (images x boxes x boxes) IoU tensor
+PADDED_IOU_MAX_ELEMENTS = 4 * 1024 * 1024
+
+# Per-session folder keeping the unannotated uploads, so boxes can be redrawn after re-thresholding
+ORIGINALS_DIRNAME = "originals"
+
+# Define colors for classes (B, G, R)
+COLOR_MAP = {
+    0: (255, 0, 0),   # Blue for Dugong (class 0)
+    1: (0, 0, 255)    # Red for Calf (class 1)
+}
+
+
+class PostprocessParams(NamedTuple):
+    """Tunable post-processing settings; defaults match the original predict() call."""
+    conf: float = 0.3
+    iou: float = 0.3
+    max_det: int = 1000
+    nms_iou_min: float = 0.1
+    nms_iou_max: float = 0.6
+    nested_overlap: float = 0.8
+    # True reproduces the original dynamic NMS, where a calf box could suppress
+    # an overlapping dugong box; False only suppresses boxes of the same class
+    class_agnostic: bool = False
+
+    @classmethod
+    def from_dict(cls, values: Optional[dict]) -> "PostprocessParams":
+        """Build params from a (partial) dict, ignoring None values."""
+        values = {k: v for k, v in (values or {}).items() if k in cls._fields and v is not None}
+        return cls(**values)
+
+
+def fully_dynamic_nms(boxes: torch.Tensor, scores: torch.Tensor, iou_min: float = 0.1, iou_max: float = 0.6,
+                      name: str = "image", cls: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    NMS whose IoU threshold shrinks as the median box size grows (large, close-up
+    animals overlap less than small, distant ones). Class-agnostic unless `cls`
+    is given.
+
+    Returns:
+        Tensor: indices of kept boxes
+    """
+    if boxes.numel() == 0:
+        return torch.empty(0, dtype=torch.long)
+    heights = boxes[:, 3] - boxes[:, 1]
+    widths = boxes[:, 2] - boxes[:, 0]
+    sizes = torch.sqrt(heights * widths)
+    median_size = float(torch.median(sizes))
+    min_size, max_size = 10, 200
+    clipped_size = np.clip(median_size, min_size, max_size)
+    relative_size = (clipped_size - min_size) / (max_size - min_size)
+    iou_thr = iou_max - relative_size * (iou_max - iou_min)
+    logger.debug(f"[{name}] Median size: {median_size:.2f}, IoU: {iou_thr:.3f}, Relative size : {relative_size}")
+    if cls is not None:
+        return torchvision.ops.batched_nms(boxes, scores, cls, float(iou_thr))
+    return torchvision.ops.nms(boxes, scores, float(iou_thr))
+
+
+def remove_nested_class0(boxes: torch.Tensor, cls: torch.Tensor, parent_cls: int = 1, child_cls: int = 0,
+                         overlap_thr: float = 0.8) -> torch.Tensor:
+    """
+    Mask out child boxes that lie mostly inside a parent box of another class
+    (a dugong box drawn around part of a mother-calf pair).
+
+    Returns:
+        Tensor: boolean keep mask
+    """
+    keep = torch.ones(len(boxes), dtype=torch.bool)
+    parents = boxes[cls == parent_cls]
+    children_idx = (cls == child_cls).nonzero(as_tuple=True)[0]
+    if not len(parents) or not len(children_idx):
+        return keep
+    children = boxes[children_idx]
+    # (children, parents) intersection areas
+    lt = torch.max(children[:, None, :2], parents[None, :, :2])
+    rb = torch.min(children[:, None, 2:], parents[None, :, 2:])
+    inter = (rb - lt).clamp(min=0).prod(dim=2)
+    c_area = (children[:, 2] - children[:, 0]) * (children[:, 3] - children[:, 1])
+    frac_inside = inter / (c_area[:, None] + 1e-6)
+    nested = (frac_inside >= overlap_thr).any(dim=1) & (c_area > 0)
+    keep[children_idx[nested]] = False
+    return keep
+
+
+def apply_postprocess(raw: ImageDetections, params: PostprocessParams = PostprocessParams()) -> ImageDetections:
+    """
+    Run the post-processing chain on one image's raw detections
+    (reference implementation; the pipeline uses postprocess_batch).
+    """
+    boxes = torch.from_numpy(np.array(raw.boxes, dtype=np.float32)).reshape(-1, 4)
+    scores = torch.from_numpy(np.array(raw.scores, dtype=np.float32))
+    cls = torch.from_numpy(np.array(raw.classes, dtype=np.int64))
+
+    # 1. Confidence threshold and per-class NMS, as YOLO.predict(conf, iou, max_det) did
+    mask = scores >= params.conf
+    boxes, scores, cls = boxes[mask], scores[mask], cls[mask]
+    keep = torchvision.ops.batched_nms(boxes, scores, cls, params.iou)[: params.max_det]
+    boxes, scores, cls = boxes[keep], scores[keep], cls[keep]
+
+    # 2. Size-adaptive NMS
+    keep = fully_dynamic_nms(
+        boxes, scores, params.nms_iou_min, params.nms_iou_max, os.path.basename(raw.name),
+        cls=None if params.class_agnostic else cls,
+    )
+    boxes, scores, cls = boxes[keep], scores[keep], cls[keep]
+
+    # 3. Remove dugong boxes nested in mother-calf boxes
+    keep = remove_nested_class0(boxes, cls, parent_cls=1, child_cls=0, overlap_thr=params.nested_overlap)
+    boxes, scores, cls = boxes[keep], scores[keep], cls[keep]
+
+    return raw._replace(
+        boxes=boxes.numpy(), scores=scores.numpy(), classes=cls.numpy().astype(np.uint8)
+    )
+
+
+def _group_ranks(groups: torch.Tensor, num_groups: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    For elements sorted by group, return each element's position within its group
+    and the per-group counts.
+    """
+    counts = torch.bincount(groups, minlength=num_groups)
+    starts = torch.cumsum(counts, 0) - counts
+    return torch.arange(len(groups)) - starts[groups], counts
+
+
+def _by_image(image_ids: torch.Tensor, order: torch.Tensor) -> torch.Tensor:
+    """Stable-sort `order` (indices already sorted by score) by image."""
+    return order[torch.sort(image_ids[order], stable=True).indices]
+
+
+def dynamic_iou_thresholds(boxes: torch.Tensor, image_ids: torch.Tensor, num_images: int,
+                           iou_min: float, iou_max: float) -> torch.Tensor:
+    """
+    Per-image IoU thresholds of fully_dynamic_nms, computed for all images at once
+    from each image's (lower) median box size.
+    """
+    sizes = torch.sqrt((boxes[:, 3] - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0]))
+    order = torch.sort(sizes).indices
+    order = order[torch.sort(image_ids[order], stable=True).indices]
+    counts = torch.bincount(image_ids, minlength=num_images)
+    starts = torch.cumsum(counts, 0) - counts
+    lower_middle = torch.div((counts - 1).clamp(min=0), 2, rounding_mode="floor")
+    median_pos = (starts + lower_middle).clamp(max=max(len(sizes) - 1, 0))
+    # float64 like the scalar threshold fully_dynamic_nms passes to torchvision
+    medians = sizes[order][median_pos].double() if len(sizes) else torch.zeros(num_images, dtype=torch.float64)
+    min_size, max_size = 10, 200
+    relative = (medians.clamp(min_size, max_size) - min_size) / (max_size - min_size)
+    return iou_max - relative * (iou_max - iou_min)
+
+
+def _pad(values: torch.Tensor, image_ids: torch.Tensor, ranks: torch.Tensor, num_images: int, width: int,
+         fill=0) -> torch.Tensor:
+    padded = torch.full((num_images, width, *values.shape[1:]), fill, dtype=values.dtype)
+    padded[image_ids, ranks] = values
+    return padded
+
+
+def _padded_iou(boxes: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Pairwise (intersection, IoU) within each image of a (images, n, 4) padded box tensor."""
+    area = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+    lt = torch.max(boxes[:, :, None, :2], boxes[:, None, :, :2])
+    rb = torch.min(boxes[:, :, None, 2:], boxes[:, None, :, 2:])
+    inter = (rb - lt).clamp(min=0).prod(dim=3)
+    return inter, inter / (area[:, :, None] + area[:, None, :] - inter).clamp(min=1e-9)
+
+
+def padded_nms(boxes: torch.Tensor, cls: torch.Tensor, valid: torch.Tensor, thresholds: torch.Tensor,
+               class_agnostic: bool) -> torch.Tensor:
+    """
+    Greedy NMS for many images at once. Inputs are padded to (images, n) with boxes
+    sorted by descending score within each image; every image has its own IoU
+    threshold. The loop runs over box positions, vectorised across images.
+
+    Returns:
+        Tensor: (images, n) keep mask
+    """
+    n = boxes.shape[1]
+    _, iou = _padded_iou(boxes)
+    suppresses = iou > thresholds[:, None, None]
+    if not class_agnostic:
+        suppresses &= cls[:, :, None] == cls[:, None, :]
+    # A box can only suppress lower-scored boxes
+    suppresses &= torch.ones(n, n, dtype=torch.bool).triu(diagonal=1)
+    keep = valid.clone()
+    for i in range(n):
+        keep &= ~(suppresses[:, i, :] & keep[:, i:i + 1])
+    return keep
+
+
+def padded_nested_mask(boxes: torch.Tensor, cls: torch.Tensor, valid: torch.Tensor, parent_cls: int = 1,
+                       child_cls: int = 0, overlap_thr: float = 0.8) -> torch.Tensor:
+    """remove_nested_class0 for padded (images, n) inputs; returns the keep mask."""
+    inter, _ = _padded_iou(boxes)
+    area = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+    frac_inside = inter / (area[:, :, None] + 1e-6)
+    is_child = (cls == child_cls) & valid & (area > 0)
+    is_parent = (cls == parent_cls) & valid
+    nested = ((frac_inside >= overlap_thr) & is_parent[:, None, :]).any(dim=2) & is_child
+    return valid & ~nested
+
+
+def postprocess_batch(raws: List[ImageDetections], params: PostprocessParams = PostprocessParams()) -> List[ImageDetections]:
+    """
+    Run the post-processing chain for many images with batched tensor operations.
+    The result matches apply_postprocess image by image in both NMS modes, apart
+    from ties (equal scores, or an IoU landing exactly on a threshold); see
+    tests/test_postprocess.py.
+    """
+    num_images = len(raws)
+    if not num_images:
+        return []
+    boxes = torch.from_numpy(np.concatenate([np.asarray(r.boxes, dtype=np.float32).reshape(-1, 4) for r in raws]))
+    scores = torch.from_numpy(np.concatenate([np.asarray(r.scores, dtype=np.float32) for r in raws]))
+    cls = torch.from_numpy(np.concatenate([np.asarray(r.classes, dtype=np.int64) for r in raws]))
+    image_ids = torch.cat([torch.full((len(r.scores),), i, dtype=torch.long) for i, r in enumerate(raws)])
+
+    # 1. Confidence threshold, then one class-aware NMS call for all images
+    idx = (scores >= params.conf).nonzero(as_tuple=True)[0]
+    num_classes = int(cls.max()) + 1 if len(cls) else 1
+    keep = torchvision.ops.batched_nms(
+        boxes[idx], scores[idx], image_ids[idx] * num_classes + cls[idx], params.iou
+    )
+    order = _by_image(image_ids, idx[keep])
+    ranks, _ = _group_ranks(image_ids[order], num_images)
+    order = order[ranks < params.max_det]
+
+    # 2. Size-adaptive NMS with per-image thresholds on padded per-image tensors
+    img = image_ids[order]
+    ranks, counts = _group_ranks(img, num_images)
+    thresholds = dynamic_iou_thresholds(boxes[order], img, num_images, params.nms_iou_min, params.nms_iou_max)
+    width = int(counts.max()) if len(order) else 0
+    kept = torch.zeros(len(order), dtype=torch.bool)
+    if width:
+        p_boxes = _pad(boxes[order], img, ranks, num_images, width)
+        p_cls = _pad(cls[order], img, ranks, num_images, width, fill=-1)
+        valid = _pad(torch.ones(len(order), dtype=torch.bool), img, ranks, num_images, width, fill=False)
+        # Bound the size of the IoU tensors by processing images in chunks
+        step = max(1, PADDED_IOU_MAX_ELEMENTS // (width * width))
+        keep_mask = torch.zeros_like(valid)
+        for start in range(0, num_images, step):
+            sl = slice(start, start + step)
+            chunk_keep = padded_nms(p_boxes[sl], p_cls[sl], valid[sl], thresholds[sl], params.class_agnostic)
+            # 3. Nested dugong/calf removal among the survivors
+            keep_mask[sl] = padded_nested_mask(
+                p_boxes[sl], p_cls[sl], chunk_keep, parent_cls=1, child_cls=0, overlap_thr=params.nested_overlap
+            )
+        kept = keep_mask[img, ranks]
+    order, img = order[kept], img[kept]
+
+    out_boxes, out_scores, out_cls = boxes[order].numpy(), scores[order].numpy(), cls[order].numpy().astype(np.uint8)
+    bounds = torch.cumsum(torch.bincount(img, minlength=num_images), 0).tolist()
+    results, start = [], 0
+    for raw, end in zip(raws, bounds):
+        results.append(raw._replace(boxes=out_boxes[start:end], scores=out_scores[start:end], classes=out_cls[start:end]))
+        start = end
+    return results
+
+
+def count_classes(det: ImageDetections):
+    """Return (dugong count, calf count) of final detections."""
+    classes = np.asarray(det.classes)
+    return int((classes == 0).sum()), int((classes == 1).sum())
+
+
+def draw_detections(img: np.ndarray, det: ImageDetections) -> np.ndarray:
+    """Draw colored bounding boxes onto an image in place."""
+    for box, cls in zip(np.asarray(det.boxes), np.asarray(det.classes).astype(int)):
+        x1, y1, x2, y2 = map(int, box)
+        color = COLOR_MAP.get(cls, (0, 255, 0))
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+    return img
+
+
+def keep_original(image_path: Path, output_dir: Path) -> Path:
+    """
+    Keep the unannotated image under `<output_dir>/originals/` before its annotated
+    copy is written to `images/`: moved there if it is in `images/` (it would be
+    overwritten), copied otherwise. Returns the kept path.
+    """
+    originals = output_dir / ORIGINALS_DIRNAME
+    originals.mkdir(parents=True, exist_ok=True)
+    kept = originals / image_path.name
+    if image_path.parent.resolve() == (output_dir / "images").resolve():
+        os.replace(image_path, kept)
+    else:
+        shutil.copyfile(image_path, kept)
+    return kept
+
+
+def render_annotated(session_dir: Path, det: ImageDetections) -> bool:
+    """Redraw `images/<name>` from the kept original. False if there is no original to draw on."""
+    original = session_dir / ORIGINALS_DIRNAME / det.name
+    img = cv2.imread(str(original)) if original.exists() else None
+    if img is None:
+        return False
+    if len(det.scores) > 0:
+        draw_detections(img, det)
+    cv2.imwrite(str(session_dir / "images" / det.name), img)
+    return True
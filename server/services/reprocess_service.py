@@ -0,0 +1,103 @@
+"""
+Re-apply the detection post-processing chain to a whole session.
+Starts from the cached raw detector output, so new thresholds take effect
+without loading or running the models; counts, stored detections (and so the
+exported YOLO labels) and the annotated images are updated. Annotated images are
+redrawn from the unannotated originals kept under `originals/`; images processed
+before originals were kept cannot be redrawn and are returned as staleAnnotations.
+"""
+
+import time
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+from core.config import BASE_DIR
+from core.logger import setup_logger
+from services import image_index
+from services.detection_store import RAW_STORE_DIRNAME, DetectionStore, ImageDetections
+from services.metadata_service import chunked, load_metadata, save_metadata, session_lock, set_counts
+from services.postprocess import PostprocessParams, count_classes, postprocess_batch, render_annotated
+
+logger = setup_logger("reprocess_service", "logs/reprocess_service.log")
+
+# Images post-processed per batched call
+REPROCESS_BATCH_SIZE = 256
+
+
+def session_params(session_dir: Path) -> PostprocessParams:
+    """Post-processing settings last applied to a session (defaults if never tuned)."""
+    return PostprocessParams.from_dict(load_metadata(session_dir).get("postprocess"))
+
+
+def _same(a: ImageDetections, b: ImageDetections) -> bool:
+    return len(a.scores) == len(b.scores) and np.array_equal(np.asarray(a.boxes), np.asarray(b.boxes))
+
+
+def reprocess_session(session_id: str, params: PostprocessParams) -> dict:
+    """
+    Re-run post-processing for every image of a session with new parameters.
+
+    Args:
+        session_id: Session identifier
+        params: Post-processing settings to apply (and remember for later uploads)
+
+    Returns:
+        dict: Summary with image/changed counts, images without cached raw output,
+              images whose annotated copy could not be redrawn, and timing
+    """
+    session_dir = BASE_DIR / session_id
+    raw_store = DetectionStore(session_dir, RAW_STORE_DIRNAME)
+    store = DetectionStore(session_dir)
+    start = time.perf_counter()
+
+    known = set(load_metadata(session_dir)["images"])
+    finals: Dict[str, ImageDetections] = {}
+    changed = []
+    current = {det.name: det for det in store}
+    raws = [raw for raw in raw_store if raw.name in known]
+    for batch in chunked(raws, REPROCESS_BATCH_SIZE):
+        for det in postprocess_batch(batch, params):
+            previous = current.get(det.name)
+            if previous is None or not _same(previous, det):
+                changed.append(det.name)
+            finals[det.name] = det
+    postprocess_ms = (time.perf_counter() - start) * 1000
+
+    store.append(finals[name] for name in changed)
+    stale_annotations = [name for name in changed if not render_annotated(session_dir, finals[name])]
+
+    updated = {}
+    with session_lock(session_dir):
+        metadata = load_metadata(session_dir)
+        for name in changed:
+            entry = metadata["images"].get(name)
+            if entry is None:
+                continue  # deleted meanwhile
+            set_counts(entry, *count_classes(finals[name]))
+            updated[name] = entry
+        metadata["postprocess"] = params._asdict()
+        save_metadata(session_dir, metadata)
+    missing_raw = sorted(set(metadata["images"]) - set(finals))
+
+    if updated:
+        try:
+            image_index.upsert_images(session_id, updated)
+        except Exception as e:
+            logger.error(f"Failed to re-index images for {session_id}: {e}")
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(
+        f"Reprocessed {session_id} with {params}: {len(finals)} images, {len(changed)} changed, "
+        f"post-processing {postprocess_ms:.1f} ms, total {elapsed_ms:.1f} ms"
+    )
+    return {
+        "images": len(finals),
+        "changed": len(changed),
+        "missingRawDetections": missing_raw,
+        "staleAnnotations": stale_annotations,
+        "params": params._asdict(),
+        "postprocessMs": round(postprocess_ms, 1),
+        "elapsedMs": round(elapsed_ms, 1),
+    }
@@ -0,0 +1,183 @@
+"""
+Read-side helpers for session status polling.
+Provides cheap ETags from the metadata file's stat, an in-process cache of parsed
+metadata keyed by that stat, and filtering, sorting and pagination of the image table.
+"""
+
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from core.logger import setup_logger
+from services.image_index import entry_captured_at
+from services.metadata_service import metadata_path
+
+logger = setup_logger("session_query", "logs/session_query.log")
+
+SORT_FIELDS = ("name", "uploadedAt", "capturedAt", "dugongCount", "motherCalfCount", "totalCount")
+COUNT_FIELDS = ("dugongCount", "motherCalfCount", "totalCount")
+MAX_PAGE_SIZE = 1000
+CACHE_SIZE = 32
+
+_cache: "OrderedDict[str, Tuple[tuple, dict]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def metadata_version(session_dir: Path) -> Optional[tuple]:
+    """
+    Identify the current metadata file contents without reading it.
+    save_metadata replaces the file atomically, so inode, mtime and size change on every write.
+    """
+    try:
+        st = os.stat(metadata_path(session_dir))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def make_etag(version: tuple, query: str = "") -> str:
+    """Weak ETag for a metadata version and the query that shaped the response."""
+    ino, mtime_ns, size = version
+    tag = f"{ino:x}-{mtime_ns:x}-{size:x}"
+    if query:
+        tag += f"-{zlib.crc32(query.encode()):x}"
+    return f'W/"{tag}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header with weak comparison."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+def load_metadata_cached(session_dir: Path, version: tuple) -> dict:
+    """
+    Return parsed metadata for the given version, reusing the last parse while the
+    file is unchanged. The returned dict is shared and must not be modified.
+    """
+    key = str(session_dir)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == version:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    with open(metadata_path(session_dir), "r") as f:
+        metadata = json.load(f)
+    metadata.setdefault("images", {})
+
+    with _cache_lock:
+        _cache[key] = (version, metadata)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return metadata
+
+
+def forget_session(session_dir: Path) -> None:
+    """Drop a deleted session from the parse cache."""
+    with _cache_lock:
+        _cache.pop(str(session_dir), None)
+
+
+def time_remaining(metadata: dict, timeout_minutes: int) -> int:
+    """Seconds until the session expires, based on its last_activity."""
+    last_activity = datetime.fromisoformat(metadata.get("last_activity"))
+    remaining = timedelta(minutes=timeout_minutes) - (datetime.utcnow() - last_activity)
+    return int(max(remaining, timedelta()).total_seconds())
+
+
+def _parse_day(value: Optional[str], end: bool) -> Optional[str]:
+    """Normalise a YYYY-MM-DD or ISO bound to an ISO string comparable with capturedAt."""
+    if not value:
+        return None
+    if "T" in value:
+        return value
+    return f"{value}T23:59:59.999999" if end else f"{value}T00:00:00"
+
+
+def filter_images(
+    images: dict,
+    image_class: Optional[str] = None,
+    count_field: str = "totalCount",
+    min_count: Optional[int] = None,
+    max_count: Optional[int] = None,
+    captured_from: Optional[str] = None,
+    captured_to: Optional[str] = None,
+) -> List[Tuple[str, dict]]:
+    """
+    Select image entries matching all given filters.
+
+    Args:
+        images: metadata["images"]
+        image_class: Case-insensitive image class, e.g. "Feeding"
+        count_field: Entry field the count range applies to
+        min_count, max_count: Inclusive count range
+        captured_from, captured_to: Inclusive capture date bounds (YYYY-MM-DD or ISO)
+
+    Returns:
+        list: (file name, entry) pairs in metadata order
+    """
+    wanted_class = image_class.lower() if image_class else None
+    start = _parse_day(captured_from, end=False)
+    end = _parse_day(captured_to, end=True)
+
+    selected = []
+    for name, entry in images.items():
+        if wanted_class and str(entry.get("imageClass", "")).lower() != wanted_class:
+            continue
+        count = entry.get(count_field, 0) or 0
+        if min_count is not None and count < min_count:
+            continue
+        if max_count is not None and count > max_count:
+            continue
+        if start or end:
+            captured = entry_captured_at(entry)
+            if captured is None or (start and captured < start) or (end and captured > end):
+                continue
+        selected.append((name, entry))
+    return selected
+
+
+def sort_images(items: List[Tuple[str, dict]], sort_by: Optional[str], descending: bool) -> List[Tuple[str, dict]]:
+    """Sort (name, entry) pairs by a SORT_FIELDS key; entries missing the key sort last."""
+    if not sort_by:
+        return items[::-1] if descending else items
+    if sort_by == "name":
+        return sorted(items, key=lambda item: item[0], reverse=descending)
+    if sort_by == "capturedAt":
+        value = lambda item: entry_captured_at(item[1])  # noqa: E731
+    else:
+        value = lambda item: item[1].get(sort_by)  # noqa: E731
+    present = [item for item in items if value(item) is not None]
+    missing = [item for item in items if value(item) is None]
+    return sorted(present, key=value, reverse=descending) + missing
+
+
+def paginate(items: List[Tuple[str, dict]], page: int, page_size: Optional[int]) -> Tuple[Iterable, dict]:
+    """Slice one page out of the selected items and describe the pagination."""
+    total = len(items)
+    if not page_size:
+        return items, {"total": total, "page": 1, "pageSize": total, "pages": 1}
+    start = (page - 1) * page_size
+    return items[start:start + page_size], {
+        "total": total,
+        "page": page,
+        "pageSize": page_size,
+        "pages": max(1, -(-total // page_size)),
+    }
@@ -0,0 +1,319 @@
+"""
+Disk budget for the session store under BASE_DIR.
+On Cloud Run /tmp is RAM-backed, so session files count against the instance's
+memory. The manager tracks allocated bytes per session and artifact type,
+evicts artifacts that can be regenerated (least recently active sessions first)
+when usage passes the budget, and refuses new uploads when even that cannot
+make room for them.
+"""
+
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from core.config import (
+    ALLOWED_EXTENSIONS,
+    BASE_DIR,
+    STORAGE_BUDGET_MB,
+    STORAGE_LOW_WATER_FRACTION,
+    STORAGE_STALE_UPLOAD_MINUTES,
+)
+from core.logger import setup_logger
+from services.dedup_service import HASHES_FILENAME, NAMES_FILENAME
+from services.detection_store import RAW_STORE_DIRNAME, DetectionStore
+from services.job_queue import JOBS_DIRNAME
+from services.metadata_service import load_metadata, metadata_path, save_metadata, session_lock
+from services.postprocess import ORIGINALS_DIRNAME
+
+logger = setup_logger("storage_service", "logs/storage_service.log")
+
+# Seconds a usage scan is trusted before admission rescans the store
+SCAN_INTERVAL = 30.0
+UPLOADS_DIRNAME = ".uploads"
+
+
+class StorageFull(RuntimeError):
+    """Raised when an upload does not fit in the budget even after eviction."""
+
+
+def _allocated(stat: os.stat_result) -> int:
+    # Blocks actually allocated: pre-sized, partly written upload files count what is written
+    return stat.st_blocks * 512
+
+
+def classify(relative: Path) -> str:
+    """Artifact type of a file, from its path relative to the session folder."""
+    parts = relative.parts
+    top = parts[0]
+    if top == UPLOADS_DIRNAME or relative.name.endswith(".part"):
+        return "partialUploads"
+    if top == "images":
+        return "annotated"
+    if top == "videos":
+        # Per-frame counts written next to the video
+        return "detections" if relative.suffix == ".json" else "originals"
+    if top in (JOBS_DIRNAME, ORIGINALS_DIRNAME):
+        return "originals"
+    if top == "mosaics":
+        return "mosaicExports" if relative.suffix == ".geojson" else "originals"
+    if top == "labels":
+        return "labels"
+    if top == RAW_STORE_DIRNAME:
+        return "rawDetections"
+    if top.startswith("detections"):
+        return "detections"
+    if top in (HASHES_FILENAME, NAMES_FILENAME):
+        return "dedupIndex"
+    if len(parts) == 1 and relative.suffix.lower() in ALLOWED_EXTENSIONS:
+        return "originals"
+    return "metadata"
+
+
+def session_usage(session_dir: Path) -> Dict[str, int]:
+    """Allocated bytes per artifact type of one session."""
+    usage: Dict[str, int] = {}
+    for root, _, files in os.walk(session_dir):
+        for name in files:
+            path = Path(root) / name
+            try:
+                size = _allocated(path.stat())
+            except FileNotFoundError:
+                continue
+            kind = classify(path.relative_to(session_dir))
+            usage[kind] = usage.get(kind, 0) + size
+    return usage
+
+
+def _last_activity(session_dir: Path) -> float:
+    """Session recency for LRU ordering (metadata last_activity, else folder mtime)."""
+    try:
+        value = load_metadata(session_dir).get("last_activity")
+        if value:
+            return datetime.fromisoformat(value).timestamp()
+    except (OSError, ValueError):
+        pass
+    try:
+        return session_dir.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+# -- evictors: each frees one artifact type of a session and returns the bytes freed --
+
+def _remove_tree(path: Path) -> int:
+    freed = sum(_allocated(p.stat()) for p in path.rglob("*") if p.is_file()) if path.exists() else 0
+    shutil.rmtree(path, ignore_errors=True)
+    return freed
+
+
+def _remove_file(path: Path) -> int:
+    try:
+        freed = _allocated(path.stat())
+        path.unlink()
+        return freed
+    except FileNotFoundError:
+        return 0
+
+
+def evict_raw_detections(session_dir: Path) -> int:
+    """Raw detector cache: only needed to re-threshold without rerunning the models."""
+    return _remove_tree(session_dir / RAW_STORE_DIRNAME)
+
+
+def evict_covered_labels(session_dir: Path) -> int:
+    """Legacy YOLO label files of images whose boxes are in the detection store (export renders those)."""
+    labels = session_dir / "labels"
+    if not labels.is_dir():
+        return 0
+    stored = {Path(name).stem for name in DetectionStore(session_dir).names()}
+    return sum(_remove_file(path) for path in list(labels.iterdir()) if path.stem in stored)
+
+
+def evict_dedup_index(session_dir: Path) -> int:
+    """Perceptual-hash index: later uploads are just not checked against earlier ones."""
+    return _remove_file(session_dir / HASHES_FILENAME) + _remove_file(session_dir / NAMES_FILENAME)
+
+
+def evict_stale_uploads(session_dir: Path) -> int:
+    """Chunked uploads nobody has sent a chunk to for STORAGE_STALE_UPLOAD_MINUTES."""
+    uploads = session_dir / UPLOADS_DIRNAME
+    if not uploads.is_dir():
+        return 0
+    cutoff = time.time() - STORAGE_STALE_UPLOAD_MINUTES * 60
+    freed = 0
+    for upload_dir in list(uploads.iterdir()):
+        try:
+            last_chunk = max(p.stat().st_mtime for p in upload_dir.iterdir())
+        except (ValueError, FileNotFoundError):
+            last_chunk = 0.0
+        if last_chunk >= cutoff:
+            continue
+        for folder in ("images", "mosaics"):
+            if (session_dir / folder).is_dir():
+                freed += sum(_remove_file(p) for p in (session_dir / folder).glob(f".*.{upload_dir.name}.part"))
+        freed += _remove_tree(upload_dir)
+    return freed
+
+
+# Eviction order: cheapest to lose first; each tier is applied to all sessions,
+# least recently active first, before the next tier is touched
+EVICTION_TIERS: List[Tuple[str, Callable[[Path], int]]] = [
+    ("rawDetections", evict_raw_detections),
+    ("labels", evict_covered_labels),
+    ("dedupIndex", evict_dedup_index),
+    ("partialUploads", evict_stale_uploads),
+]
+
+
+class StorageManager:
+    """
+    Usage accounting and budget enforcement for BASE_DIR.
+
+    Args:
+        budget_mb: Bytes the session store may allocate
+        low_water: Eviction frees space down to this fraction of the budget
+    """
+
+    def __init__(self, budget_mb: int = STORAGE_BUDGET_MB, low_water: float = STORAGE_LOW_WATER_FRACTION):
+        self.budget = budget_mb * 1024 * 1024
+        self.low_water = low_water
+        self._usage: Dict[str, Dict[str, int]] = {}
+        self._scanned_at = 0.0
+        self._reserved = 0
+        self._evicted: Dict[str, int] = {}
+        self._rejected = 0
+        # Sessions deleted while a rescan was running, so it does not count them again
+        self._forgotten: Set[str] = set()
+        # Guards the counters above; only ever held briefly, never across file I/O
+        self._lock = threading.Lock()
+        # Serialises rescans and eviction, which walk and delete files
+        self._io_lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Rescan every session folder. Caller holds the I/O lock."""
+        with self._lock:
+            self._forgotten = set()
+        usage = {}
+        if BASE_DIR.exists():
+            for session_dir in BASE_DIR.iterdir():
+                if session_dir.is_dir():
+                    usage[session_dir.name] = session_usage(session_dir)
+        with self._lock:
+            for session_id in self._forgotten:
+                usage.pop(session_id, None)
+            self._usage = usage
+            self._scanned_at = time.monotonic()
+            self._reserved = 0
+
+    def _total(self) -> int:
+        """Bytes in use plus reserved. Caller holds the lock."""
+        return sum(sum(kinds.values()) for kinds in self._usage.values()) + self._reserved
+
+    def _over(self, target: int) -> bool:
+        with self._lock:
+            return self._total() > target
+
+    def _evict(self, target: int, protect: Optional[str] = None) -> int:
+        """Evict tier by tier, LRU session first, until usage is at most `target`. Caller holds the I/O lock."""
+        freed_total = 0
+        with self._lock:
+            sessions = list(self._usage)
+        sessions.sort(key=lambda s: (s == protect, _last_activity(BASE_DIR / s)))
+        for kind, evict in EVICTION_TIERS:
+            for session_id in sessions:
+                if not self._over(target):
+                    return freed_total
+                with self._lock:
+                    if not self._usage.get(session_id, {}).get(kind):
+                        continue
+                session_dir = BASE_DIR / session_id
+                if not session_dir.is_dir():
+                    continue
+                # Under the session lock so eviction never races the pipeline writing the same files
+                with session_lock(session_dir):
+                    freed = evict(session_dir)
+                    if freed:
+                        _note_eviction(session_dir, kind)
+                if not freed:
+                    continue
+                freed_total += freed
+                with self._lock:
+                    if session_id in self._usage:
+                        self._usage[session_id][kind] = max(0, self._usage[session_id].get(kind, 0) - freed)
+                    self._evicted[kind] = self._evicted.get(kind, 0) + freed
+                logger.info(f"Evicted {kind} of {session_id}: {freed / 1e6:.1f} MB")
+        return freed_total
+
+    def ensure_space(self, nbytes: int, session_id: Optional[str] = None) -> None:
+        """
+        Make room for `nbytes` of new files, evicting regenerable artifacts if needed.
+        The bytes are counted as used until the next rescan picks up the real files.
+
+        Raises:
+            StorageFull: the budget cannot accommodate the request
+        """
+        with self._io_lock:
+            if time.monotonic() - self._scanned_at > SCAN_INTERVAL:
+                self.refresh()
+            if self._over(self.budget - nbytes):
+                target = min(self.budget - nbytes, int(self.budget * self.low_water))
+                self._evict(target, protect=session_id)
+            with self._lock:
+                if self._total() + nbytes > self.budget:
+                    self._rejected += 1
+                    free = max(0, self.budget - self._total())
+                    raise StorageFull(
+                        f"Upload needs {nbytes / 1e6:.1f} MB but only {free / 1e6:.1f} MB of the "
+                        f"{self.budget / 1e6:.0f} MB session storage budget is free"
+                    )
+                self._reserved += nbytes
+
+    def enforce(self) -> int:
+        """Periodic pass: rescan and evict down to the low-water mark if over budget. Returns bytes freed."""
+        with self._io_lock:
+            self.refresh()
+            if not self._over(self.budget):
+                return 0
+            return self._evict(int(self.budget * self.low_water))
+
+    def forget(self, session_id: str) -> None:
+        """Drop a deleted session from the accounting. Does no I/O, so it is safe on the event loop."""
+        with self._lock:
+            self._usage.pop(session_id, None)
+            self._forgotten.add(session_id)
+
+    def report(self) -> dict:
+        """Usage per session and artifact type, budget and eviction counters (rescans first)."""
+        with self._io_lock:
+            self.refresh()
+        with self._lock:
+            by_type: Dict[str, int] = {}
+            for kinds in self._usage.values():
+                for kind, size in kinds.items():
+                    by_type[kind] = by_type.get(kind, 0) + size
+            return {
+                "budgetBytes": self.budget,
+                "usedBytes": self._total(),
+                "byType": by_type,
+                "bySession": {s: {"total": sum(k.values()), **k} for s, k in self._usage.items()},
+                "evictedBytes": dict(self._evicted),
+                "rejectedUploads": self._rejected,
+            }
+
+
+def _note_eviction(session_dir: Path, kind: str) -> None:
+    """Record in the session metadata which artifacts were dropped. Caller holds the session lock."""
+    if not metadata_path(session_dir).exists():
+        return
+    metadata = load_metadata(session_dir)
+    evicted = metadata.setdefault("evictedArtifacts", [])
+    if kind not in evicted:
+        evicted.append(kind)
+        save_metadata(session_dir, metadata)
+
+
+storage = StorageManager()
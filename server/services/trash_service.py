@@ -0,0 +1,168 @@
+"""
+Instant session deletion.
+Deleting a session renames its folder into TRASH_DIR (on the same filesystem,
+so the rename is atomic and O(1)) and returns; a background reaper thread then
+removes the trash at a bounded rate so a large deletion does not starve
+inference of I/O. Trash is just a folder tree, whatever state a crash leaves it
+in, so the reaper resumes it at startup; one reaper per instance holds a lock.
+"""
+
+import fcntl
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from core.config import BASE_DIR, TRASH_DIR, TRASH_REAP_MB_PER_SECOND
+from core.logger import setup_logger
+from services import image_index
+
+logger = setup_logger("trash_service", "logs/trash_service.log")
+
+REAPER_LOCK_FILENAME = ".reaper.lock"
+# Seconds between trash scans when nothing was deleted in this process
+REAP_POLL_INTERVAL = 30.0
+# Each file removal is charged at least this many bytes, so trees of tiny files are paced too
+MIN_FILE_COST = 4096
+
+_wake = threading.Event()
+_reaper: Optional[threading.Thread] = None
+_reaper_lock = threading.Lock()
+
+
+def _session_id(entry: Path) -> str:
+    """Session id of a trash entry named `<session_id>.<token>`."""
+    return entry.name.rsplit(".", 1)[0]
+
+
+def trash_session(session_id: str) -> bool:
+    """
+    Atomically move a session folder into the trash and drop it from the image index.
+
+    Returns:
+        bool: False if the session folder does not exist
+    """
+    session_dir = BASE_DIR / session_id
+    TRASH_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        os.rename(session_dir, TRASH_DIR / f"{session_id}.{uuid.uuid4().hex}")
+    except FileNotFoundError:
+        return False
+    image_index.remove_session(session_id)
+    _wake.set()
+    logger.info(f"Moved session {session_id} to trash")
+    return True
+
+
+class _Pacer:
+    """Sleeps as needed to keep removals under `rate` bytes per second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.spent = 0
+
+    def charge(self, nbytes: int) -> None:
+        self.spent += max(nbytes, MIN_FILE_COST)
+        ahead = self.spent / self.rate - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def reap_entry(entry: Path, pacer: _Pacer) -> int:
+    """Remove one trash entry bottom-up; tolerates files already gone. Returns bytes freed."""
+    freed = 0
+    if not entry.is_dir() or entry.is_symlink():
+        try:
+            freed = entry.lstat().st_blocks * 512
+            entry.unlink()
+        except FileNotFoundError:
+            pass
+        return freed
+    for root, dirs, files in os.walk(entry, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                size = os.lstat(path).st_blocks * 512
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            freed += size
+            pacer.charge(size)
+        for name in dirs:
+            path = os.path.join(root, name)
+            try:
+                if os.path.islink(path):
+                    os.unlink(path)
+                else:
+                    os.rmdir(path)
+            except FileNotFoundError:
+                pass
+    try:
+        os.rmdir(entry)
+    except FileNotFoundError:
+        pass
+    return freed
+
+
+def reap(rate_mb: float = TRASH_REAP_MB_PER_SECOND) -> int:
+    """Remove everything currently in the trash. Returns bytes freed."""
+    if not TRASH_DIR.exists():
+        return 0
+    pacer = _Pacer(rate_mb * 1024 * 1024)
+    freed = 0
+    for entry in sorted(TRASH_DIR.iterdir()):
+        if entry.name == REAPER_LOCK_FILENAME:
+            continue
+        try:
+            freed += reap_entry(entry, pacer)
+        except OSError as e:
+            logger.error(f"Could not remove trash entry {entry.name}: {e}")
+    return freed
+
+
+def recover() -> int:
+    """
+    Startup pass over trash left by a crash or restart: drop the sessions from
+    the image index again (the crash may have come between rename and index
+    update). The reaper removes the files. Returns the number of entries found.
+    """
+    if not TRASH_DIR.exists():
+        return 0
+    entries = [e for e in TRASH_DIR.iterdir() if e.name != REAPER_LOCK_FILENAME]
+    for entry in entries:
+        try:
+            image_index.remove_session(_session_id(entry))
+        except Exception as e:
+            logger.warning(f"Could not drop {entry.name} from the image index: {e}")
+    if entries:
+        logger.info(f"Recovered {len(entries)} trash entries left from a previous run")
+    return len(entries)
+
+
+def _reaper_loop() -> None:
+    TRASH_DIR.mkdir(parents=True, exist_ok=True)
+    with open(TRASH_DIR / REAPER_LOCK_FILENAME, "a") as lock_file:
+        # Only one reaper per instance; the others stay idle
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        recover()
+        while True:
+            _wake.clear()
+            try:
+                freed = reap()
+                if freed:
+                    logger.info(f"Reaped {freed / 1e6:.1f} MB of deleted sessions")
+            except Exception as e:
+                logger.error(f"Trash reaper pass failed: {e}")
+            _wake.wait(REAP_POLL_INTERVAL)
+
+
+def start_reaper() -> None:
+    """Start the background reaper thread of this process (idempotent)."""
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None or not _reaper.is_alive():
+            _reaper = threading.Thread(target=_reaper_loop, name="trash-reaper", daemon=True)
+            _reaper.start()
@@ -0,0 +1,459 @@
+"""
+Resumable chunked uploads for the Dugong Classification system.
+A client announces the files of a batch, then PUTs fixed-size chunks at their
+offsets in any order (and retries them freely); each file is assembled in place
+under the session's `images/` folder and handed to inference as soon as its last
+chunk arrives, so a dropped connection only costs the chunks in flight.
+
+State of an upload lives on disk so any worker process can serve any request:
+    <session>/.uploads/<upload_id>/manifest.json   announced files and chunk size
+    <session>/.uploads/<upload_id>/<index>.chunks  one byte per chunk, 1 = received
+    <session>/.uploads/<upload_id>/<index>.state   inference of the completed file:
+                                                   queued (by which process), done or failed
+    <session>/images/.<name>.<upload_id>.part      the file being assembled
+
+Completed files are queued in memory by the process that received their last
+chunk. finalize_upload queues them again if that process is gone, so a restart
+or crash does not leave them unprocessed.
+
+Orthomosaic TIFFs are assembled under `<session>/mosaics/` instead and run
+through the windowed detector (services/mosaic_service.py); videos go to
+`<session>/videos/` and are sampled frame by frame (services/video_service.py).
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import psutil
+
+from core.config import (
+    ALLOWED_EXTENSIONS,
+    BASE_DIR,
+    MAX_FILE_SIZE,
+    MOSAIC_EXTENSIONS,
+    MOSAIC_MAX_FILE_SIZE,
+    UPLOAD_BATCH_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_MAX_FILES,
+    VIDEO_EXTENSIONS,
+    VIDEO_MAX_FILE_SIZE,
+)
+from core.logger import setup_logger
+from services.metadata_service import touch_session
+from services.mosaic_service import MOSAICS_DIRNAME, process_session_mosaic
+from services.inference_scheduler import submit_images
+from services.video_service import VIDEOS_DIRNAME, process_session_video
+
+logger = setup_logger("upload_service", "logs/upload_service.log")
+
+UPLOADS_DIRNAME = ".uploads"
+MANIFEST_FILENAME = "manifest.json"
+LOCK_FILENAME = ".lock"
+MIN_CHUNK_SIZE = 64 * 1024
+# Seconds between last_activity refreshes while chunks arrive
+TOUCH_INTERVAL = 30.0
+
+
+class UploadError(ValueError):
+    """Raised for requests that do not fit the announced upload."""
+
+
+class UploadNotFound(UploadError):
+    """Raised when the upload id is unknown (never created, finalized or expired)."""
+
+
+def _upload_dir(session_id: str, upload_id: str) -> Path:
+    if not upload_id.isalnum():
+        raise UploadNotFound(f"Unknown upload {upload_id}")
+    return BASE_DIR / session_id / UPLOADS_DIRNAME / upload_id
+
+
+def _is_mosaic(name: str) -> bool:
+    return Path(name).suffix.lower() in MOSAIC_EXTENSIONS
+
+
+def _is_video(name: str) -> bool:
+    return Path(name).suffix.lower() in VIDEO_EXTENSIONS
+
+
+def _target_dir(session_id: str, name: str) -> Path:
+    if _is_mosaic(name):
+        return BASE_DIR / session_id / MOSAICS_DIRNAME
+    if _is_video(name):
+        return BASE_DIR / session_id / VIDEOS_DIRNAME
+    return BASE_DIR / session_id / "images"
+
+
+def _part_path(session_id: str, upload_id: str, name: str) -> Path:
+    return _target_dir(session_id, name) / f".{name}.{upload_id}.part"
+
+
+@contextmanager
+def _locked(upload_dir: Path):
+    """Serialise chunk bookkeeping of one upload across threads and processes."""
+    with open(upload_dir / LOCK_FILENAME, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _load_manifest(upload_dir: Path) -> dict:
+    try:
+        with open(upload_dir / MANIFEST_FILENAME, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadNotFound(f"Unknown upload {upload_dir.name}")
+
+
+def _chunk_count(size: int, chunk_size: int) -> int:
+    return max(1, -(-size // chunk_size))
+
+
+def create_upload(session_id: str, files: List[Tuple[str, int]], chunk_size: Optional[int] = None) -> dict:
+    """
+    Announce the files of a new upload and pre-allocate them in the session folder.
+
+    Args:
+        session_id: Session identifier
+        files: (file name, size in bytes) for every file of the batch
+        chunk_size: Requested chunk size; clamped to [64 KiB, UPLOAD_CHUNK_SIZE]
+
+    Returns:
+        dict: Upload id, chunk size and the chunk count of every file
+    """
+    if not files:
+        raise UploadError("No files announced")
+    if len(files) > UPLOAD_MAX_FILES:
+        raise UploadError(f"At most {UPLOAD_MAX_FILES} files per upload")
+    chunk_size = min(max(chunk_size or UPLOAD_CHUNK_SIZE, MIN_CHUNK_SIZE), UPLOAD_CHUNK_SIZE)
+
+    entries, seen = [], set()
+    for name, size in files:
+        name = Path(name).name
+        suffix = Path(name).suffix.lower()
+        if not name or name.startswith(".") or suffix not in ALLOWED_EXTENSIONS | MOSAIC_EXTENSIONS | VIDEO_EXTENSIONS:
+            raise UploadError(f"Unsupported file: {name or '<empty>'}")
+        if name in seen:
+            raise UploadError(f"Duplicate file name: {name}")
+        max_size = MAX_FILE_SIZE
+        if _is_mosaic(name):
+            max_size = MOSAIC_MAX_FILE_SIZE
+        elif _is_video(name):
+            max_size = VIDEO_MAX_FILE_SIZE
+        if size <= 0 or size > max_size:
+            raise UploadError(f"{name}: size must be between 1 byte and {max_size} bytes")
+        seen.add(name)
+        entries.append({"name": name, "size": size, "chunks": _chunk_count(size, chunk_size)})
+
+    upload_id = uuid.uuid4().hex
+    upload_dir = _upload_dir(session_id, upload_id)
+    upload_dir.mkdir(parents=True)
+    # Sessions without metadata, or idle for too long, are expired by the cleanup task
+    touch_session(BASE_DIR / session_id)
+    for index, entry in enumerate(entries):
+        _target_dir(session_id, entry["name"]).mkdir(parents=True, exist_ok=True)
+        with open(upload_dir / f"{index}.chunks", "wb") as f:
+            f.write(bytes(entry["chunks"]))
+        with open(_part_path(session_id, upload_id, entry["name"]), "wb") as f:
+            f.truncate(entry["size"])
+
+    manifest = {
+        "uploadId": upload_id,
+        "sessionId": session_id,
+        "chunkSize": chunk_size,
+        "created": time.time(),
+        "files": entries,
+    }
+    with open(upload_dir / MANIFEST_FILENAME, "w") as f:
+        json.dump(manifest, f, indent=4)
+    logger.info(f"Created upload {upload_id} for {session_id}: {len(entries)} files, {chunk_size} byte chunks")
+    return {**manifest, "files": [{"index": i, **e} for i, e in enumerate(entries)]}
+
+
+def write_chunk(session_id: str, upload_id: str, index: int, offset: int, data: bytes,
+                sha256: Optional[str] = None) -> dict:
+    """
+    Store one chunk of a file. Chunks that were already received are acknowledged
+    without being written again, so clients can blindly retry after a timeout.
+    When the last chunk of a file lands, the file is moved into place and queued
+    for inference.
+
+    Args:
+        session_id: Session identifier
+        upload_id: Upload identifier from create_upload
+        index: File index in the manifest
+        offset: Byte offset of the chunk; must be a multiple of the chunk size
+        data: Chunk bytes; must be exactly one chunk (shorter only at the end of the file)
+        sha256: Optional hex digest of `data`, checked before anything is written
+
+    Returns:
+        dict: Whether the chunk was a duplicate and whether the file is complete
+    """
+    upload_dir = _upload_dir(session_id, upload_id)
+    manifest = _load_manifest(upload_dir)
+    if not 0 <= index < len(manifest["files"]):
+        raise UploadError(f"No file with index {index}")
+    entry = manifest["files"][index]
+    chunk_size = manifest["chunkSize"]
+    if offset < 0 or offset % chunk_size or offset >= entry["size"]:
+        raise UploadError(f"Offset {offset} is not a chunk boundary of {entry['name']}")
+    expected = min(chunk_size, entry["size"] - offset)
+    if len(data) != expected:
+        raise UploadError(f"Chunk at {offset} of {entry['name']} must be {expected} bytes, got {len(data)}")
+    if sha256 and hashlib.sha256(data).hexdigest() != sha256.lower():
+        raise UploadError(f"Checksum mismatch for chunk at {offset} of {entry['name']}")
+
+    # A large file can take longer than the session expiry to arrive
+    touch_session(BASE_DIR / session_id, TOUCH_INTERVAL)
+
+    chunk = offset // chunk_size
+    bitmap_path = upload_dir / f"{index}.chunks"
+    with open(bitmap_path, "rb") as bitmap:
+        if os.pread(bitmap.fileno(), 1, chunk) == b"\x01":
+            return {"duplicate": True, "fileComplete": _is_complete(bitmap_path)}
+
+    part = _part_path(session_id, upload_id, entry["name"])
+    try:
+        fd = os.open(part, os.O_WRONLY)
+    except FileNotFoundError:
+        # A concurrent retry of this chunk completed the file and moved it into place
+        return {"duplicate": True, "fileComplete": True}
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+    with _locked(upload_dir):
+        with open(bitmap_path, "r+b") as bitmap:
+            os.pwrite(bitmap.fileno(), b"\x01", chunk)
+        complete = _is_complete(bitmap_path)
+        if complete and part.exists():
+            _complete_file(session_id, upload_dir, index, entry["name"])
+    return {"duplicate": False, "fileComplete": complete}
+
+
+def _complete_file(session_id: str, upload_dir: Path, index: int, name: str) -> None:
+    """Move an assembled file into place and queue it for inference. Caller holds the upload lock."""
+    part = _part_path(session_id, upload_dir.name, name)
+    target = _target_dir(session_id, name) / name
+    if part.exists():
+        os.replace(part, target)
+    _write_state(upload_dir, index, {"state": "queued", "host": socket.gethostname(), "pid": os.getpid()})
+    _enqueue(session_id, target, (upload_dir, index))
+    logger.info(f"Upload {upload_dir.name}: {name} complete, queued for inference")
+
+
+def _write_state(upload_dir: Path, index: int, state: dict) -> None:
+    path = upload_dir / f"{index}.state"
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({**state, "at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def _read_state(upload_dir: Path, index: int) -> Optional[dict]:
+    try:
+        with open(upload_dir / f"{index}.state", "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _is_orphaned(upload_dir: Path, index: int, state: dict) -> bool:
+    """Whether a queued file's process is gone (or has forgotten it), so nobody will run it."""
+    if state.get("host") != socket.gethostname():
+        return False  # cannot tell for another node; its own finalize calls recover it
+    if state.get("pid") != os.getpid():
+        return not psutil.pid_exists(state.get("pid") or 0)
+    with _worker_lock:
+        return (str(upload_dir), index) not in _inflight
+
+
+def _is_complete(bitmap_path: Path) -> bool:
+    return b"\x00" not in bitmap_path.read_bytes()
+
+
+def _missing_chunks(bitmap_path: Path) -> List[int]:
+    return [i for i, received in enumerate(bitmap_path.read_bytes()) if not received]
+
+
+def upload_status(session_id: str, upload_id: str) -> dict:
+    """
+    Received/missing chunks per file, for resuming an interrupted upload, and
+    which completed files have been processed by inference (or failed it, with
+    the error).
+    """
+    upload_dir = _upload_dir(session_id, upload_id)
+    manifest = _load_manifest(upload_dir)
+    files = []
+    for index, entry in enumerate(manifest["files"]):
+        missing = _missing_chunks(upload_dir / f"{index}.chunks")
+        state = _read_state(upload_dir, index) or {}
+        files.append({
+            "index": index,
+            "name": entry["name"],
+            "size": entry["size"],
+            "chunks": entry["chunks"],
+            "missingChunks": missing,
+            "complete": not missing,
+            "processed": state.get("state") == "done",
+            "error": state.get("error"),
+        })
+    return {
+        "uploadId": upload_id,
+        "chunkSize": manifest["chunkSize"],
+        "files": files,
+        "complete": all(f["complete"] for f in files),
+        "failed": [f["name"] for f in files if f["error"]],
+    }
+
+
+def _requeue_orphans(session_id: str, upload_id: str) -> None:
+    """Queue complete files whose inference was lost with the process that queued them."""
+    upload_dir = _upload_dir(session_id, upload_id)
+    manifest = _load_manifest(upload_dir)
+    with _locked(upload_dir):
+        for index, entry in enumerate(manifest["files"]):
+            if not _is_complete(upload_dir / f"{index}.chunks"):
+                continue
+            state = _read_state(upload_dir, index)
+            if state is not None and (state["state"] != "queued" or not _is_orphaned(upload_dir, index, state)):
+                continue
+            logger.warning(f"Upload {upload_id}: {entry['name']} was never processed; queueing it again")
+            _complete_file(session_id, upload_dir, index, entry["name"])
+
+
+def finalize_upload(session_id: str, upload_id: str) -> dict:
+    """
+    Close an upload once every chunk has arrived. Safe to call repeatedly: files
+    whose inference was lost (its process exited) are queued again, and the
+    bookkeeping is dropped only once every file has been processed or has
+    failed, so clients can poll this until `processed` is true.
+
+    Returns:
+        dict: Upload status plus `processed`; `complete` is False while chunks
+              are missing, and `failed` lists the files inference failed on
+    """
+    _requeue_orphans(session_id, upload_id)
+    status = upload_status(session_id, upload_id)
+    status["processed"] = status["complete"] and all(f["processed"] or f["error"] for f in status["files"])
+    if status["processed"]:
+        shutil.rmtree(_upload_dir(session_id, upload_id), ignore_errors=True)
+        logger.info(f"Finalized upload {upload_id} for {session_id}")
+    return status
+
+
+# -- inference of completed files -------------------------------------------
+
+# (upload folder, file index) of a completed file
+FileKey = Tuple[Path, int]
+
+_ready: "queue.Queue" = queue.Queue()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+# Files queued by this process whose inference has not finished
+_inflight: Set[Tuple[str, int]] = set()
+
+
+def _enqueue(session_id: str, path: Path, key: FileKey) -> None:
+    global _worker
+    with _worker_lock:
+        _inflight.add((str(key[0]), key[1]))
+        _ready.put((session_id, path, key))
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_infer_worker, name="upload-infer", daemon=True)
+            _worker.start()
+
+
+def _record(keys: List[FileKey], error: Optional[str] = None) -> None:
+    """Record the inference outcome of completed files in their upload's state."""
+    for upload_dir, index in keys:
+        with _worker_lock:
+            _inflight.discard((str(upload_dir), index))
+        if not upload_dir.is_dir():
+            continue  # finalized or evicted meanwhile
+        try:
+            _write_state(upload_dir, index, {"state": "failed", "error": error} if error else {"state": "done"})
+        except OSError as e:
+            logger.warning(f"Could not record the result of {upload_dir.name}/{index}: {e}")
+
+
+def _record_future(session_id: str, keys: List[FileKey], future) -> None:
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Inference failed for uploaded files in {session_id}: {error}")
+    _record(keys, f"{type(error).__name__}: {error}" if error is not None else None)
+
+
+def _run_mosaic(session_id: str, path: Path, key: FileKey) -> None:
+    try:
+        process_session_mosaic(session_id, path)
+    except Exception as e:
+        logger.error(f"Mosaic processing failed for {path.name} in {session_id}: {e}")
+        _record([key], f"{type(e).__name__}: {e}")
+    else:
+        _record([key])
+
+
+def _run_video(session_id: str, path: Path, key: FileKey) -> None:
+    try:
+        process_session_video(session_id, path)
+    except Exception as e:
+        logger.error(f"Video processing failed for {path.name} in {session_id}: {e}")
+        _record([key], f"{type(e).__name__}: {e}")
+    else:
+        _record([key])
+
+
+def _infer_worker() -> None:
+    """
+    Hand completed files to the inference scheduler. Files that complete close
+    together are grouped (per session, up to UPLOAD_BATCH_SIZE) into one job;
+    mosaics and videos get their own thread, whose detector calls are fair-queued too.
+    """
+    while True:
+        pending: Dict[str, List[Tuple[Path, FileKey]]] = {}
+        session_id, path, key = _ready.get()
+        pending.setdefault(session_id, []).append((path, key))
+        while sum(len(files) for files in pending.values()) < UPLOAD_BATCH_SIZE:
+            try:
+                session_id, path, key = _ready.get_nowait()
+            except queue.Empty:
+                break
+            pending.setdefault(session_id, []).append((path, key))
+
+        for session_id, files in pending.items():
+            _record([key for path, key in files if not path.exists()], "File was deleted before it was processed")
+            files = [(path, key) for path, key in files if path.exists()]
+            images = [(p, k) for p, k in files if not _is_mosaic(p.name) and not _is_video(p.name)]
+            if images:
+                try:
+                    future = submit_images(session_id, [p for p, _ in images])
+                except Exception as e:
+                    logger.error(f"Could not queue uploaded files in {session_id}: {e}")
+                    _record([k for _, k in images], f"{type(e).__name__}: {e}")
+                else:
+                    future.add_done_callback(
+                        lambda f, s=session_id, keys=[k for _, k in images]: _record_future(s, keys, f)
+                    )
+            for mosaic, key in ((p, k) for p, k in files if _is_mosaic(p.name)):
+                threading.Thread(
+                    target=_run_mosaic, args=(session_id, mosaic, key), name=f"mosaic-{mosaic.name}", daemon=True
+                ).start()
+            for video, key in ((p, k) for p, k in files if _is_video(p.name)):
+                threading.Thread(
+                    target=_run_video, args=(session_id, video, key), name=f"video-{video.name}", daemon=True
+                ).start()
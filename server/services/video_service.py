@@ -0,0 +1,382 @@
+"""
+Detection on survey videos.
+The video is decoded as a stream with cv2.VideoCapture and only sampled frames
+are kept, a detector batch at a time, so memory does not grow with its length.
+Frames are sampled at a fixed interval, or whenever the camera has moved far
+enough that less than the requested overlap remains with the previous sample;
+camera motion is estimated by phase correlation on small grayscale copies of
+frames a fraction of a second apart. The same motion estimate shifts each
+sample's boxes onto the next sample, where an overlapping box is the same animal
+seen again, which gives de-duplicated per-video counts.
+
+Results of a session video `<session>/videos/<name>`:
+    <session>/detections_video/     columnar boxes (DetectionStore), one record per sampled frame
+    <session>/videos/<name>.frames.json
+                                    per-frame counts (see load_video_frames)
+    metadata["videos"][<name>]      unique and peak counts, sampling details and progress
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core.config import (
+    BASE_DIR,
+    VIDEO_BATCH_SIZE,
+    VIDEO_SAMPLE_INTERVAL,
+    VIDEO_SAMPLE_OVERLAP,
+    VIDEO_SAMPLING,
+)
+from core.logger import setup_logger
+from services.detection_store import DetectionStore, ImageDetections, from_result
+from services.metadata_service import load_metadata, save_metadata, session_lock
+from services.postprocess import PostprocessParams, count_classes, postprocess_batch
+from services.inference_scheduler import scheduler
+from services.reprocess_service import session_params
+
+logger = setup_logger("video_service", "logs/video_service.log")
+
+VIDEOS_DIRNAME = "videos"
+VIDEO_STORE_DIRNAME = "detections_video"
+# Per-frame counts of a video, kept out of the session metadata that every request loads
+FRAMES_SUFFIX = ".frames.json"
+SAMPLING_MODES = ("interval", "overlap")
+# Seconds between the frames compared to follow camera motion
+MOTION_CHECK_INTERVAL = 0.25
+# Width of the grayscale copies used for motion estimation
+MOTION_WIDTH = 320
+# Phase correlation peaks below this are not trusted (open water, motion blur)
+MIN_MOTION_RESPONSE = 0.05
+# IoU between a motion-shifted box of the previous sample and a box of the next one
+# above which both are taken to be the same animal
+TRACK_IOU = 0.3
+# Seconds between progress updates (which also keep the session from expiring)
+PROGRESS_INTERVAL = 10.0
+
+
+class VideoError(ValueError):
+    """Raised for files OpenCV cannot decode as a video."""
+
+
+class SampledFrame(NamedTuple):
+    """A frame picked for detection; `shift` is the camera motion in pixels since
+    the previous sample (content moves by +shift), None when it could not be followed."""
+    index: int
+    time: float
+    frame: np.ndarray
+    shift: Optional[Tuple[float, float]]
+
+
+class VideoReader:
+    """Streaming frame access to a video file."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.capture = cv2.VideoCapture(str(path))
+        if not self.capture.isOpened():
+            raise VideoError(f"Cannot decode {path.name} as a video")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS)
+        if not self.fps or self.fps <= 0:
+            self.capture.release()
+            raise VideoError(f"{path.name} has no frame rate")
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def close(self) -> None:
+        self.capture.release()
+
+    def __enter__(self) -> "VideoReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _motion_thumbnail(frame: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Small float32 grayscale copy for phase correlation and its scale to full size."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    scale = gray.shape[1] / MOTION_WIDTH
+    small = cv2.resize(gray, (MOTION_WIDTH, max(1, round(gray.shape[0] / scale))), interpolation=cv2.INTER_AREA)
+    return small.astype(np.float32), scale
+
+
+def estimate_shift(previous: np.ndarray, current: np.ndarray) -> Optional[Tuple[float, float]]:
+    """Translation (dx, dy) of the content from `previous` to `current`, or None if unreliable."""
+    window = cv2.createHanningWindow(previous.shape[::-1], cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(previous, current, window)
+    if response < MIN_MOTION_RESPONSE:
+        return None
+    return dx, dy
+
+
+def iter_samples(
+    reader: VideoReader,
+    mode: str = VIDEO_SAMPLING,
+    interval: float = VIDEO_SAMPLE_INTERVAL,
+    overlap: float = VIDEO_SAMPLE_OVERLAP,
+) -> Iterator[SampledFrame]:
+    """
+    Decode a video frame by frame and yield the frames selected for detection.
+
+    Args:
+        reader: Open video
+        mode: "interval" samples every `interval` seconds; "overlap" samples when
+              less than `overlap` of the previous sample is still in view (and at
+              least every `interval` seconds, so a hovering camera is still sampled)
+        interval: Seconds between samples (the maximum gap in overlap mode)
+        overlap: Fraction of the frame shared with the previous sample in overlap mode
+    """
+    if mode not in SAMPLING_MODES:
+        raise VideoError(f"Unknown sampling mode {mode!r}")
+    interval_frames = max(1, round(reader.fps * interval))
+    check_frames = max(1, round(reader.fps * MOTION_CHECK_INTERVAL))
+    capture = reader.capture
+    last_sample = None
+    last_thumb = None
+    moved = np.zeros(2)
+    followed = True
+    index = -1
+    while True:
+        index += 1
+        due = last_sample is None or index - last_sample >= interval_frames
+        if not due and index % check_frames:
+            # Frames between motion checks are only demuxed/decoded, never converted
+            if not capture.grab():
+                break
+            continue
+        ok, frame = capture.read()
+        if not ok:
+            break
+        thumb, scale = _motion_thumbnail(frame)
+        if last_thumb is not None and last_thumb.shape == thumb.shape:
+            shift = estimate_shift(last_thumb, thumb)
+            if shift is None:
+                followed = False
+            else:
+                moved += np.array(shift) * scale
+        last_thumb = thumb
+        if mode == "overlap" and not due:
+            height, width = frame.shape[:2]
+            due = max(abs(moved[0]) / width, abs(moved[1]) / height) >= 1 - overlap
+        if due:
+            shift = (float(moved[0]), float(moved[1])) if followed and last_sample is not None else None
+            yield SampledFrame(index, index / reader.fps, frame, shift)
+            last_sample = index
+            moved[:] = 0
+            followed = True
+
+
+def _box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU matrix between (N, 4) and (M, 4) xyxy boxes."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def new_detections(
+    previous: Optional[ImageDetections], current: ImageDetections, shift: Optional[Tuple[float, float]]
+) -> np.ndarray:
+    """
+    Mask of the boxes in `current` not already seen in the previous sample.
+    Previous boxes are moved by the camera shift and matched greedily by IoU;
+    without a motion estimate every box counts as new.
+    """
+    boxes = np.asarray(current.boxes, dtype=np.float32).reshape(-1, 4)
+    new = np.ones(len(boxes), dtype=bool)
+    if previous is None or shift is None or not len(boxes) or not len(previous.boxes):
+        return new
+    dx, dy = shift
+    moved = np.asarray(previous.boxes, dtype=np.float32).reshape(-1, 4) + np.array([dx, dy, dx, dy], dtype=np.float32)
+    iou = _box_iou(moved, boxes)
+    while iou.size:
+        i, j = np.unravel_index(iou.argmax(), iou.shape)
+        if iou[i, j] < TRACK_IOU:
+            break
+        new[j] = False
+        iou[i, :] = -1
+        iou[:, j] = -1
+    return new
+
+
+def detect_video(
+    path: Path,
+    params: Optional[PostprocessParams] = None,
+    mode: str = VIDEO_SAMPLING,
+    interval: float = VIDEO_SAMPLE_INTERVAL,
+    overlap: float = VIDEO_SAMPLE_OVERLAP,
+    batch_size: int = VIDEO_BATCH_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+    detector: Optional[Callable[[List[np.ndarray]], list]] = None,
+) -> Tuple[List[ImageDetections], List[dict], dict]:
+    """
+    Sample a video and run the detector and post-processing on the samples.
+    At most `batch_size` decoded frames are held in memory at a time.
+
+    Args:
+        path: Video file
+        params: Post-processing settings (default: PostprocessParams())
+        mode, interval, overlap: Frame sampling, see iter_samples
+        batch_size: Frames per detector call
+        progress: Optional callback(frames decoded, frames total)
+        detector: Runs the detector on a list of frames (default: model_service.detect_windows)
+
+    Returns:
+        (detections, frames, info): detections per sampled frame, per-frame counts,
+        and a summary with the video's properties, unique counts and timing
+    """
+    if detector is None:
+        from services.model_service import detect_windows as detector
+
+    params = params or PostprocessParams()
+    start = time.perf_counter()
+    detections: List[ImageDetections] = []
+    frames: List[dict] = []
+    unique = np.zeros(2, dtype=int)
+    untracked = 0
+    previous: Optional[ImageDetections] = None
+
+    def run_batch(batch: List[SampledFrame]) -> None:
+        nonlocal previous, untracked
+        raw = [from_result(f"{path.stem}_{s.index:06d}", res)
+               for s, res in zip(batch, detector([s.frame for s in batch]))]
+        for sample, det in zip(batch, postprocess_batch(raw, params)):
+            new = new_detections(previous, det, sample.shift)
+            classes = np.asarray(det.classes).astype(int)
+            unique[0] += int(((classes == 0) & new).sum())
+            unique[1] += int(((classes == 1) & new).sum())
+            untracked += previous is not None and sample.shift is None
+            dugong_count, calf_count = count_classes(det)
+            frames.append({
+                "frame": sample.index,
+                "time": round(sample.time, 3),
+                "dugongCount": dugong_count,
+                "motherCalfCount": calf_count,
+                "totalCount": dugong_count + 2 * calf_count,
+                "newAnimals": int(new.sum()),
+            })
+            detections.append(det)
+            previous = det
+
+    with VideoReader(path) as reader:
+        batch: List[SampledFrame] = []
+        for sample in iter_samples(reader, mode, interval, overlap):
+            batch.append(sample)
+            if len(batch) >= batch_size:
+                run_batch(batch)
+                batch = []
+                if progress is not None:
+                    progress(sample.index + 1, reader.frame_count)
+        if batch:
+            run_batch(batch)
+        info = {
+            "fps": round(reader.fps, 3),
+            "frameCount": reader.frame_count,
+            "duration": round(reader.frame_count / reader.fps, 3),
+            "width": reader.width,
+            "height": reader.height,
+        }
+
+    peak = max(frames, key=lambda f: f["totalCount"], default=None)
+    info.update({
+        "sampling": {"mode": mode, "interval": interval, "overlap": overlap if mode == "overlap" else None},
+        "framesSampled": len(frames),
+        "untrackedSamples": untracked,
+        "peakFrame": peak["frame"] if peak else None,
+        "peakTotalCount": peak["totalCount"] if peak else 0,
+        "uniqueDugongCount": int(unique[0]),
+        "uniqueMotherCalfCount": int(unique[1]),
+        "uniqueTotalCount": int(unique[0] + 2 * unique[1]),
+        "elapsedMs": round((time.perf_counter() - start) * 1000, 1),
+    })
+    return detections, frames, info
+
+
+def _update_entry(session_dir: Path, name: str, values: dict) -> None:
+    with session_lock(session_dir):
+        metadata = load_metadata(session_dir)
+        metadata.setdefault("videos", {}).setdefault(name, {}).update(values)
+        metadata["last_activity"] = datetime.utcnow().isoformat()
+        save_metadata(session_dir, metadata)
+
+
+def frames_path(session_dir: Path, name: str) -> Path:
+    return session_dir / VIDEOS_DIRNAME / f"{name}{FRAMES_SUFFIX}"
+
+
+def load_video_frames(session_dir: Path, name: str) -> Optional[List[dict]]:
+    """Per-frame counts of a processed session video; None if it has none."""
+    try:
+        with open(frames_path(session_dir, name), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_frames(session_dir: Path, name: str, frames: List[dict]) -> None:
+    path = frames_path(session_dir, name)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(frames, f)
+    os.replace(tmp_path, path)
+
+
+def process_session_video(session_id: str, path: Path, params: Optional[PostprocessParams] = None) -> dict:
+    """
+    Detect animals in a video saved under `<session>/videos/` and record the
+    result in the session (see module docstring).
+
+    Returns:
+        dict: The video's metadata entry plus its per-frame counts under "frames"
+    """
+    session_dir = BASE_DIR / session_id
+    params = params or session_params(session_dir)
+    _update_entry(session_dir, path.name, {"status": "processing", "framesDecoded": 0})
+    last_update = [time.monotonic()]
+
+    def progress(done: int, total: int) -> None:
+        if time.monotonic() - last_update[0] >= PROGRESS_INTERVAL:
+            last_update[0] = time.monotonic()
+            _update_entry(session_dir, path.name, {"framesDecoded": done, "frameCount": total})
+
+    from services.model_service import detect_windows, registry
+    version = registry.active()
+
+    def detector(frames: List[np.ndarray]) -> list:
+        # One fair-queue job per frame batch, so a long video does not hold the models
+        return scheduler.run(session_id, len(frames), detect_windows, frames, version)
+
+    try:
+        detections, frames, info = detect_video(path, params, progress=progress, detector=detector)
+    except Exception as e:
+        logger.error(f"Video {path.name} in {session_id} failed: {e}")
+        _update_entry(session_dir, path.name, {"status": "failed", "error": str(e)})
+        raise
+
+    if detections:
+        DetectionStore(session_dir, VIDEO_STORE_DIRNAME).append(detections)
+    _save_frames(session_dir, path.name, frames)
+    entry = {
+        **info,
+        "status": "done",
+        "framesDecoded": info["frameCount"],
+        "modelVersion": version.version,
+        "processedAt": datetime.utcnow().isoformat(),
+    }
+    _update_entry(session_dir, path.name, entry)
+    logger.info(
+        f"Video {path.name} in {session_id}: {info['framesSampled']} frames sampled, "
+        f"{info['uniqueTotalCount']} unique animals"
+    )
+    return {**entry, "frames": frames}
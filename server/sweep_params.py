@@ -0,0 +1,298 @@
+# Accuracy vs latency sweep of the inference settings
+"""
+Evaluates combinations of detector input size and post-processing settings
+(conf, iou, max_det, dynamic NMS bounds, nested-box overlap, class-agnostic NMS
+and a minimum box side) on a labelled set, and prints the Pareto front of
+per-image latency against count error and mAP.
+
+The detector runs once per input size, in this process, on the permissive raw
+thresholds the server caches (see services.postprocess); its per-image latency
+is measured there. Every post-processing setting is then applied to those raw
+detections in a pool of single-threaded worker processes, one setting per task,
+which also time the post-processing. Latency of a setting = detector + its
+post-processing, per image.
+
+Ground truth is a YOLO label folder (one `<stem>.txt` per image, `class cx cy w h`
+normalised; a missing file means an empty frame). Counts are animals as in the
+session metadata (dugongs + 2 per mother-calf pair); mAP is per class at IoU 0.5
+and averaged over 0.5:0.95, matched greedily by IoU as in YOLO validation.
+
+Usage (from the `server/` directory):
+    python sweep_params.py /data/val/images --labels /data/val/labels --imgsz 480 640 --conf 0.2 0.3 0.4 --iou 0.3 0.5
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from core.config import ALLOWED_EXTENSIONS
+from core.cpu_topology import available_cpus
+from services.metadata_service import chunked
+
+BATCH_SIZE = 8
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+# Recall points of the interpolated precision-recall curve (COCO style)
+RECALL_POINTS = np.linspace(0, 1, 101)
+
+# Per worker process, set by _init_worker
+_raw: Dict[int, list] = {}
+_truth: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+
+# -- ground truth -----------------------------------------------------------
+
+def load_labels(label: Path, width: int, height: int) -> Tuple[np.ndarray, np.ndarray]:
+    """YOLO label file -> (xyxy pixel boxes, classes)."""
+    rows = []
+    if label.exists():
+        rows = [list(map(float, line.split()[:5])) for line in label.read_text().splitlines() if line.strip()]
+    if not rows:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    values = np.array(rows, dtype=np.float32)
+    cx, cy, w, h = values[:, 1] * width, values[:, 2] * height, values[:, 3] * width, values[:, 4] * height
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    return boxes, values[:, 0].astype(np.int64)
+
+
+def animal_count(classes: np.ndarray) -> int:
+    """Animals as counted in session metadata: a mother-calf pair (class 1) counts as two."""
+    classes = np.asarray(classes)
+    return int((classes == 0).sum() + 2 * (classes == 1).sum())
+
+
+# -- matching and metrics ----------------------------------------------------
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU matrix between (N, 4) and (M, 4) xyxy boxes."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def match_predictions(pred_boxes: np.ndarray, pred_cls: np.ndarray,
+                      gt_boxes: np.ndarray, gt_cls: np.ndarray) -> np.ndarray:
+    """
+    True-positive matrix (predictions x IOU_THRESHOLDS): at each threshold,
+    same-class pairs are matched one to one in order of decreasing IoU.
+    """
+    tp = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(pred_boxes) or not len(gt_boxes):
+        return tp
+    iou = box_iou(gt_boxes, pred_boxes) * (gt_cls[:, None] == pred_cls[None, :])
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        gt_idx, pred_idx = np.nonzero(iou >= threshold)
+        if not len(gt_idx):
+            continue
+        order = iou[gt_idx, pred_idx].argsort()[::-1]
+        gt_idx, pred_idx = gt_idx[order], pred_idx[order]
+        # np.unique keeps the first (highest-IoU) occurrence of each prediction, then of each label
+        _, first = np.unique(pred_idx, return_index=True)
+        first.sort()
+        gt_idx, pred_idx = gt_idx[first], pred_idx[first]
+        _, first = np.unique(gt_idx, return_index=True)
+        tp[pred_idx[first], t] = True
+    return tp
+
+
+def average_precision(tp: np.ndarray, scores: np.ndarray, num_gt: int) -> np.ndarray:
+    """AP at every IoU threshold from stacked true-positive flags of one class."""
+    if not num_gt:
+        return np.full(len(IOU_THRESHOLDS), np.nan)
+    if not len(scores):
+        return np.zeros(len(IOU_THRESHOLDS))
+    tp = tp[np.argsort(-scores, kind="stable")]
+    tpc = np.cumsum(tp, axis=0)
+    fpc = np.cumsum(~tp, axis=0)
+    recall = tpc / num_gt
+    precision = tpc / (tpc + fpc)
+    # Precision envelope (monotonically non-increasing from the right), sampled at RECALL_POINTS
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision, axis=0), axis=0), axis=0)
+    ap = np.zeros(len(IOU_THRESHOLDS))
+    for t in range(len(IOU_THRESHOLDS)):
+        idx = np.searchsorted(recall[:, t], RECALL_POINTS, side="left")
+        valid = idx < len(recall)
+        ap[t] = envelope[idx[valid], t].sum() / len(RECALL_POINTS)
+    return ap
+
+
+def score(detections: list) -> dict:
+    """Count error and mAP of post-processed detections against _truth."""
+    tps, scores, classes, errors = [], [], [], []
+    predicted = expected = 0
+    gt_classes = []
+    for det in detections:
+        gt_boxes, gt_cls = _truth[det.name]
+        boxes = np.asarray(det.boxes, dtype=np.float32).reshape(-1, 4)
+        cls = np.asarray(det.classes).astype(np.int64)
+        tps.append(match_predictions(boxes, cls, gt_boxes, gt_cls))
+        scores.append(np.asarray(det.scores, dtype=np.float32))
+        classes.append(cls)
+        gt_classes.append(gt_cls)
+        pred_count, true_count = animal_count(cls), animal_count(gt_cls)
+        errors.append(abs(pred_count - true_count))
+        predicted += pred_count
+        expected += true_count
+    tp, conf, pred_cls = np.concatenate(tps), np.concatenate(scores), np.concatenate(classes)
+    gt_cls = np.concatenate(gt_classes)
+    per_class = [average_precision(tp[pred_cls == c], conf[pred_cls == c], int((gt_cls == c).sum()))
+                 for c in np.unique(np.concatenate([gt_cls, pred_cls]))]
+    ap = np.nanmean(per_class, axis=0) if per_class and not np.all(np.isnan(per_class)) else np.zeros(len(IOU_THRESHOLDS))
+    return {
+        "countMAE": float(np.mean(errors)),
+        "countBias": (predicted - expected) / expected if expected else None,
+        "mAP50": float(ap[0]),
+        "mAP50_95": float(ap.mean()),
+    }
+
+
+# -- sweep ------------------------------------------------------------------
+
+def remove_small(det, min_side: float):
+    """Drop boxes with a side below `min_side` pixels (remove_small_boxes on cached detections)."""
+    boxes = np.asarray(det.boxes).reshape(-1, 4)
+    keep = np.minimum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) >= min_side
+    return det._replace(boxes=boxes[keep], scores=np.asarray(det.scores)[keep], classes=np.asarray(det.classes)[keep])
+
+
+def _init_worker(raw: Dict[int, list], truth: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> None:
+    import torch
+
+    global _raw, _truth
+    torch.set_num_threads(1)
+    _raw, _truth = raw, truth
+
+
+def evaluate_setting(setting: Tuple[int, dict, float]) -> dict:
+    """Post-process and score the cached raw detections of one input size with one setting."""
+    from services.postprocess import PostprocessParams, postprocess_batch
+
+    imgsz, values, min_side = setting
+    params = PostprocessParams(**values)
+    raw = _raw[imgsz]
+    postprocess_batch(raw[:1], params)  # warm-up
+    start = time.perf_counter()
+    final = []
+    for batch in chunked(raw, BATCH_SIZE):
+        if min_side:
+            batch = [remove_small(det, min_side) for det in batch]
+        final.extend(postprocess_batch(batch, params))
+    elapsed = time.perf_counter() - start
+    return {"imgsz": imgsz, **values, "min_side": min_side,
+            "postprocessMsPerImage": elapsed * 1000 / len(raw), **score(final)}
+
+
+def detect_all(images: List[Path], imgsz: int) -> Tuple[list, float]:
+    """Raw detections of every image at one input size and the detector's ms per image."""
+    from services.detection_store import from_result
+    from services.model_service import detect_batch
+
+    detect_batch(images[:1], imgsz=imgsz)  # warm-up
+    raw = []
+    start = time.perf_counter()
+    for batch in chunked(images, BATCH_SIZE):
+        raw.extend(from_result(p.name, res) for p, res in zip(batch, detect_batch(batch, imgsz=imgsz)))
+    return raw, (time.perf_counter() - start) * 1000 / len(images)
+
+
+def pareto_front(results: List[dict]) -> List[dict]:
+    """Settings no other setting beats on latency, count error and mAP50-95 at once."""
+    points = np.array([[r["msPerImage"], r["countMAE"], -r["mAP50_95"]] for r in results])
+    no_worse = (points[:, None, :] <= points[None, :, :]).all(axis=2)
+    better = (points[:, None, :] < points[None, :, :]).any(axis=2)
+    dominated = (no_worse & better).any(axis=0)
+    return sorted((r for r, d in zip(results, dominated) if not d), key=lambda r: r["msPerImage"])
+
+
+def settings_grid(args) -> List[Tuple[int, dict, float]]:
+    agnostic = {"off": [False], "on": [True], "both": [False, True]}[args.class_agnostic]
+    grid = []
+    for imgsz, conf, iou, max_det, lo, hi, nested, agn, min_side in itertools.product(
+        args.imgsz, args.conf, args.iou, args.max_det, args.nms_iou_min, args.nms_iou_max,
+        args.nested_overlap, agnostic, args.min_side,
+    ):
+        if lo > hi:
+            continue
+        values = {"conf": conf, "iou": iou, "max_det": max_det, "nms_iou_min": lo, "nms_iou_max": hi,
+                  "nested_overlap": nested, "class_agnostic": agn}
+        grid.append((imgsz, values, min_side))
+    return grid
+
+
+def run(args) -> dict:
+    images = sorted(p for p in args.images_dir.iterdir() if p.suffix.lower() in ALLOWED_EXTENSIONS)
+    if args.limit:
+        images = images[:args.limit]
+    if not images:
+        raise SystemExit(f"No images found in {args.images_dir}")
+    labels_dir = args.labels or args.images_dir.parent / "labels"
+    grid = settings_grid(args)
+    print(f"{len(images)} images, labels from {labels_dir}; {len(grid)} settings")
+
+    raw, detector_ms, truth = {}, {}, {}
+    for imgsz in args.imgsz:
+        raw[imgsz], detector_ms[imgsz] = detect_all(images, imgsz)
+        print(f"imgsz {imgsz}: detector {detector_ms[imgsz]:.1f} ms/image")
+    for det in raw[args.imgsz[0]]:
+        truth[det.name] = load_labels(labels_dir / f"{Path(det.name).stem}.txt", det.width, det.height)
+
+    # spawn: the parent already runs torch thread pools, which do not survive fork
+    workers = args.workers or available_cpus()
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    with context.Pool(workers, initializer=_init_worker, initargs=(raw, truth)) as pool:
+        results = pool.map(evaluate_setting, grid, chunksize=max(1, len(grid) // (workers * 4)))
+    print(f"Evaluated {len(results)} settings on {workers} workers in {time.perf_counter() - start:.1f} s")
+    for r in results:
+        r["detectorMsPerImage"] = detector_ms[r["imgsz"]]
+        r["msPerImage"] = r["detectorMsPerImage"] + r["postprocessMsPerImage"]
+
+    front = pareto_front(results)
+    print(f"\nPareto front ({len(front)} of {len(results)} settings):")
+    print(f"{'imgsz':>6} {'conf':>5} {'iou':>5} {'max_det':>7} {'nms lo-hi':>10} {'nested':>6} {'agn':>4} "
+          f"{'min side':>8} {'ms/img':>8} {'count MAE':>9} {'bias':>7} {'mAP50':>6} {'mAP50-95':>8}")
+    for r in front:
+        bias = f"{r['countBias']:+.1%}" if r["countBias"] is not None else "n/a"
+        print(f"{r['imgsz']:>6} {r['conf']:>5.2f} {r['iou']:>5.2f} {r['max_det']:>7} "
+              f"{r['nms_iou_min']:>4.2f}-{r['nms_iou_max']:<5.2f} {r['nested_overlap']:>6.2f} "
+              f"{'y' if r['class_agnostic'] else 'n':>4} {r['min_side']:>8g} {r['msPerImage']:>8.1f} "
+              f"{r['countMAE']:>9.3f} {bias:>7} {r['mAP50']:>6.3f} {r['mAP50_95']:>8.3f}")
+
+    summary = {"images": len(images), "results": results, "pareto": front}
+    if args.json:
+        args.json.write_text(json.dumps(summary, indent=2))
+        print(f"Wrote {args.json}")
+    return summary
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Sweep inference settings for accuracy vs latency")
+    parser.add_argument("images_dir", type=Path, help="Labelled images")
+    parser.add_argument("--labels", type=Path, help="YOLO label folder (default: ../labels next to the images)")
+    parser.add_argument("--imgsz", type=int, nargs="+", default=[640], help="Detector input sizes")
+    parser.add_argument("--conf", type=float, nargs="+", default=[0.3])
+    parser.add_argument("--iou", type=float, nargs="+", default=[0.3])
+    parser.add_argument("--max-det", type=int, nargs="+", default=[1000])
+    parser.add_argument("--nms-iou-min", type=float, nargs="+", default=[0.1])
+    parser.add_argument("--nms-iou-max", type=float, nargs="+", default=[0.6])
+    parser.add_argument("--nested-overlap", type=float, nargs="+", default=[0.8])
+    parser.add_argument("--class-agnostic", choices=["off", "on", "both"], default="off")
+    parser.add_argument("--min-side", type=float, nargs="+", default=[0],
+                        help="Drop boxes with a side below this many pixels (0 = off)")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (default: usable CPUs)")
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N images")
+    parser.add_argument("--json", type=Path, help="Write all results and the front to this file")
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
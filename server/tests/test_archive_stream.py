@@ -0,0 +1,153 @@
+"""The streaming ZIP/TAR reader must extract what zipfile/tarfile would, from a body fed in chunks."""
+import io
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+from services import archive_service
+from services.archive_service import ArchiveError, BodyStream, extract_images, start_archive_stream
+
+
+class _Unseekable(io.RawIOBase):
+    """Write-only sink without tell/seek, so zipfile writes data descriptors."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.buffer.write(b)
+
+
+def image_bytes(i: int, size: int = 5000) -> bytes:
+    return bytes((i * 7 + j) % 251 for j in range(size))
+
+
+def make_zip(entries, compression=zipfile.ZIP_DEFLATED, streamed=False) -> bytes:
+    sink = _Unseekable() if streamed else io.BytesIO()
+    with zipfile.ZipFile(sink, "w", compression=compression) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+    return (sink.buffer if streamed else sink).getvalue()
+
+
+def make_tar(entries, mode="w") -> bytes:
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode=mode) as archive:
+        for name, data in entries:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+
+def feed(stream: BodyStream, body: bytes, chunk_size: int = 4096) -> threading.Thread:
+    """Push the body from another thread, as the route does from the event loop."""
+
+    def produce():
+        for start in range(0, len(body), chunk_size):
+            stream.feed(body[start:start + chunk_size])
+        stream.finish()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    return producer
+
+
+def extract(body: bytes, dest):
+    stream = BodyStream(max_chunks=4)
+    producer = feed(stream, body)
+    seen = []
+    try:
+        result = extract_images(stream, dest, seen.append)
+    finally:
+        stream.abort()
+        producer.join(timeout=10)
+    assert not producer.is_alive()
+    return result, seen
+
+
+ENTRIES = [("photos/a.jpg", image_bytes(1)), ("notes.txt", b"text"), ("b.PNG", image_bytes(2, 300_000)),
+           ("__MACOSX/._a.jpg", b"meta"), ("nested/dir/c.jpeg", image_bytes(3))]
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_zip_members_are_extracted(tmp_path, compression):
+    (extracted, skipped), seen = extract(make_zip(ENTRIES, compression), tmp_path)
+    assert extracted == ["a.jpg", "b.PNG", "c.jpeg"]
+    assert skipped == ["notes.txt", "__MACOSX/._a.jpg"]
+    assert [p.name for p in seen] == extracted
+    for name, data in ENTRIES:
+        if name.rsplit("/", 1)[-1] in extracted:
+            assert (tmp_path / name.rsplit("/", 1)[-1]).read_bytes() == data
+    assert not list(tmp_path.glob(".*.part"))
+
+
+def test_zip_data_descriptors(tmp_path):
+    (extracted, _), _ = extract(make_zip(ENTRIES, streamed=True), tmp_path)
+    assert extracted == ["a.jpg", "b.PNG", "c.jpeg"]
+    assert (tmp_path / "b.PNG").read_bytes() == ENTRIES[2][1]
+
+
+def test_stored_zip_with_data_descriptor_is_rejected(tmp_path):
+    with pytest.raises(ArchiveError):
+        extract(make_zip(ENTRIES, zipfile.ZIP_STORED, streamed=True), tmp_path)
+
+
+def test_duplicate_names_get_unique_paths(tmp_path):
+    body = make_zip([("x/a.jpg", image_bytes(1)), ("y/a.jpg", image_bytes(2))])
+    (extracted, _), _ = extract(body, tmp_path)
+    assert extracted == ["a.jpg", "a_1.jpg"]
+    assert (tmp_path / "a_1.jpg").read_bytes() == image_bytes(2)
+
+
+def test_corrupt_local_header(tmp_path):
+    body = make_zip(ENTRIES[:1], zipfile.ZIP_STORED)
+    end = body.index(b"PK\x01\x02")
+    with pytest.raises(ArchiveError):
+        extract(body[:end] + b"garbage!" + body[end:], tmp_path)
+
+
+def test_truncated_zip(tmp_path):
+    body = make_zip(ENTRIES[:1], zipfile.ZIP_STORED)
+    with pytest.raises(ArchiveError):
+        extract(body[:len(body) // 2], tmp_path)
+
+
+def test_large_central_directory_is_drained(tmp_path):
+    entries = [(f"img_{i}.jpg", image_bytes(i, 16)) for i in range(30_000)]
+    (extracted, _), _ = extract(make_zip(entries, zipfile.ZIP_STORED), tmp_path)
+    assert len(extracted) == len(entries)
+
+
+@pytest.mark.parametrize("mode", ["w", "w:gz", "w:bz2"])
+def test_tar_members_are_extracted(tmp_path, mode):
+    (extracted, skipped), _ = extract(make_tar(ENTRIES, mode), tmp_path)
+    assert extracted == ["a.jpg", "b.PNG", "c.jpeg"]
+    assert skipped == ["notes.txt", "__MACOSX/._a.jpg"]
+    assert (tmp_path / "c.jpeg").read_bytes() == ENTRIES[4][1]
+
+
+def test_archive_stream_batches_and_stops_reading(tmp_path, monkeypatch):
+    batches = []
+    monkeypatch.setattr(archive_service, "BASE_DIR", tmp_path)
+    monkeypatch.setattr(archive_service, "process_images_fairly",
+                        lambda session_id, paths: batches.append([p.name for p in paths]) or
+                        {"processed": [p.name for p in paths], "duplicates": {}})
+
+    stream = BodyStream(max_chunks=2)
+    # Garbage after the central directory is never read: the producer must not block on it
+    body = make_zip(ENTRIES, zipfile.ZIP_DEFLATED) + bytes(1_000_000)
+    producer = feed(stream, body, chunk_size=1024)
+    summary = start_archive_stream(stream, "session", 2).result(timeout=30)
+    producer.join(timeout=10)
+
+    assert not producer.is_alive()
+    assert summary["extracted"] == ["a.jpg", "b.PNG", "c.jpeg"]
+    assert summary["processed"] == summary["extracted"]
+    assert batches == [["a.jpg", "b.PNG"], ["c.jpeg"]]
+    assert summary["errors"] == []
@@ -0,0 +1,59 @@
+"""postprocess_batch must keep exactly the boxes apply_postprocess keeps, image by image."""
+import numpy as np
+import pytest
+
+from benchmark_nms import synthetic_frame
+from services.detection_store import ImageDetections
+from services.postprocess import PostprocessParams, apply_postprocess, postprocess_batch
+
+
+def empty_frame(name: str) -> ImageDetections:
+    return ImageDetections(
+        name, 4000, 3000,
+        np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.uint8),
+    )
+
+
+def assert_same(reference, batched):
+    assert len(reference) == len(batched)
+    for a, b in zip(reference, batched):
+        assert a.name == b.name
+        np.testing.assert_array_equal(np.asarray(a.boxes).reshape(-1, 4), np.asarray(b.boxes).reshape(-1, 4))
+        np.testing.assert_array_equal(a.scores, b.scores)
+        np.testing.assert_array_equal(a.classes, b.classes)
+
+
+@pytest.mark.parametrize("class_agnostic", [False, True])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_batch_matches_per_image(seed, class_agnostic):
+    rng = np.random.default_rng(seed)
+    frames = [synthetic_frame(rng, i) for i in range(48)]
+    params = PostprocessParams(class_agnostic=class_agnostic)
+    assert_same([apply_postprocess(f, params) for f in frames], postprocess_batch(frames, params))
+
+
+@pytest.mark.parametrize("params", [
+    PostprocessParams(conf=0.5, iou=0.5, nms_iou_min=0.2, nms_iou_max=0.4),
+    PostprocessParams(max_det=5),
+    PostprocessParams(nested_overlap=0.5, class_agnostic=True),
+])
+def test_batch_matches_per_image_with_other_settings(params):
+    rng = np.random.default_rng(3)
+    frames = [synthetic_frame(rng, i) for i in range(32)]
+    assert_same([apply_postprocess(f, params) for f in frames], postprocess_batch(frames, params))
+
+
+def test_frames_without_boxes():
+    rng = np.random.default_rng(4)
+    frames = [empty_frame("a.jpg"), synthetic_frame(rng, 1), empty_frame("b.jpg")]
+    params = PostprocessParams()
+    assert_same([apply_postprocess(f, params) for f in frames], postprocess_batch(frames, params))
+    assert postprocess_batch([], params) == []
+    assert_same([apply_postprocess(f, params) for f in frames[::2]], postprocess_batch(frames[::2], params))
+
+
+def test_nothing_above_confidence():
+    rng = np.random.default_rng(5)
+    frames = [synthetic_frame(rng, i) for i in range(4)]
+    batched = postprocess_batch(frames, PostprocessParams(conf=1.0))
+    assert all(len(d.scores) == 0 for d in batched)
@@ -0,0 +1,138 @@
+# Validation of the empty-frame prefilter cascade
+"""
+Runs the low-resolution prefilter (services.model_service.prefilter_batch) over
+a labelled validation set and reports, for each image size / confidence
+setting, how many frames it would skip and how many frames containing animals
+it would wrongly skip. Use it to pick PREFILTER_IMGSZ and PREFILTER_CONF before
+setting PREFILTER_ENABLED=1.
+
+Ground truth is a YOLO label folder (one `<stem>.txt` per image; a missing or
+empty file means an empty frame). With --compare-full the full detector and
+post-processing also run, and misses are counted against its output too.
+
+Usage (from the `server/` directory):
+    python validate_prefilter.py /data/val/images --labels /data/val/labels --imgsz 256 320 416 --conf 0.05 0.1 0.2
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from core.config import ALLOWED_EXTENSIONS
+from services.metadata_service import chunked
+
+BATCH_SIZE = 16
+
+
+def ground_truth_counts(images: List[Path], labels_dir: Path) -> Dict[str, int]:
+    """Number of labelled animals per image name."""
+    counts = {}
+    for path in images:
+        label = labels_dir / f"{path.stem}.txt"
+        counts[path.name] = (
+            sum(1 for line in label.read_text().splitlines() if line.strip()) if label.exists() else 0
+        )
+    return counts
+
+
+def full_pipeline_counts(images: List[Path]) -> Dict[str, int]:
+    """Animals found by the full detector and post-processing chain per image name."""
+    from services.detection_store import from_result
+    from services.model_service import detect_batch
+    from services.postprocess import postprocess_batch
+
+    counts = {}
+    for batch in chunked(images, BATCH_SIZE):
+        raw = [from_result(p.name, res) for p, res in zip(batch, detect_batch(batch))]
+        for det in postprocess_batch(raw):
+            counts[det.name] = len(det.scores)
+    return counts
+
+
+def evaluate(images: List[Path], truth: Dict[str, int], imgsz: int, conf: float,
+             full: Optional[Dict[str, int]] = None) -> dict:
+    """Run the prefilter at one setting and score it against the reference counts."""
+    from services.model_service import prefilter_batch
+
+    prefilter_batch(images[:1], imgsz=imgsz, conf=conf)  # warm-up
+    skipped = set()
+    start = time.perf_counter()
+    for batch in chunked(images, BATCH_SIZE):
+        for path, res in zip(batch, prefilter_batch(batch, imgsz=imgsz, conf=conf)):
+            if not len(res.boxes):
+                skipped.add(path.name)
+    elapsed = time.perf_counter() - start
+
+    empty = {name for name, count in truth.items() if count == 0}
+    missed = sorted(name for name in skipped if truth[name] > 0)
+    result = {
+        "imgsz": imgsz,
+        "conf": conf,
+        "frames": len(images),
+        "emptyFrames": len(empty),
+        "skipped": len(skipped),
+        "skipRate": len(skipped) / len(images),
+        "emptyFramesSkipped": len(skipped & empty),
+        "missedFrames": len(missed),
+        "missedAnimals": sum(truth[name] for name in missed),
+        "missedFrameNames": missed,
+        "prefilterMsPerImage": elapsed * 1000 / len(images),
+    }
+    if full is not None:
+        missed_full = sorted(name for name in skipped if full.get(name, 0) > 0)
+        result["missedVsFullFrames"] = len(missed_full)
+        result["missedVsFullAnimals"] = sum(full[name] for name in missed_full)
+    return result
+
+
+def run(args) -> List[dict]:
+    images = sorted(p for p in args.images_dir.iterdir() if p.suffix.lower() in ALLOWED_EXTENSIONS)
+    if args.limit:
+        images = images[:args.limit]
+    if not images:
+        raise SystemExit(f"No images found in {args.images_dir}")
+    labels_dir = args.labels or args.images_dir.parent / "labels"
+    truth = ground_truth_counts(images, labels_dir)
+    print(f"{len(images)} frames, {sum(1 for c in truth.values() if c == 0)} empty per {labels_dir}")
+
+    full = None
+    if args.compare_full:
+        start = time.perf_counter()
+        full = full_pipeline_counts(images)
+        print(f"Full pipeline: {(time.perf_counter() - start) * 1000 / len(images):.1f} ms/image (detector + post-processing)")
+
+    results = []
+    print(f"{'imgsz':>6} {'conf':>6} {'skip rate':>10} {'empty skipped':>14} {'missed frames':>14} "
+          f"{'missed animals':>15} {'ms/image':>9}")
+    for imgsz in args.imgsz:
+        for conf in args.conf:
+            r = evaluate(images, truth, imgsz, conf, full)
+            results.append(r)
+            print(f"{imgsz:>6} {conf:>6.2f} {r['skipRate']:>9.1%} "
+                  f"{r['emptyFramesSkipped']:>6}/{r['emptyFrames']:<7} {r['missedFrames']:>14} "
+                  f"{r['missedAnimals']:>15} {r['prefilterMsPerImage']:>9.1f}")
+            if r["missedFrameNames"]:
+                print(f"       missed: {', '.join(r['missedFrameNames'][:10])}"
+                      f"{' ...' if len(r['missedFrameNames']) > 10 else ''}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Wrote {args.json}")
+    return results
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Measure skip rate and misses of the empty-frame prefilter")
+    parser.add_argument("images_dir", type=Path, help="Validation images")
+    parser.add_argument("--labels", type=Path, help="YOLO label folder (default: ../labels next to the images)")
+    parser.add_argument("--imgsz", type=int, nargs="+", default=[320])
+    parser.add_argument("--conf", type=float, nargs="+", default=[0.1])
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N images")
+    parser.add_argument("--compare-full", action="store_true", help="Also count misses against the full detector")
+    parser.add_argument("--json", type=Path, help="Write all results to this file")
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
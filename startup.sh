@@ -22,9 +22,15 @@ if ! python3 /app/backend/create_user.py; then
 fi
 
 # 5. Start FastAPI backend in background
+# WEB_CONCURRENCY > 1 runs several workers sharing preloaded model weights
 echo "Starting FastAPI backend..."
 cd /app/backend
-uvicorn main:app --host 0.0.0.0 --port 8000 &
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+  echo "Multi-worker mode: ${WEB_CONCURRENCY} workers with preloaded models"
+  gunicorn -c gunicorn_conf.py main:app &
+else
+  uvicorn main:app --host 0.0.0.0 --port 8000 &
+fi
 
 # 6. Start Nginx (serves frontend and proxies to backend)
 echo "Starting Nginx server..."